@@ -1,13 +1,19 @@
+import hashlib
 import io
 import json
 import os
+import re
 import secrets
 import shutil
+import tempfile
 import time
 import traceback
-import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from queue import Queue
+from urllib.parse import quote
 import pandas as pd
 from PIL import Image
 from flask import (
@@ -21,16 +27,34 @@ from flask import (
     session,
     redirect,
     url_for,
+    copy_current_request_context,
 )
 from flask_compress import Compress
+from werkzeug.utils import secure_filename
 
-from manager.file_manager import clear_folder
-from manager.image_util import convert_pdf_to_images, create_web_optimized_image, clean_image_file
-from manager.omr import OMRSystemFinal
+from manager.image_util import convert_pdf_to_images, convert_tiff_to_images, create_web_optimized_image, \
+    clean_image_file
+from manager.omr import OMRSystemFinal, PROCESSING_MAX_DIMENSION, PREVIEW_MAX_DIMENSION, SheetRejected
 from manager.logging_manager import setup_logging
 from manager.session_manager import get_session_path, get_session_data, get_global_session_list, save_global_session_list, \
-    _cleanup_inactive_sessions_loop, process_data, load_answer_key, save_session_data
+    _cleanup_inactive_sessions_loop, process_data, save_session_data
+from manager.answer_key_manager import load_answer_key, refresh_answer_key, validate_choices
+from manager.roster_manager import StudentRoster, build_roster, forget_session_rosters, get_roster, get_used_student_ids
+from manager.sync_manager import ChangeLog, compact_changes
+from manager.export_manager import EXPORT_FORMATS, iter_export_rows, question_columns, stream_export, stream_zip
+from manager.report_manager import stream_pdf_report
+from manager.upload_manager import MAX_ZIP_ENTRY_SIZE, ZipStreamReader, ChunkedUpload, UploadOffsetMismatch, \
+    CHECKSUM_ALGORITHMS, CHUNKED_UPLOAD_CHUNK_SIZE, MAX_CHUNK_SIZE, MAX_CHUNKED_UPLOAD_SIZE
+from manager.duplicate_manager import DuplicateIndex, apply_duplicate_flags, forget_session_indexes, \
+    get_duplicate_index, remember_duplicate_index, NON_DUPLICATE_IDS
+from manager.watch_manager import HotFolderWatcher, get_watcher, resolve_watch_path, start_watcher, stop_watcher
 from manager.web_util import get_base_url, get_local_ip
+from manager.storage_manager import get_storage
+from manager.compaction_manager import compact_session
+from manager.image_store import content_addressed_name, content_hash, get_image_index, load_layout, save_layout
+from manager.asset_manager import PRECACHE_ASSETS, assets_version, static_fingerprint
+from manager.artifact_writer import get_artifact_writer
+from manager.debug_manager import DEBUG_POLICIES, bundle_name, get_debug_capture
 
 import threading
 
@@ -38,7 +62,18 @@ import threading
 UPLOAD_FOLDER = "uploads"
 DEBUG_FOLDER = "debug_output"
 STATIC_FOLDER = "config"
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "pdf"}
+ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "pdf", "tif", "tiff"}
+MULTIPAGE_EXTENSIONS = {"pdf", "tif", "tiff"}  # ไฟล์ที่ต้องแยกเป็นรูปทีละหน้าก่อนตรวจ
+UPLOAD_CHUNK_SIZE = 256 * 1024  # ขนาดที่อ่านจาก request body ต่อครั้งเมื่ออัปโหลดแบบ stream
+HIGHLIGHTED_FILE_PATTERN = re.compile(r"^(web_)?highlighted_(single|multi)_(.+)\.png$")  # รูปผลตรวจใน debug_output
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{43}$")  # รูปแบบของ secrets.token_urlsafe(32)
+ZIP_GRADE_FLUSH_EVERY = 20  # บันทึกผลตรวจระหว่างอัปโหลด ZIP ทุก ๆ กี่แผ่น
+MAX_REQUEST_SIZE = 64 * 1024 * 1024  # ขนาด request สูงสุด (ไฟล์ใหญ่กว่านี้ให้ใช้ /upload_chunked)
+CAPTURE_JPEG_QUALITY = 0.9  # คุณภาพ JPEG ที่หน้าถ่ายภาพใช้บีบอัดก่อนอัปโหลด (ยังอ่านวงกลมที่ฝนได้ชัด)
+MAX_PREVIEW_SIZE = 1024 * 1024  # รูป preview สำหรับตรวจว่าเห็นกระดาษครบ (ขนาดเล็กเท่านั้น)
+MAX_ZIP_UPLOAD_SIZE = 1024 * 1024 * 1024  # /upload_zip อ่าน body แบบ stream จึงรับไฟล์ใหญ่กว่าได้
+STATIC_MAX_AGE = 3600  # อายุ cache ของไฟล์ที่อาจเปลี่ยนได้ (static ที่ไม่มี fingerprint, รูปต้นฉบับ, debug)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # ไฟล์ที่ URL เปลี่ยนทุกครั้งที่เนื้อหาเปลี่ยน (static ?v=, รูป web_ ที่เขียนครั้งเดียว)
 CLEANUP_THREAD_STARTED = False
 
 app = Flask(__name__)
@@ -64,6 +99,7 @@ compress = Compress(app)
 
 app_logger = setup_logging(app)  # <--- ใช้ระบบ logging ใหม่
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_SIZE
 
 # สร้างโฟลเดอร์ถ้ายังไม่มี
 for folder in [UPLOAD_FOLDER, DEBUG_FOLDER, STATIC_FOLDER]:
@@ -74,49 +110,99 @@ for folder in [UPLOAD_FOLDER, DEBUG_FOLDER, STATIC_FOLDER]:
 class MessageAnnouncer:
     def __init__(self):
         self.listeners = []
+        self._lock = threading.Lock()
 
-    def listen(self):
-        q = Queue(maxsize=5)
-        self.listeners.append(q)
+    def listen(self, session_id=None):
+        q = Queue(maxsize=100)  # รองรับ event ความถี่สูง เช่น ความคืบหน้าการอัปโหลด ZIP
+        with self._lock:
+            self.listeners.append((q, session_id))
         return q
 
-    def announce(self, msg):
-        for i in reversed(range(len(self.listeners))):
-            try:
-                self.listeners[i].put_nowait(msg)
-            except Exception:
-                del self.listeners[i]
+    def announce(self, msg, session_id=None):
+        # ส่งเฉพาะ listener ของ session เดียวกัน (ถ้าไม่ระบุ session จะส่งให้ทุกคน)
+        with self._lock:
+            for i in reversed(range(len(self.listeners))):
+                q, listener_session_id = self.listeners[i]
+                if session_id and listener_session_id and listener_session_id != session_id:
+                    continue
+                try:
+                    q.put_nowait(msg)
+                except Exception:
+                    del self.listeners[i]
 
 
 announcer = MessageAnnouncer()
+change_log = ChangeLog()
 omr_system = OMRSystemFinal()
+# ล็อกการอ่าน-แก้ไข-บันทึก session data (แก้ไขคะแนน และเพิ่มผลลัพธ์ระหว่างอัปโหลด ZIP)
+score_update_lock = threading.Lock()
+
+
+def format_sse_change(entry, session_id):
+    """แปลง entry ของ change log เป็นข้อความ SSE ที่มี id เป็นเลขลำดับ"""
+    payload = {
+        "event": entry["event"],
+        "data": entry["data"],
+        "session_id": session_id,
+        "seq": entry["seq"],
+    }
+    if entry["mode"]:
+        payload["mode"] = entry["mode"]
+    return f"id: {entry['seq']}\ndata: {json.dumps(payload)}\n\n"
+
+
+def publish_change(session_id, event, data=None, mode=None, keys=None):
+    """บันทึกการเปลี่ยนแปลงของ session พร้อมเลขลำดับ และแจ้ง client ผ่าน SSE"""
+    entry = change_log.record(session_id, event, data=data, mode=mode, keys=keys)
+    announcer.announce(msg=format_sse_change(entry, session_id), session_id=session_id)
+    return entry["seq"]
 
 
 def _utcnow_iso():
     return datetime.now().isoformat()
 
+def _touch_session_activity(sid, device_type="unknown"):
+    """อัปเดตเวลาใช้งานล่าสุดของ session เพื่อไม่ให้ถูกลบโดย cleanup thread"""
+    global_sessions = get_global_session_list()
+    active_sessions = global_sessions.get("active_sessions", {})
+
+    if sid not in active_sessions:
+        # Re-register if missing
+        active_sessions[sid] = {
+            "created_at": _utcnow_iso(),
+            "device_type": device_type,
+            "last_activity": _utcnow_iso(),
+        }
+    else:
+        active_sessions[sid]["last_activity"] = _utcnow_iso()
+
+    global_sessions["active_sessions"] = active_sessions
+    save_global_session_list(global_sessions)
+
+
+@contextmanager
+def _session_context(session_id):
+    """request context สำหรับงานเบื้องหลังที่เรียก helper ซึ่งอ่าน session_id จาก flask session"""
+    with app.test_request_context():
+        session["session_id"] = session_id
+        yield
+
+
+def _forget_session_state(session_id):
+    """ล้าง cache ในหน่วยความจำของ session ที่ถูกล้างหรือหมดอายุ (เรียกหลัง publish_change ของ session นั้น)"""
+    change_log.forget(session_id)
+    get_debug_capture().forget(session_id)
+    forget_session_rosters(session_id)
+    forget_session_indexes(session_id)
+
+
 @app.route("/heartbeat", methods=["POST"])
 def heartbeat():
     try:
         if "session_id" not in session:
             return jsonify({"success": False, "error": "No active session"}), 400
 
-        global_sessions = get_global_session_list()
-        active_sessions = global_sessions.get("active_sessions", {})
-        sid = session["session_id"]
-
-        if sid not in active_sessions:
-            # Re-register if missing
-            active_sessions[sid] = {
-                "created_at": _utcnow_iso(),
-                "device_type": session.get("device_type", "unknown"),
-                "last_activity": _utcnow_iso(),
-            }
-        else:
-            active_sessions[sid]["last_activity"] = _utcnow_iso()
-
-        global_sessions["active_sessions"] = active_sessions
-        save_global_session_list(global_sessions)
+        _touch_session_activity(session["session_id"], session.get("device_type", "unknown"))
         return jsonify({"success": True})
     except Exception as e:
         app_logger.error(f"Heartbeat error: {e}")
@@ -125,12 +211,87 @@ def heartbeat():
 
 @app.route("/toggle_debug", methods=["POST"])
 def toggle_debug():
-    """เปิด/ปิด debug mode เพื่อเพิ่มความเร็วในการประมวลผล"""
-    data = request.get_json()
-    debug_enabled = data.get("debug", False)
-    omr_system.debug_mode = debug_enabled
-    app_logger.info(f"Debug mode {'enabled' if debug_enabled else 'disabled'}")
-    return jsonify({"debug_mode": omr_system.debug_mode})
+    """เปิด/ปิดการเก็บข้อมูล debug ของทุกแผ่นใน session นี้ (ไม่กระทบ session อื่น)"""
+    session_id = session.get("session_id")
+    if not session_id:
+        return jsonify({"error": "No active session"}), 400
+    data = request.get_json() or {}
+    debug_enabled = bool(data.get("debug", False))
+    settings = get_debug_capture().configure(session_id, policy="all" if debug_enabled else "off", sample_rate=0)
+    app_logger.info(f"Debug capture {'enabled' if debug_enabled else 'disabled'} for session {session_id}")
+    return jsonify({"debug_mode": debug_enabled, **settings})
+
+
+@app.route("/debug_capture", methods=["GET", "POST"])
+def debug_capture_settings():
+    """
+    นโยบายเก็บ bundle debug ของ session
+    POST {"policy": off|failed|issues|all, "sample_rate": 0-1} เช่น เก็บเฉพาะแผ่นที่ตรวจไม่สำเร็จ + สุ่ม 5% ของแผ่นอื่น
+    GET คืนค่าการตั้งค่าและ URL ของ bundle ที่มีอยู่
+    """
+    session_id = session.get("session_id")
+    if not session_id:
+        return jsonify({"error": "No active session"}), 400
+    debug_capture = get_debug_capture()
+    if request.method == "POST":
+        data = request.get_json() or {}
+        try:
+            settings = debug_capture.configure(session_id, data.get("policy"), data.get("sample_rate"))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e), "policies": DEBUG_POLICIES}), 400
+        app_logger.info(f"Debug capture for session {session_id}: {settings}")
+        return jsonify(settings)
+
+    session_debug_path = get_session_path("debug_output")
+    get_artifact_writer().flush(session_debug_path)
+    return jsonify({
+        **debug_capture.settings(session_id),
+        "policies": DEBUG_POLICIES,
+        "bundles": [
+            f"/debug_output/{session_id}/{name}" for name in debug_capture.list_bundles(session_debug_path)
+        ],
+    })
+
+
+@app.route("/debug_capture/sheet", methods=["POST"])
+def debug_capture_sheet():
+    """
+    ตรวจแผ่นเดียวซ้ำพร้อมเก็บ bundle debug body: {"filename", "mode"}
+    ไม่เปลี่ยนผลตรวจ layout และรูปผลตรวจที่บันทึกไว้ (รูปผลตรวจของรอบนี้อยู่ใน bundle)
+    """
+    data = request.get_json() or {}
+    mode = data.get("mode", "single")
+    filename = secure_filename(data.get("filename", ""))
+    if mode not in ("single", "multi"):
+        return jsonify({"error": f"Unknown mode: {mode}"}), 400
+    answer_key, err = load_answer_key(mode)
+    if err:
+        return jsonify({"error": err}), 400
+    try:
+        session_upload_path = get_session_path("uploads")
+        session_debug_path = get_session_path("debug_output")
+    except ValueError:
+        return jsonify({"error": "No active session"}), 400
+    if not filename or not os.path.isfile(os.path.join(session_upload_path, filename)):
+        return jsonify({"error": "File not found"}), 404
+
+    try:
+        roster = get_roster()
+    except Exception as e:
+        app_logger.warning(f"Could not load student names: {e}")
+        roster = StudentRoster([])
+    with tempfile.TemporaryDirectory(prefix="omr_debug_sheet_") as render_folder:
+        result, _ = _grade_sheet(
+            mode, filename, answer_key, roster, session_upload_path, session_debug_path, session["session_id"],
+            debug_policy="all", render_folder=render_folder,
+        )
+        get_artifact_writer().flush(render_folder)
+    get_artifact_writer().flush(session_debug_path)
+    result.pop("image_url", None)  # รูปของรอบนี้ถูกลบไปพร้อมโฟลเดอร์ชั่วคราว (ดูใน bundle แทน)
+    return jsonify({
+        "result": result,
+        "bundle_url": f"/debug_output/{session['session_id']}/{bundle_name(mode, filename)}",
+    })
 
 
 # === API สำหรับโหมด 1 คำตอบ (Single-Answer) ===
@@ -144,6 +305,7 @@ def upload_answer_key_single():
         config_path = get_session_path("config")
         filepath = os.path.join(config_path, "answer_key_single.csv")
         file.save(filepath)
+        refresh_answer_key("single")
         app_logger.info(
             f"Single mode answer key uploaded for session {session['session_id']}: {file.filename}"
         )
@@ -164,6 +326,7 @@ def save_answer_key_single():
 
         with open(answer_key_path, "w", encoding="utf-8") as f:
             f.write(csv_content)
+        refresh_answer_key("single")
 
         app_logger.info(
             f"Single mode answer key saved for session {session['session_id']}: {filename}"
@@ -183,6 +346,95 @@ def save_answer_key_single():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def _grade_sheet(mode, original_filename, answer_key, roster, session_upload_path, session_debug_path, session_id,
+                 debug_policy=None, render_folder=None):
+    """
+    ตรวจกระดาษคำตอบหนึ่งแผ่น คืนค่า (แถวผลลัพธ์, คำตอบรายข้อสำหรับบันทึก)
+    ถ้าประมวลผลไม่สำเร็จจะคืนค่าแถว ERROR และคำตอบเป็น None
+    เก็บ bundle debug ตามนโยบายของ session (debug_policy บังคับนโยบายเฉพาะแผ่นนี้)
+    render_folder: ตรวจทดลอง เขียนรูปผลตรวจลงโฟลเดอร์นี้แทน debug_output และไม่บันทึก layout
+    """
+    filepath = os.path.join(session_upload_path, original_filename)
+    debug_capture = get_debug_capture()
+    trace = debug_capture.start_trace(session_id, mode, original_filename, policy=debug_policy)
+    try:
+        with open(filepath, "rb") as f:
+            image_bytes = f.read()
+
+        layout = {}
+        student_id, answered_data, h_file = omr_system.find_and_process_sheet(
+            image_bytes,
+            original_filename,
+            mode=mode,
+            single_answer_key=answer_key if mode == "single" else None,
+            multi_answer_key=answer_key if mode == "multi" else None,
+            session_debug_folder=render_folder or session_debug_path,  # ส่ง Path ของ session ปัจจุบัน
+            debug_trace=trace,
+            layout=layout,
+        )
+        if render_folder is None:
+            # วาดรูปผลตรวจใหม่จากตำแหน่งที่ตรวจได้ครั้งนี้ (ไม่ตรวจซ้ำบนรูปที่ถูกบีบอัดภายหลัง)
+            save_layout(session_upload_path, original_filename, mode, layout)
+
+        serializable_answers = {}
+        multiple_answers_count = 0  # นับจำนวนข้อที่กาหลายคำตอบ
+        unreadable_count = 0  # ข้อในคอลัมน์ที่หาเส้นตารางไม่ได้ (ต้องตรวจเอง)
+        for q_num, data in answered_data.items():
+            serializable_answers[q_num] = {
+                "answers": list(data.get("answers", set())),
+                "status": data.get("status", "incorrect"),
+                "has_multiple_answers": data.get("has_multiple_answers", False),
+            }
+            if data.get("unreadable"):
+                serializable_answers[q_num]["unreadable"] = True
+                unreadable_count += 1
+            # ใน multi mode การกาหลายคำตอบเป็นเรื่องปกติ ไม่นับเป็นปัญหา
+            if mode == "single" and data.get("has_multiple_answers", False):
+                multiple_answers_count += 1
+
+        first_name, last_name, score = process_data(student_id, roster.names, answered_data)
+        result = {
+            "student_file": original_filename,
+            "student_id": student_id,
+            "student_name": f"{first_name} {last_name}".strip(),  # แสดงชื่อ+นามสกุลในคอลัมเดียว
+            "fname": first_name,
+            "lname": last_name,
+            "score": score,
+            "total": len(answer_key),
+            "image_url": f"/debug_output/{session_id}/{h_file}",  # ใช้รูปภาพที่บีบอัดแล้ว
+            "multiple_answers_count": multiple_answers_count,  # เพิ่มข้อมูลจำนวนข้อที่กาหลายคำตอบ
+            "unreadable_count": unreadable_count,
+            "has_issues": multiple_answers_count > 0 or unreadable_count > 0,  # apply_duplicate_flags คำนวณใหม่รวมสถานะรหัสซ้ำ
+            "is_duplicate": False,
+        }
+        if unreadable_count:
+            result.update(needs_attention=True, attention_reason=f"อ่านตารางคำตอบไม่ได้ {unreadable_count} ข้อ")
+        if mode == "multi" and any(d.get("status") == "partial" for d in answered_data.values()):
+            result["status"] = "partial"
+        debug_capture.finish(trace, session_debug_path, result)
+        return result, serializable_answers
+    except Exception as e:
+        if isinstance(e, SheetRejected):
+            # รูปที่ไม่ใช่กระดาษคำตอบหรือตรวจเกินเวลา: หยุดแผ่นนี้แล้วตรวจแผ่นถัดไปต่อ
+            app_logger.warning(f"Sheet {original_filename} needs attention ({e.reason}): {e}")
+        else:
+            app_logger.error(
+                f"ERROR processing {original_filename}: {e} | {traceback.format_exc()}"
+            )
+        debug_capture.finish(trace, session_debug_path, error=e)
+        return {
+            "student_file": original_filename,
+            "student_id": "ERROR",
+            "student_name": "ข้อผิดพลาด",
+            "score": "Processing Error",
+            "total": len(answer_key) if answer_key else 0,
+            "image_url": f"/uploads/{session_id}/{original_filename}",
+            "needs_attention": True,  # ต้องให้ผู้ใช้ตรวจสอบ/ตรวจเอง พร้อมสาเหตุ
+            "attention_reason": str(e),
+            "attention_code": getattr(e, "reason", "error"),
+        }, None
+
+
 @app.route("/process_single", methods=["POST"])
 def process_single():
     answer_key, err = load_answer_key("single")
@@ -192,25 +444,14 @@ def process_single():
     try:
         session_upload_path = get_session_path("uploads")
         session_debug_path = get_session_path("debug_output")
-        session_config_path = get_session_path("config")
     except ValueError:
         return jsonify({"error": "No active session"}), 400
 
-    student_list_path = os.path.join(session_config_path, "student_list.csv")
-    student_names = {}
-    if os.path.exists(student_list_path):
-        try:
-            # Read with skipinitialspace to handle spaces after commas
-            df_students = pd.read_csv(student_list_path, header=None, skipinitialspace=True)
-            # Build student_names dict for lookup (first name + last name)
-            student_names = dict(
-                zip(
-                    df_students[0].astype(str).str.strip(),
-                    (df_students[1].astype(str).str.strip(), df_students[2].astype(str).str.strip())
-                )
-            )
-        except Exception as e:
-            app_logger.warning(f"Could not load student names: {e}")
+    try:
+        roster = get_roster()
+    except Exception as e:
+        app_logger.warning(f"Could not load student names: {e}")
+        roster = StudentRoster([])
 
     student_sheets_files = sorted(
         [f for f in os.listdir(session_upload_path) if allowed_file(f)]
@@ -220,11 +461,16 @@ def process_single():
         return jsonify({"error": "No student answer sheets to process"}), 400
 
     results = []
-    seen_student_ids = {}  # ติดตามรหัสนักศึกษาที่เจอแล้ว {student_id: [list of filenames]}
+    duplicate_index = DuplicateIndex()  # ติดตามรหัสนักศึกษาที่เจอแล้ว {student_id: [list of filenames]}
+    image_index = get_image_index(session_upload_path)
+    reshots = {}  # ไฟล์ที่ถ่ายกระดาษแผ่นเดิมซ้ำ -> ไฟล์ที่ใช้เป็นผลตรวจ
 
     session_data = get_session_data()
     session_data["single_detailed_answers"] = {}
 
+    # ตรวจรูปที่ดีที่สุดของแต่ละกลุ่มรูปถ่ายซ้ำก่อน รูปที่เหลือในกลุ่มถูกข้ามเมื่ออ่านได้รหัสและคำตอบเหมือนกัน
+    student_sheets_files = image_index.grading_order(student_sheets_files, _saved_name_of)
+
     for filename in student_sheets_files:
         # ใช้รูปภาพต้นฉบับสำหรับการประมวลผล (ไม่ใช่เวอร์ชันเว็บ)
         original_filename = filename
@@ -237,70 +483,30 @@ def process_single():
             # ถ้ามีเวอร์ชันเว็บอยู่แล้ว ข้ามไฟล์ต้นฉบับ (ป้องกันการประมวลผลซ้ำ)
             continue
             
-        filepath = os.path.join(session_upload_path, original_filename)
-        try:
-            with open(filepath, "rb") as f:
-                image_bytes = f.read()
-
-            student_id, answered_data, h_file = omr_system.find_and_process_sheet(
-                image_bytes,
-                original_filename,
-                mode="single",
-                single_answer_key=answer_key,
-                session_debug_folder=session_debug_path,  # ส่ง Path ของ session ปัจจุบัน
-            )
-
-            serializable_answers = {}
-            multiple_answers_count = 0  # นับจำนวนข้อที่กาหลายคำตอบ
-            for q_num, data in answered_data.items():
-                serializable_answers[q_num] = {
-                    "answers": list(data.get("answers", set())),
-                    "status": data.get("status", "incorrect"),
-                    "has_multiple_answers": data.get("has_multiple_answers", False),
-                }
-                if data.get("has_multiple_answers", False):
-                    multiple_answers_count += 1
-            session_data["single_detailed_answers"][student_id] = serializable_answers
-
-            first_name, last_name, score = process_data(student_id, student_names, answered_data)
-            # ตรวจสอบรหัสซ้ำ
-            is_duplicate = False
-            if str(student_id) in seen_student_ids:
-                is_duplicate = True
-                seen_student_ids[str(student_id)].append(original_filename)
-                app_logger.warning(f"Duplicate student ID detected: {student_id} in files {seen_student_ids[str(student_id)]}")
-            else:
-                seen_student_ids[str(student_id)] = [original_filename]
-            
-            results.append(
-                {
-                    "student_file": original_filename,
-                    "student_id": student_id,
-                    "student_name": f"{first_name} {last_name}".strip(),  # แสดงชื่อ+นามสกุลในคอลัมเดียว
-                    "fname": first_name,
-                    "lname": last_name,
-                    "score": score,
-                    "total": len(answer_key),
-                    "image_url": f"/debug_output/{session['session_id']}/{h_file}",  # ใช้รูปภาพที่บีบอัดแล้ว
-                    "multiple_answers_count": multiple_answers_count,  # เพิ่มข้อมูลจำนวนข้อที่กาหลายคำตอบ
-                    "has_issues": multiple_answers_count > 0 or is_duplicate,  # มีปัญหาหรือไม่ (รวมรหัสซ้ำ)
-                    "is_duplicate": is_duplicate,  # เพิ่มแฟล็กรหัสซ้ำ
-                }
-            )
-        except Exception as e:
-            app_logger.error(
-                f"ERROR processing {original_filename}: {e} | {traceback.format_exc()}"
-            )
-            results.append(
-                {
-                    "student_file": original_filename,
-                    "student_id": "ERROR",
-                    "student_name": "ข้อผิดพลาด",
-                    "score": "Processing Error",
-                    "total": len(answer_key) if answer_key else 0,
-                    "image_url": f"/uploads/{session['session_id']}/{original_filename}",
-                }
+        result, serializable_answers = _grade_sheet(
+            "single", original_filename, answer_key, roster, session_upload_path, session_debug_path, session["session_id"]
+        )
+        if serializable_answers is not None:
+            kept_file, confirmed = _find_reshot(
+                original_filename, result["student_id"], serializable_answers,
+                duplicate_index, session_data["single_detailed_answers"], image_index,
             )
+            if confirmed:
+                reshots[original_filename] = kept_file
+                app_logger.info(f"Skipped re-shot {original_filename} of {kept_file} (student {result['student_id']})")
+                continue
+            if kept_file:
+                _flag_possible_reshot(result, kept_file)
+            session_data["single_detailed_answers"][result["student_id"]] = serializable_answers
+            # ตรวจสอบรหัสซ้ำ (สถานะของทุกแถวในกลุ่มถูกตั้งค่าหลังประมวลผลครบ)
+            duplicate_index.add(original_filename, result["student_id"])
+        results.append(result)
+
+    # ตั้งค่าสถานะรหัสซ้ำของทุกแถวในกลุ่ม (รวมไฟล์แรกที่ใช้รหัสนั้น)
+    for student_id, files in duplicate_index.conflicts().items():
+        app_logger.warning(f"Duplicate student ID detected: {student_id} in files {files}")
+    for result in results:
+        apply_duplicate_flags(result, duplicate_index, "single")
 
     # เรียงผลลัพธ์ตามรหัสนักศึกษาก่อนบันทึก
     # แยกเป็น 2 กลุ่ม: ไม่พบชื่อ/รหัสอ่านไม่ได้ (ไม่ sort) และ พบชื่อ+รหัสปกติ (sort ตามรหัส)
@@ -341,49 +547,18 @@ def process_single():
     # รวมผลลัพธ์: กลุ่มไม่พบชื่อ/รหัสอ่านไม่ได้/มีปัญหาก่อน (ไม่ sort) + กลุ่มพบชื่อ+รหัสปกติ (sort แล้ว)
     results = not_found_group + found_group_sorted
     
+    # รูปผลตรวจถูกเขียนในเบื้องหลัง: รอให้เขียนเสร็จก่อนส่ง URL ให้หน้าเว็บ
+    get_artifact_writer().flush(session_debug_path)
     session_data["single_results"] = results
     save_session_data(session_data)
+    remember_duplicate_index("single", duplicate_index)
+    publish_change(session["session_id"], "results_replaced", mode="single")
 
-    # สร้าง DataFrame สำหรับ export
-    students = []
-    if os.path.exists(student_list_path):
-        try:
-            # df_students is already loaded above
-            for idx, row in df_students.iterrows():
-                student_id = str(row[0]).strip()
-                name = str(row[1]).strip()
-                if name and " " in name:
-                    fname, lname = name.split(" ", 1)
-                else:
-                    fname, lname = name, ""
-                group_code = str(row[2]).strip() if len(row) > 2 else ""
-                students.append({
-                    "student_id": student_id,
-                    "fname": fname,
-                    "lname": lname,
-                    "group_code": group_code
-                })
-        except Exception as e:
-            app_logger.warning(f"Could not build students list: {e}")
-
-    export_rows = []
-    for s in students:
-        # ตรวจสอบว่ามี student_id จริง
-        if "student_id" in s and s["student_id"]:
-            export_rows.append({
-                "student_id": s["student_id"],
-                "fname": s.get("fname", ""),
-                "lname": s.get("lname", ""),
-                "group_code": s.get("group_code", ""),
-                "score": next((r["score"] for r in results if r["student_id"] == s["student_id"]), "")
-            })
-    if not export_rows:
+    # ต้องมีรายชื่อนักศึกษาที่มีรหัสอย่างน้อยหนึ่งคน
+    if not any(roster.by_id):
         return jsonify({"success": False, "error": "ไม่พบ student_id ในรายชื่อ"}), 400
-    df = pd.DataFrame(export_rows)
-    if "student_id" in df.columns:
-        df = df.sort_values(by=["student_id"])
 
-    return jsonify({"results": results})
+    return jsonify({"results": results, "reshots": reshots})
 
 
 # === API สำหรับโหมดหลายคำตอบ (Multi-Answer) ===
@@ -405,6 +580,7 @@ def upload_answer_key_multi():
         config_path = get_session_path("config")
         filepath = os.path.join(config_path, "answer_key_multi.csv")
         file.save(filepath)
+        refresh_answer_key("multi")
         app_logger.info(
             f"Multi mode answer key uploaded for session {session['session_id']}: {file.filename}"
         )
@@ -425,6 +601,7 @@ def save_answer_key_multi():
 
         with open(answer_key_path, "w", encoding="utf-8") as f:
             f.write(csv_content)
+        refresh_answer_key("multi")
 
         app_logger.info(
             f"Multi mode answer key saved for session {session['session_id']}: {filename}"
@@ -453,23 +630,14 @@ def process_multi():
     try:
         session_upload_path = get_session_path("uploads")
         session_debug_path = get_session_path("debug_output")
-        session_config_path = get_session_path("config")
     except ValueError:
         return jsonify({"error": "No active session"}), 400
 
-    student_list_path = os.path.join(session_config_path, "student_list.csv")
-    student_names = {}
-    if os.path.exists(student_list_path):
-        try:
-            df_students = pd.read_csv(student_list_path, header=None, skipinitialspace=True)
-            student_names = dict(
-                zip(
-                    df_students[0].astype(str).str.strip(),
-                    (df_students[1].astype(str).str.strip(), df_students[2].astype(str).str.strip())
-                )
-            )
-        except Exception as e:
-            app_logger.warning(f"Could not load student names: {e}")
+    try:
+        roster = get_roster()
+    except Exception as e:
+        app_logger.warning(f"Could not load student names: {e}")
+        roster = StudentRoster([])
 
     student_sheets_files = sorted(
         [f for f in os.listdir(session_upload_path) if allowed_file(f)]
@@ -479,11 +647,16 @@ def process_multi():
         return jsonify({"error": "No student answer sheets to process"}), 400
 
     results = []
-    seen_student_ids = {}  # ติดตามรหัสนักศึกษาที่เจอแล้ว {student_id: [list of filenames]}
+    duplicate_index = DuplicateIndex()  # ติดตามรหัสนักศึกษาที่เจอแล้ว {student_id: [list of filenames]}
+    image_index = get_image_index(session_upload_path)
+    reshots = {}  # ไฟล์ที่ถ่ายกระดาษแผ่นเดิมซ้ำ -> ไฟล์ที่ใช้เป็นผลตรวจ
 
     session_data = get_session_data()
     session_data["multi_detailed_answers"] = {}
 
+    # ตรวจรูปที่ดีที่สุดของแต่ละกลุ่มรูปถ่ายซ้ำก่อน รูปที่เหลือในกลุ่มถูกข้ามเมื่ออ่านได้รหัสและคำตอบเหมือนกัน
+    student_sheets_files = image_index.grading_order(student_sheets_files, _saved_name_of)
+
     for filename in student_sheets_files:
         # ใช้รูปภาพต้นฉบับสำหรับการประมวลผล (ไม่ใช่เวอร์ชันเว็บ)
         original_filename = filename
@@ -496,71 +669,30 @@ def process_multi():
             # ถ้ามีเวอร์ชันเว็บอยู่แล้ว ข้ามไฟล์ต้นฉบับ (ป้องกันการประมวลผลซ้ำ)
             continue
             
-        filepath = os.path.join(session_upload_path, original_filename)
-        try:
-            with open(filepath, "rb") as f:
-                image_bytes = f.read()
-
-            student_id, answered_data, h_file = omr_system.find_and_process_sheet(
-                image_bytes,
-                original_filename,
-                mode="multi",
-                multi_answer_key=answer_key,
-                session_debug_folder=session_debug_path,
-            )
-
-            serializable_answers = {}
-            multiple_answers_count = 0  # นับจำนวนข้อที่กาหลายคำตอบ (ไม่ใช้ใน multi mode แต่เก็บไว้เพื่อความสม่ำเสมอ)
-            for q_num, data in answered_data.items():
-                serializable_answers[q_num] = {
-                    "answers": list(data.get("answers", set())),
-                    "status": data.get("status", "incorrect"),
-                    "has_multiple_answers": data.get("has_multiple_answers", False),
-                }
-                # ใน multi mode การกาหลายคำตอบเป็นเรื่องปกติ ไม่นับเป็นปัญหา
-            session_data["multi_detailed_answers"][student_id] = serializable_answers
-            first_name, last_name, score = process_data(student_id, student_names, answered_data)
-            
-            # ตรวจสอบรหัสซ้ำ
-            is_duplicate = False
-            if str(student_id) in seen_student_ids:
-                is_duplicate = True
-                seen_student_ids[str(student_id)].append(original_filename)
-                app_logger.warning(f"Duplicate student ID detected: {student_id} in files {seen_student_ids[str(student_id)]}")
-            else:
-                seen_student_ids[str(student_id)] = [original_filename]
-            
-            result_item = {
-                "student_file": original_filename,
-                "student_id": student_id,
-                "student_name": f"{first_name} {last_name}".strip(),
-                "fname": first_name,
-                "lname": last_name,
-                "score": score,
-                "total": len(answer_key),
-                "image_url": f"/debug_output/{session['session_id']}/{h_file}",
-                "multiple_answers_count": 0,  # ใน multi mode ไม่นับเป็นปัญหา
-                "has_issues": is_duplicate,  # ใน multi mode เฉพาะรหัสซ้ำเท่านั้นที่เป็นปัญหา
-                "is_duplicate": is_duplicate,  # เพิ่มแฟล็กรหัสซ้ำ
-            }
-            if any(d.get("status") == "partial" for d in answered_data.values()):
-                result_item["status"] = "partial"
-            results.append(result_item)
-
-        except Exception as e:
-            app_logger.error(
-                f"ERROR processing {original_filename}: {e} | {traceback.format_exc()}"
-            )
-            results.append(
-                {
-                    "student_file": original_filename,
-                    "student_id": "ERROR",
-                    "student_name": "ข้อผิดพลาด",
-                    "score": "Processing Error",
-                    "total": len(answer_key) if answer_key else 0,
-                    "image_url": f"/uploads/{session['session_id']}/{original_filename}",
-                }
+        result, serializable_answers = _grade_sheet(
+            "multi", original_filename, answer_key, roster, session_upload_path, session_debug_path, session["session_id"]
+        )
+        if serializable_answers is not None:
+            kept_file, confirmed = _find_reshot(
+                original_filename, result["student_id"], serializable_answers,
+                duplicate_index, session_data["multi_detailed_answers"], image_index,
             )
+            if confirmed:
+                reshots[original_filename] = kept_file
+                app_logger.info(f"Skipped re-shot {original_filename} of {kept_file} (student {result['student_id']})")
+                continue
+            if kept_file:
+                _flag_possible_reshot(result, kept_file)
+            session_data["multi_detailed_answers"][result["student_id"]] = serializable_answers
+            # ตรวจสอบรหัสซ้ำ (สถานะของทุกแถวในกลุ่มถูกตั้งค่าหลังประมวลผลครบ)
+            duplicate_index.add(original_filename, result["student_id"])
+        results.append(result)
+
+    # ตั้งค่าสถานะรหัสซ้ำของทุกแถวในกลุ่ม (รวมไฟล์แรกที่ใช้รหัสนั้น)
+    for student_id, files in duplicate_index.conflicts().items():
+        app_logger.warning(f"Duplicate student ID detected: {student_id} in files {files}")
+    for result in results:
+        apply_duplicate_flags(result, duplicate_index, "multi")
 
     # เรียงผลลัพธ์ตามรหัสนักศึกษาก่อนบันทึก
     # แยกเป็น 2 กลุ่ม: ไม่พบชื่อ/รหัสอ่านไม่ได้ (ไม่ sort) และ พบชื่อ+รหัสปกติ (sort ตามรหัส)
@@ -600,46 +732,39 @@ def process_multi():
     # รวมผลลัพธ์: กลุ่มไม่พบชื่อ/รหัสอ่านไม่ได้ก่อน (ไม่ sort) + กลุ่มพบชื่อ+รหัสปกติ (sort แล้ว)
     results = not_found_group + found_group_sorted
     
+    # รูปผลตรวจถูกเขียนในเบื้องหลัง: รอให้เขียนเสร็จก่อนส่ง URL ให้หน้าเว็บ
+    get_artifact_writer().flush(session_debug_path)
     session_data["multi_results"] = results
     save_session_data(session_data)
+    remember_duplicate_index("multi", duplicate_index)
+    publish_change(session["session_id"], "results_replaced", mode="multi")
 
-    # สร้าง DataFrame สำหรับ export
-    students = []
-    if os.path.exists(student_list_path):
-        try:
-            for idx, row in df_students.iterrows():
-                student_id = str(row[0]).strip()
-                fname = str(row[1]).strip()
-                lname = str(row[2]).strip() if len(row) > 2 else ""
-                group_code = str(row[3]).strip() if len(row) > 3 else ""
-                students.append({
-                    "student_id": student_id,
-                    "fname": fname,
-                    "lname": lname,
-                    "group_code": group_code
-                })
-        except Exception as e:
-            app_logger.warning(f"Could not build students list: {e}")
-
-    export_rows = []
-    for s in students:
-        if "student_id" in s and s["student_id"]:
-            export_rows.append({
-                "student_id": s["student_id"],
-                "fname": s.get("fname", ""),
-                "lname": s.get("lname", ""),
-                "group_code": s.get("group_code", ""),
-                "score": next((r["score"] for r in results if r["student_id"] == s["student_id"]), "")
-            })
-    if not export_rows:
+    # ต้องมีรายชื่อนักศึกษาที่มีรหัสอย่างน้อยหนึ่งคน
+    if not any(roster.by_id):
         return jsonify({"success": False, "error": "ไม่พบ student_id ในรายชื่อ"}), 400
-    df = pd.DataFrame(export_rows)
-    if "student_id" in df.columns:
-        df = df.sort_values(by=["student_id"])
 
-    return jsonify({"results": results})
+    return jsonify({"results": results, "reshots": reshots})
+
 
 
+@app.url_defaults
+def add_static_fingerprint(endpoint, values):
+    """ต่อ ?v=<hash เนื้อไฟล์> ให้ url_for('static', ...) เพื่อให้ cache ได้ถาวรและเปลี่ยน URL เมื่อแก้ไฟล์"""
+    if endpoint != "static" or "v" in values or "filename" not in values:
+        return
+    fingerprint = static_fingerprint(app.static_folder, values["filename"])
+    if fingerprint:
+        values["v"] = fingerprint
+
+
+def _is_immutable_asset(req):
+    """static ที่มี fingerprint ตรงกับเนื้อไฟล์ปัจจุบัน หรือรูปย่อ web_ (ชื่อไม่ซ้ำ เขียนครั้งเดียว)"""
+    if req.path.startswith("/static/"):
+        version = req.args.get("v")
+        filename = req.path[len("/static/"):]
+        return bool(version) and version == static_fingerprint(app.static_folder, filename)
+    return req.path.startswith("/uploads/") and os.path.basename(req.path).startswith("web_")
+
 
 # Middleware สำหรับ log การเข้าถึง
 @app.before_request
@@ -663,13 +788,25 @@ def log_response_info(response):
     
     # เพิ่ม Cache-Control headers สำหรับ static files
     if any(request.path.startswith(path) for path in ["/static/", "/uploads/", "/debug_output/"]):
-        # Cache static files และรูปภาพเป็นเวลา 1 ชั่วโมง
-        response.headers['Cache-Control'] = 'public, max-age=3600'
+        if response.status_code == 200 and _is_immutable_asset(request):
+            response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            # Cache static files และรูปภาพเป็นเวลา 1 ชั่วโมง
+            response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}'
         response.headers['Vary'] = 'Accept-Encoding'
+
+    # ให้ service worker แยก cache ของ API ตาม session (hash แทน session_id จริง)
+    if "session_id" in session:
+        response.headers["X-Session-Tag"] = hashlib.sha256(session["session_id"].encode()).hexdigest()[:16]
     
     return response
 
 
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({"error": "ไฟล์มีขนาดใหญ่เกินไป กรุณาอัปโหลดแบบแบ่งส่วน"}), 413
+
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     app_logger.error(f"Unhandled exception: {str(e)}")
@@ -779,23 +916,16 @@ def new_session():
     if "session_id" in session:
         session_id = session["session_id"]
         app_logger.info(f"Clearing all data for session: {session_id}")
+        stop_watcher(session_id)
 
-        paths_to_delete = [
-            os.path.join(app.config["UPLOAD_FOLDER"], session_id),
-            os.path.join(DEBUG_FOLDER, session_id),
-            os.path.join(STATIC_FOLDER, session_id),
-        ]
-
-        for path in paths_to_delete:
-            if os.path.exists(path):
-                try:
-                    shutil.rmtree(path)
-                    app_logger.info(f"Removed directory: {path}")
-                except Exception as e:
-                    app_logger.error(f"Failed to delete directory {path}. Reason: {e}")
+        # ย้ายโฟลเดอร์ของ session ไปรอลบในเบื้องหลัง (ไม่ต้องรอลบไฟล์ทีละไฟล์ใน request)
+        try:
+            get_storage().discard_session(session_id)
+        except OSError as e:
+            app_logger.error(f"Failed to discard directories of session {session_id}. Reason: {e}")
 
-    msg = json.dumps({"event": "clear"})
-    announcer.announce(msg=f"data: {msg}\n\n")
+        publish_change(session_id, "clear")
+        _forget_session_state(session_id)
 
     return jsonify({"message": "Current session data cleared. Please reload the page."})
 
@@ -803,9 +933,12 @@ def new_session():
 @app.route("/get_images")
 def get_images():
     images = []
+    seq = None
     try:
         session_id = session["session_id"]
         session_upload_path = get_session_path("uploads")
+        # อ่านเลขลำดับก่อนอ่านไฟล์ เพื่อไม่ให้พลาดการเปลี่ยนแปลงที่เกิดระหว่างอ่าน
+        seq = change_log.current_seq(session_id)
 
         if os.path.exists(session_upload_path):
             for filename in sorted(os.listdir(session_upload_path)):
@@ -834,15 +967,21 @@ def get_images():
                                 "url": f"/uploads/{session_id}/{filename}",
                             }
                         )
-    except ValueError:
+    except (KeyError, ValueError):
         pass  # ไม่มี session ไม่ต้องทำอะไร
-    return jsonify({"files": images})
+    return jsonify({"files": images, "seq": seq})
 
 
 @app.route("/stream")
 def stream():
+    session_id = session.get("session_id")
+    # EventSource ส่ง Last-Event-ID มาเองเมื่อเชื่อมต่อใหม่ (รองรับ query string สำหรับการเชื่อมต่อใหม่แบบ manual)
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+
     def generate():
-        messages = announcer.listen()
+        messages = announcer.listen(session_id)
+        if session_id and last_event_id:
+            yield from _replay_changes(session_id, last_event_id)
         while True:
             msg = messages.get()
             yield msg
@@ -850,6 +989,200 @@ def stream():
     return Response(generate(), mimetype="text/event-stream")
 
 
+def _replay_changes(session_id, last_event_id):
+    """ส่งการเปลี่ยนแปลงที่ client พลาดไประหว่างหลุดการเชื่อมต่อ"""
+    try:
+        since = int(last_event_id)
+    except (TypeError, ValueError):
+        since = None
+    changes, latest = change_log.since(session_id, since)
+    if changes is None:
+        # ประวัติไม่พอสำหรับ replay ให้ client โหลดข้อมูลใหม่ทั้งหมด
+        payload = {"event": "resync", "session_id": session_id, "seq": latest}
+        yield f"id: {latest}\ndata: {json.dumps(payload)}\n\n"
+        return
+    for entry in changes:
+        yield format_sse_change(entry, session_id)
+
+
+@app.route("/get_changes")
+def get_changes():
+    """ดึงเฉพาะการเปลี่ยนแปลงหลังเลขลำดับ since (รูปภาพและแถวผลลัพธ์ที่เปลี่ยน)"""
+    if "session_id" not in session:
+        return jsonify({"error": "No active session"}), 400
+
+    since = request.args.get("since", type=int)
+    changes, latest = change_log.since(session["session_id"], since)
+    if changes is None:
+        return jsonify({"reset": True, "seq": latest})
+
+    images, result_changes = compact_changes(changes)
+    session_data = get_session_data() if result_changes else {}
+    results = {}
+    for mode, mode_changes in result_changes.items():
+        rows = session_data.get(f"{mode}_results", [])
+        if not mode_changes["replaced"]:
+            rows = [r for r in rows if r.get("student_file") in mode_changes["keys"]]
+        results[mode] = {"replaced": mode_changes["replaced"], "rows": rows}
+
+    return jsonify({"reset": False, "seq": latest, "images": images, "results": results})
+
+
+def _register_uploaded_image(unique_filename, original_filename, session_id, session_upload_path, digest=None):
+    """สร้างเวอร์ชันเว็บของรูปที่บันทึกแล้ว แจ้ง client และคืนค่าข้อมูลไฟล์"""
+    filepath = os.path.join(session_upload_path, unique_filename)
+    # สร้างเวอร์ชันเว็บสำหรับรูปภาพปกติ
+    try:
+        with Image.open(filepath) as img:
+            _index_capture(unique_filename, digest, img, session_upload_path)
+            web_filename = f"web_{unique_filename}"
+            web_filepath = os.path.join(session_upload_path, web_filename)
+            web_image_data = create_web_optimized_image(img, max_width=800, quality=60)
+
+            with open(web_filepath, 'wb') as f:
+                f.write(web_image_data)
+
+            file_info = {
+                "original_name": original_filename,
+                "saved_name": unique_filename,
+                "web_name": web_filename,
+                "url": f"/uploads/{session_id}/{web_filename}",  # ใช้เวอร์ชันเว็บสำหรับแสดงผล
+                "original_url": f"/uploads/{session_id}/{unique_filename}",  # เก็บ URL ต้นฉบับไว้
+            }
+    except Exception as e:
+        app_logger.warning(f"Could not create web version for {unique_filename}: {e}")
+        # ถ้าสร้างเวอร์ชันเว็บไม่ได้ ใช้ต้นฉบับ
+        file_info = {
+            "original_name": original_filename,
+            "saved_name": unique_filename,
+            "url": f"/uploads/{session_id}/{unique_filename}",
+        }
+
+    _record_stored_files(session_id, session_upload_path, [file_info])
+    publish_change(session_id, "new_image", data=file_info, keys=[unique_filename])
+    app_logger.info(
+        f"Uploaded file for session {session_id}: {unique_filename}"
+    )
+    return file_info
+
+
+def _record_stored_files(session_id, session_upload_path, files_info):
+    """นับพื้นที่ของรูปที่บันทึกใหม่ (ต้นฉบับและรูปย่อ) เข้าโควตาของ session"""
+    storage = get_storage()
+    for file_info in files_info:
+        for name, regenerable in ((file_info["saved_name"], False), (file_info.get("web_name"), True)):
+            if name:
+                try:
+                    storage.record_added(session_id, os.path.getsize(os.path.join(session_upload_path, name)), regenerable)
+                except OSError:
+                    pass
+
+
+def _storage_quota_error(session_id):
+    """response 507 ถ้าพื้นที่ของ session เต็มโควตา (None ถ้ายังรับไฟล์ได้)"""
+    if not get_storage().is_over_quota(session_id):
+        return None
+    app_logger.warning(f"Session {session_id} is over its storage quota")
+    return jsonify({"error": "พื้นที่จัดเก็บของ session นี้เต็มแล้ว กรุณาลบรูปที่ไม่ใช้หรือเริ่ม session ใหม่"}), 507
+
+
+def _index_capture(saved_name, digest, img, session_upload_path):
+    """เพิ่มรูปเข้า index ของ session และบันทึก log ถ้าเป็นรูปที่ถ่ายกระดาษแผ่นเดิมซ้ำ"""
+    try:
+        group = get_image_index(session_upload_path).add_image(saved_name, digest, img)
+    except Exception as e:
+        app_logger.warning(f"Could not index {saved_name}: {e}")
+        return
+    if group != saved_name:
+        app_logger.info(f"{saved_name} may be a re-shot of {group}")
+
+
+def _existing_image_info(saved_name, original_filename, session_id, session_upload_path):
+    """ข้อมูลไฟล์ของรูปที่มีอยู่แล้ว (อัปโหลดเนื้อไฟล์เดิมซ้ำ) โดยไม่แจ้ง client ซ้ำ"""
+    file_info = {
+        "original_name": original_filename,
+        "saved_name": saved_name,
+        "url": f"/uploads/{session_id}/{saved_name}",
+        "deduplicated": True,
+    }
+    web_filename = f"web_{saved_name}"
+    if os.path.exists(os.path.join(session_upload_path, web_filename)):
+        file_info.update({
+            "web_name": web_filename,
+            "url": f"/uploads/{session_id}/{web_filename}",
+            "original_url": f"/uploads/{session_id}/{saved_name}",
+        })
+    return file_info
+
+
+def _store_uploaded_image(source, original_filename, session_id, session_upload_path, move=False):
+    """
+    บันทึกรูปโดยตั้งชื่อจาก hash ของเนื้อไฟล์ (source เป็น bytes หรือ path บนดิสก์)
+    ไฟล์ที่เนื้อหาตรงกับรูปที่มีอยู่แล้ว (มือถือส่งซ้ำ อัปโหลดไฟล์เดิมอีกครั้ง) ไม่ถูกบันทึกและไม่ถูกตรวจซ้ำ
+    move=True จะย้ายไฟล์แทนการคัดลอก
+    """
+    ext = original_filename.rsplit(".", 1)[1].lower()
+    digest = content_hash(source)
+    saved_name = content_addressed_name(digest, ext)
+    target = os.path.join(session_upload_path, saved_name)
+    if os.path.exists(target):
+        if move:
+            os.remove(source)
+        app_logger.info(f"Skipped byte-identical upload {original_filename} (already stored as {saved_name})")
+        return _existing_image_info(saved_name, original_filename, session_id, session_upload_path)
+
+    # เขียนลงไฟล์ชั่วคราวก่อน แล้วเปลี่ยนชื่อ เพื่อไม่ให้ไฟล์ที่เขียนไม่เสร็จถูกนำไปตรวจ
+    if isinstance(source, (bytes, bytearray)):
+        fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=session_upload_path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(source)
+        os.replace(tmp_path, target)
+    elif move:
+        os.replace(source, target)
+    else:
+        fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=session_upload_path)
+        os.close(fd)
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+    return _register_uploaded_image(saved_name, original_filename, session_id, session_upload_path, digest)
+
+
+def _ingest_multipage_file(source, original_filename, session_id, session_upload_path):
+    """
+    แยก PDF หรือ TIFF หลายหน้าเป็นรูปทีละหน้า แจ้ง client และคืนค่ารายการข้อมูลไฟล์
+    source เป็น path บนดิสก์ (ไม่ต้องโหลดทั้งไฟล์เข้า memory) หรือ bytes
+    ไฟล์ที่เคยนำเข้าแล้ว (เนื้อไฟล์เดียวกัน) คืนค่าหน้าเดิมโดยไม่แปลงซ้ำ
+    """
+    ext = original_filename.rsplit(".", 1)[1].lower()
+    image_index = get_image_index(session_upload_path)
+    digest = content_hash(source)
+    pages = image_index.source_pages(digest)
+    if pages:
+        app_logger.info(f"Skipped byte-identical {ext.upper()} {original_filename} ({len(pages)} pages already stored)")
+        return [
+            _existing_image_info(page["saved_name"], page["original_name"], session_id, session_upload_path)
+            for page in pages
+        ]
+
+    if ext == "pdf":
+        converted_images = convert_pdf_to_images(source, original_filename, session_upload_path)
+    else:
+        converted_images = convert_tiff_to_images(source, original_filename, session_upload_path)
+    for image_info in converted_images:
+        try:
+            with Image.open(os.path.join(session_upload_path, image_info["saved_name"])) as img:
+                _index_capture(image_info["saved_name"], None, img, session_upload_path)
+        except OSError as e:
+            app_logger.warning(f"Could not index {image_info['saved_name']}: {e}")
+        publish_change(session_id, "new_image", data=image_info, keys=[image_info["saved_name"]])
+        app_logger.info(
+            f"Converted {ext.upper()} page for session {session_id}: {image_info['saved_name']}"
+        )
+    image_index.add_source(digest, converted_images)
+    _record_stored_files(session_id, session_upload_path, converted_images)
+    return converted_images
+
+
 @app.route("/upload_image", methods=["POST"])
 def upload_image():
     if "files" not in request.files:
@@ -861,6 +1194,10 @@ def upload_image():
     except ValueError:
         return jsonify({"error": "No active session"}), 400
 
+    quota_error = _storage_quota_error(session_id)
+    if quota_error:
+        return quota_error
+
     files = request.files.getlist("files")
     uploaded_files_info = []
 
@@ -869,75 +1206,539 @@ def upload_image():
             original_filename = file.filename
             ext = original_filename.rsplit(".", 1)[1].lower()
 
-            if ext == "pdf":
+            if ext in MULTIPAGE_EXTENSIONS:
+                # บันทึกลงดิสก์ก่อนแปลง เพื่อไม่ต้องอ่านทั้งไฟล์เข้า memory
+                fd, document_path = tempfile.mkstemp(suffix=f".{ext}.part", dir=session_upload_path)
+                os.close(fd)
                 try:
-                    pdf_bytes = file.read()
-                    # ส่ง Path ของ session เข้าไปในฟังก์ชัน
-                    converted_images = convert_pdf_to_images(
-                        pdf_bytes, original_filename, session_upload_path
+                    file.save(document_path)
+                    uploaded_files_info.extend(
+                        _ingest_multipage_file(document_path, original_filename, session_id, session_upload_path)
                     )
-
-                    for image_info in converted_images:
-                        uploaded_files_info.append(image_info)
-                        msg = json.dumps({"event": "new_image", "data": image_info, "session_id": session_id})
-                        announcer.announce(msg=f"data: {msg}\n\n")
-                        app_logger.info(
-                            f"Converted PDF page for session {session_id}: {image_info['saved_name']}"
-                        )
-
                 except Exception as e:
-                    app_logger.error(f"Error processing PDF {original_filename}: {e}")
+                    app_logger.error(f"Error processing {ext.upper()} {original_filename}: {e}")
                     return (
-                        jsonify({"error": f"ไม่สามารถประมวลผลไฟล์ PDF ได้: {str(e)}"}),
+                        jsonify({"error": f"ไม่สามารถประมวลผลไฟล์ {ext.upper()} ได้: {str(e)}"}),
                         400,
                     )
+                finally:
+                    os.remove(document_path)
 
             else:
-                unique_filename = f"{uuid.uuid4()}.{ext}"
-                filepath = os.path.join(session_upload_path, unique_filename)
-                
-                # บันทึกไฟล์ต้นฉบับ
-                file.save(filepath)
-                
-                # สร้างเวอร์ชันเว็บสำหรับรูปภาพปกติ
+                # บันทึกไฟล์ต้นฉบับลงไฟล์ชั่วคราวก่อน แล้วตั้งชื่อจาก hash ของเนื้อไฟล์
+                fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=session_upload_path)
+                os.close(fd)
                 try:
-                    with Image.open(filepath) as img:
-                        web_filename = f"web_{unique_filename}"
-                        web_filepath = os.path.join(session_upload_path, web_filename)
-                        web_image_data = create_web_optimized_image(img, max_width=800, quality=60)
-                        
-                        with open(web_filepath, 'wb') as f:
-                            f.write(web_image_data)
-                        
-                        file_info = {
-                            "original_name": original_filename,
-                            "saved_name": unique_filename,
-                            "web_name": web_filename,
-                            "url": f"/uploads/{session_id}/{web_filename}",  # ใช้เวอร์ชันเว็บสำหรับแสดงผล
-                            "original_url": f"/uploads/{session_id}/{unique_filename}",  # เก็บ URL ต้นฉบับไว้
-                        }
-                except Exception as e:
-                    app_logger.warning(f"Could not create web version for {unique_filename}: {e}")
-                    # ถ้าสร้างเวอร์ชันเว็บไม่ได้ ใช้ต้นฉบับ
-                    file_info = {
-                        "original_name": original_filename,
-                        "saved_name": unique_filename,
-                        "url": f"/uploads/{session_id}/{unique_filename}",
-                    }
-                
+                    file.save(temp_path)
+                    file_info = _store_uploaded_image(
+                        temp_path, original_filename, session_id, session_upload_path, move=True
+                    )
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
                 uploaded_files_info.append(file_info)
 
-                msg = json.dumps({"event": "new_image", "data": file_info, "session_id": session_id})
-                announcer.announce(msg=f"data: {msg}\n\n")
-                app_logger.info(
-                    f"Uploaded file for session {session_id}: {unique_filename}"
+    return jsonify(
+        {"message": "Files uploaded successfully", "files": uploaded_files_info}
+    )
+
+
+def _announce_upload_progress(session_id, filename, status, processed, **extra):
+    """แจ้งความคืบหน้าการอัปโหลด ZIP ผ่าน SSE (ไม่บันทึกใน change log)"""
+    msg_data = {
+        "event": "zip_progress",
+        "filename": filename,
+        "status": status,
+        "processed": processed,
+        "session_id": session_id,
+    }
+    msg_data.update(extra)
+    announcer.announce(msg=f"data: {json.dumps(msg_data)}\n\n", session_id=session_id)
+
+
+def _ingest_zip_entry(name, data, session_id, session_upload_path):
+    """
+    ตรวจสอบและบันทึกไฟล์หนึ่งไฟล์จาก ZIP คืนค่า (รายการข้อมูลไฟล์ที่บันทึก, เหตุผลที่ข้าม)
+    """
+    original_filename = os.path.basename(name)
+    if not original_filename or name.startswith("__MACOSX/") or original_filename.startswith("."):
+        return [], "not an image"
+    if not allowed_file(original_filename):
+        return [], "unsupported file type"
+
+    ext = original_filename.rsplit(".", 1)[1].lower()
+    if ext in MULTIPAGE_EXTENSIONS:
+        try:
+            converted_images = _ingest_multipage_file(data, original_filename, session_id, session_upload_path)
+        except Exception as e:
+            return [], f"invalid {ext.upper()}: {e}"
+        return converted_images, None
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+    except Exception as e:
+        return [], f"invalid image: {e}"
+
+    return [_store_uploaded_image(data, original_filename, session_id, session_upload_path)], None
+
+
+def _saved_name_of(filename):
+    """ชื่อไฟล์ต้นฉบับของรูป (ตัด web_ ของเวอร์ชันเว็บออก)"""
+    return filename[4:] if filename.startswith("web_") else filename
+
+
+def _already_graded(mode, file_info):
+    """ไฟล์ที่อัปโหลดซ้ำ (เนื้อไฟล์เดิม) และมีผลตรวจในโหมดนี้แล้ว ไม่ต้องตรวจใหม่"""
+    if not file_info.get("deduplicated"):
+        return False
+    results = get_session_data().get(f"{mode}_results", [])
+    return any(r.get("student_file") == file_info["saved_name"] for r in results)
+
+
+def _marked_answers(answers):
+    """คำตอบที่อ่านได้ของแต่ละข้อ ใช้เทียบผลตรวจ (key เป็น str เหมือนหลังอ่านจาก JSON)"""
+    return {str(q_num): sorted(data.get("answers", [])) for q_num, data in (answers or {}).items()}
+
+
+def _find_reshot(student_file, student_id, answers, duplicate_index, detailed_answers, image_index):
+    """
+    ไฟล์ที่มีผลตรวจแล้วซึ่งอาจเป็นการถ่ายกระดาษแผ่นเดียวกับ student_file คืนค่า (ไฟล์, ยืนยันแล้ว) หรือ (None, False)
+    ยืนยันเมื่อเนื้อไฟล์เหมือนกันทุก byte หรือรูปใกล้เคียงกันและอ่านได้คำตอบเหมือนกันทุกข้อ
+    กระดาษต่างคนที่ถ่ายมุมเดียวกันก็มี hash ใกล้เคียงกัน รูปที่ใกล้เคียงอย่างเดียวจึงต้องให้ผู้ใช้ตรวจเอง
+    """
+    student_id = str(student_id)
+    if student_id in NON_DUPLICATE_IDS:
+        return None, False
+    for other_file in duplicate_index.files(student_id):
+        if other_file == student_file:
+            continue
+        match = image_index.capture_match(student_file, other_file)
+        if match == "identical":
+            return other_file, True
+        if match == "similar":
+            return other_file, _marked_answers(answers) == _marked_answers(detailed_answers.get(student_id))
+    return None, False
+
+
+def _flag_possible_reshot(result, other_file):
+    """เก็บทั้งสองแถว (ถูกตั้งเป็นรหัสซ้ำ) และบอกไฟล์ที่อาจเป็นแผ่นเดียวกันไว้ให้ผู้ใช้ตรวจ"""
+    result["possible_reshot_of"] = other_file
+    app_logger.info(
+        f"{result['student_file']} may be a re-shot of {other_file} (student {result['student_id']}) but answers differ"
+    )
+
+
+def _append_graded_results(mode, graded):
+    """
+    เพิ่มผลตรวจของแผ่นที่อัปโหลดใหม่ลงใน session data ครั้งเดียวต่อกลุ่ม
+    รูปที่ถ่ายกระดาษแผ่นเดิมซ้ำ (ยืนยันแล้ว) เก็บไว้เพียงผลของรูปที่คมชัดกว่า (ไม่ถูกนับเป็นรหัสซ้ำ)
+    """
+    image_index = get_image_index(get_session_path("uploads"))
+    # รอรูปผลตรวจที่เขียนในเบื้องหลังก่อนประกาศผล (หน้าเว็บโหลดรูปทันทีที่ได้รับ event)
+    get_artifact_writer().flush(get_session_path("debug_output"))
+    with score_update_lock:
+        session_data = get_session_data()
+        results = session_data.setdefault(f"{mode}_results", [])
+        detailed_answers = session_data.setdefault(f"{mode}_detailed_answers", {})
+        duplicate_index = get_duplicate_index(session_data, mode)
+        rows_by_file = {r.get("student_file"): r for r in results}
+
+        changed_files = set()
+        replaced_rows = False
+        for result, serializable_answers in graded:
+            if serializable_answers is not None:
+                kept_file, confirmed = _find_reshot(
+                    result["student_file"], result["student_id"], serializable_answers,
+                    duplicate_index, detailed_answers, image_index,
                 )
+                if kept_file and not confirmed:
+                    _flag_possible_reshot(result, kept_file)
+                elif kept_file:
+                    if image_index.capture_rank(result["student_file"]) <= image_index.capture_rank(kept_file):
+                        app_logger.info(f"Skipped re-shot {result['student_file']} of {kept_file}")
+                        continue
+                    # รูปใหม่คมชัดกว่า: ใช้แทนผลของรูปเดิม
+                    results.remove(rows_by_file.pop(kept_file))
+                    changed_files |= duplicate_index.remove(kept_file)
+                    replaced_rows = True
+                    app_logger.info(f"Replaced {kept_file} with sharper re-shot {result['student_file']}")
+            results.append(result)
+            rows_by_file[result["student_file"]] = result
+            changed_files.add(result["student_file"])
+            if serializable_answers is not None:
+                detailed_answers[result["student_id"]] = serializable_answers
+                changed_files |= duplicate_index.add(result["student_file"], result["student_id"])
+        changed_files &= rows_by_file.keys()
+        for student_file in changed_files:
+            apply_duplicate_flags(rows_by_file[student_file], duplicate_index, mode)
 
+        save_session_data(session_data)
+        remember_duplicate_index(mode, duplicate_index)
+
+    if replaced_rows:
+        # มีแถวถูกลบ: ให้ client โหลดผลลัพธ์ใหม่ทั้งหมด
+        publish_change(session["session_id"], "results_replaced", mode=mode)
+        return
+    changed_rows = [rows_by_file[f] for f in changed_files]
+    publish_change(session["session_id"], "result_updated", data=changed_rows, mode=mode, keys=changed_files)
+
+
+@app.route("/upload_zip", methods=["POST"])
+def upload_zip():
+    """
+    อัปโหลดไฟล์ ZIP ของรูปกระดาษคำตอบแบบ stream (ส่ง body เป็นไฟล์ ZIP โดยตรง)
+    แตกไฟล์และตรวจสอบทีละไฟล์ระหว่างที่ยังอัปโหลดไม่เสร็จ และแจ้งความคืบหน้าผ่าน SSE
+    query: grade=single|multi เพื่อตรวจกระดาษคำตอบทันทีที่แตกไฟล์ออกมา
+    """
+    request.max_content_length = MAX_ZIP_UPLOAD_SIZE  # กำหนดต่อ request ได้ตั้งแต่ Flask/Werkzeug 3.1 (ดู requirements.txt)
+    grade_mode = request.args.get("grade")
+    try:
+        session_id = session["session_id"]
+        session_upload_path = get_session_path("uploads")
+        session_debug_path = get_session_path("debug_output")
+    except (KeyError, ValueError):
+        return jsonify({"error": "No active session"}), 400
+    quota_error = _storage_quota_error(session_id)
+    if quota_error:
+        return quota_error
+
+    answer_key = None
+    roster = None
+    if grade_mode:
+        if grade_mode not in ("single", "multi"):
+            return jsonify({"error": f"Unknown mode: {grade_mode}"}), 400
+        answer_key, err = load_answer_key(grade_mode)
+        if err:
+            return jsonify({"error": err}), 400
+        roster = get_roster()
+
+    uploaded_files_info = []
+    skipped = []
+    processed_offsets = set()
+    pending_grades = []
+    grade_futures = []
+    scheduled_grades = set()
+    grade_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=1) if grade_mode else None
+
+    @copy_current_request_context
+    def grade_file(saved_name):
+        graded = _grade_sheet(
+            grade_mode, saved_name, answer_key, roster, session_upload_path, session_debug_path, session_id
+        )
+        with grade_lock:
+            pending_grades.append(graded)
+            ready = len(pending_grades) >= ZIP_GRADE_FLUSH_EVERY
+            batch = pending_grades[:] if ready else []
+            if ready:
+                pending_grades.clear()
+        if batch:
+            _append_graded_results(grade_mode, batch)
+
+    def ingest(offset, name, data):
+        processed_offsets.add(offset)
+        files_info, reason = _ingest_zip_entry(name, data, session_id, session_upload_path)
+        if reason:
+            skipped.append({"filename": name, "reason": reason})
+            _announce_upload_progress(session_id, name, "skipped", len(uploaded_files_info), reason=reason)
+            return
+        for file_info in files_info:
+            uploaded_files_info.append(file_info)
+            # ไฟล์เดียวกันที่อยู่ใน ZIP หลายครั้ง หรือมีผลตรวจแล้ว ตรวจเพียงครั้งเดียว
+            if executor and file_info["saved_name"] not in scheduled_grades and not _already_graded(grade_mode, file_info):
+                scheduled_grades.add(file_info["saved_name"])
+                grade_futures.append(executor.submit(grade_file, file_info["saved_name"]))
+        _announce_upload_progress(session_id, name, "saved", len(uploaded_files_info))
+
+    # บันทึก ZIP ลงดิสก์ระหว่างอ่าน (ใช้แตกไฟล์ที่เหลือถ้าอ่านแบบ stream ไม่ได้)
+    fd, zip_path = tempfile.mkstemp(suffix=".zip.part", dir=session_upload_path)
+    reader = ZipStreamReader()
+    try:
+        with os.fdopen(fd, "wb") as zip_file:
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                zip_file.write(chunk)
+                for offset, name, data in reader.feed(chunk):
+                    ingest(offset, name, data)
+
+        if not reader.finished:
+            # มีไฟล์ที่อ่านแบบ stream ไม่ได้ แตกไฟล์ที่เหลือจาก central directory
+            try:
+                with zipfile.ZipFile(zip_path) as archive:
+                    for info in archive.infolist():
+                        if info.header_offset in processed_offsets or info.is_dir():
+                            continue
+                        if info.file_size > MAX_ZIP_ENTRY_SIZE:
+                            skipped.append({"filename": info.filename, "reason": "file too large"})
+                            continue
+                        ingest(info.header_offset, info.filename, archive.read(info))
+            except zipfile.BadZipFile as e:
+                if not uploaded_files_info:
+                    return jsonify({"error": f"ไฟล์ ZIP ไม่ถูกต้อง: {e}"}), 400
+                skipped.append({"filename": "", "reason": f"archive truncated: {e}"})
+        for name, reason in reader.skipped:
+            skipped.append({"filename": name, "reason": reason})
+    finally:
+        os.remove(zip_path)
+        if executor:
+            executor.shutdown(wait=True)
+            for future in grade_futures:
+                if future.exception():
+                    app_logger.error(f"Error saving graded ZIP sheet: {future.exception()}")
+
+    if pending_grades:
+        _append_graded_results(grade_mode, pending_grades)
+
+    app_logger.info(
+        f"ZIP upload for session {session_id}: {len(uploaded_files_info)} images, {len(skipped)} skipped"
+    )
+    _announce_upload_progress(session_id, "", "done", len(uploaded_files_info), skipped=len(skipped))
     return jsonify(
-        {"message": "Files uploaded successfully", "files": uploaded_files_info}
+        {
+            "message": "Files uploaded successfully",
+            "files": uploaded_files_info,
+            "skipped": skipped,
+            "graded": bool(grade_mode),
+        }
     )
 
 
+def _ingest_saved_file(path, original_filename, session_id, session_upload_path, move=False):
+    """
+    นำไฟล์ที่อยู่บนดิสก์แล้ว (อัปโหลดแบบแบ่งส่วน หรือจาก hot folder) เข้าสู่ขั้นตอนเดียวกับ /upload_image
+    move=True จะย้ายไฟล์แทนการคัดลอก คืนค่ารายการข้อมูลไฟล์
+    """
+    ext = original_filename.rsplit(".", 1)[1].lower()
+    if ext in MULTIPAGE_EXTENSIONS:
+        return _ingest_multipage_file(path, original_filename, session_id, session_upload_path)
+
+    try:
+        with Image.open(path) as img:
+            img.verify()
+    except Exception as e:
+        raise ValueError(f"ไฟล์รูปภาพไม่ถูกต้อง: {e}")
+    return [_store_uploaded_image(path, original_filename, session_id, session_upload_path, move=move)]
+
+
+def _chunked_upload_status(upload):
+    return {
+        "upload_id": upload.upload_id,
+        "filename": upload.filename,
+        "size": upload.size,
+        "offset": upload.offset,
+        "complete": upload.files is not None,
+        "files": upload.files or [],
+    }
+
+
+@app.route("/upload_chunked", methods=["POST"])
+def create_chunked_upload():
+    """
+    เริ่มอัปโหลดไฟล์ใหญ่แบบแบ่งส่วน (resume ได้เมื่อการเชื่อมต่อหลุด)
+    body: {filename, size} คืนค่า upload_id และขนาด chunk ที่แนะนำ
+    จากนั้นส่งแต่ละ chunk ด้วย PATCH /upload_chunked/<upload_id>
+    """
+    try:
+        session_upload_path = get_session_path("uploads")
+    except (KeyError, ValueError):
+        return jsonify({"error": "No active session"}), 400
+    quota_error = _storage_quota_error(session["session_id"])
+    if quota_error:
+        return quota_error
+
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename", "")
+    size = data.get("size")
+    if not allowed_file(filename):
+        return jsonify({"error": "ไม่รองรับไฟล์ประเภทนี้"}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({"error": "size is required"}), 400
+    if size > MAX_CHUNKED_UPLOAD_SIZE:
+        return jsonify({"error": "ไฟล์มีขนาดใหญ่เกินไป"}), 413
+
+    upload = ChunkedUpload.create(session_upload_path, filename, size)
+    app_logger.info(f"Started chunked upload {upload.upload_id} ({filename}, {size} bytes)")
+    status = _chunked_upload_status(upload)
+    status.update(
+        {
+            "chunk_size": CHUNKED_UPLOAD_CHUNK_SIZE,
+            "max_chunk_size": MAX_CHUNK_SIZE,
+            "checksums": sorted(CHECKSUM_ALGORITHMS),
+        }
+    )
+    return jsonify(status), 201
+
+
+@app.route("/upload_chunked/<upload_id>", methods=["GET", "PATCH", "DELETE"])
+def chunked_upload(upload_id):
+    """
+    GET: ถามจำนวน bytes ที่เซิร์ฟเวอร์ได้รับแล้ว (ใช้ resume)
+    PATCH: ส่ง chunk ถัดไป ต้องมี header Upload-Offset และ Upload-Checksum ("sha256 <hex>" หรือ "crc32 <hex>")
+    DELETE: ยกเลิกการอัปโหลด
+    """
+    try:
+        session_id = session["session_id"]
+        session_upload_path = get_session_path("uploads")
+    except (KeyError, ValueError):
+        return jsonify({"error": "No active session"}), 400
+
+    upload = ChunkedUpload.load(session_upload_path, upload_id)
+    if upload is None:
+        return jsonify({"error": "Upload not found"}), 404
+
+    if request.method == "GET" or upload.files is not None:
+        # อัปโหลดเสร็จแล้ว: ส่งผลเดิมกลับ (client อาจไม่ได้รับ response ของ chunk สุดท้าย)
+        return jsonify(_chunked_upload_status(upload))
+
+    if request.method == "DELETE":
+        upload.discard()
+        return jsonify({"success": True})
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return jsonify({"error": "Upload-Offset header is required"}), 400
+    try:
+        upload.write_chunk(
+            request.stream, offset, request.content_length, request.headers.get("Upload-Checksum")
+        )
+    except UploadOffsetMismatch as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e), "offset": upload.offset}), 400
+    except Exception as e:
+        # การเชื่อมต่อหลุดระหว่างส่ง chunk (ข้อมูลถูกตัดกลับไปที่ offset เดิมแล้ว)
+        app_logger.warning(f"Chunk upload {upload_id} interrupted: {e}")
+        return jsonify({"error": "Chunk upload interrupted", "offset": upload.offset}), 400
+
+    if upload.complete:
+        try:
+            files_info = _ingest_saved_file(
+                upload.part_path, upload.filename, session_id, session_upload_path, move=True
+            )
+        except Exception as e:
+            app_logger.error(f"Error ingesting chunked upload {upload.filename}: {e}")
+            upload.discard()
+            return jsonify({"error": f"ไม่สามารถประมวลผลไฟล์ได้: {e}"}), 400
+        upload.finish(files_info)
+        app_logger.info(f"Completed chunked upload {upload_id}: {len(files_info)} images")
+
+    return jsonify(_chunked_upload_status(upload))
+
+
+def _ingest_hot_folder_files(session_id, grade_mode, paths):
+    """
+    นำเข้าไฟล์จาก hot folder (เรียกจาก thread ของ watcher) และตรวจทันทีถ้าผูกกับโหมดที่มีเฉลย
+    คืนค่า {path: สำเร็จหรือไม่}
+    """
+    if not os.path.isdir(os.path.join(UPLOAD_FOLDER, session_id)):
+        # session ถูกลบไปแล้ว ไม่ต้องเฝ้าโฟลเดอร์ต่อ
+        stop_watcher(session_id)
+        return {}
+
+    outcome = {}
+    with _session_context(session_id):
+        session_upload_path = get_session_path("uploads")
+        session_debug_path = get_session_path("debug_output")
+        answer_key = None
+        roster = None
+        if grade_mode:
+            answer_key, err = load_answer_key(grade_mode)
+            if err:
+                app_logger.warning(f"Hot folder for session {session_id} not grading: {err}")
+                answer_key = None
+            else:
+                roster = get_roster()
+
+        graded = []
+        graded_files = set()
+        for path in paths:
+            original_filename = os.path.basename(path)
+            if get_storage().is_over_quota(session_id):
+                # ไฟล์ถูกย้ายไป failed/ ให้วางใหม่ได้หลังลบรูปเพื่อคืนพื้นที่
+                app_logger.warning(f"Session {session_id} is over its storage quota, not ingesting {path}")
+                outcome[path] = False
+                continue
+            try:
+                files_info = _ingest_saved_file(path, original_filename, session_id, session_upload_path)
+            except Exception as e:
+                app_logger.error(f"Error ingesting hot folder file {path}: {e}")
+                outcome[path] = False
+                continue
+            outcome[path] = True
+            if answer_key is not None:
+                for file_info in files_info:
+                    if file_info["saved_name"] in graded_files or _already_graded(grade_mode, file_info):
+                        continue
+                    graded_files.add(file_info["saved_name"])
+                    graded.append(
+                        _grade_sheet(
+                            grade_mode, file_info["saved_name"], answer_key, roster,
+                            session_upload_path, session_debug_path, session_id,
+                        )
+                    )
+        if graded:
+            _append_graded_results(grade_mode, graded)
+
+    app_logger.info(f"Hot folder ingested {sum(outcome.values())}/{len(paths)} files for session {session_id}")
+    return outcome
+
+
+@app.route("/hot_folder/start", methods=["POST"])
+def start_hot_folder():
+    """
+    ผูกโฟลเดอร์ที่เครื่องสแกนเขียนไฟล์ลงมากับ session ปัจจุบัน ไฟล์ใหม่จะถูกนำเข้าอัตโนมัติ
+    body: {path, grade: single|multi (ไม่บังคับ)} โฟลเดอร์ต้องอยู่ใน OMR_HOT_FOLDER_ROOTS
+    """
+    if "session_id" not in session:
+        return jsonify({"error": "No active session"}), 400
+    session_id = session["session_id"]
+
+    data = request.get_json(silent=True) or {}
+    grade_mode = data.get("grade") or None
+    if grade_mode not in (None, "single", "multi"):
+        return jsonify({"error": f"Unknown mode: {grade_mode}"}), 400
+    try:
+        watch_path = resolve_watch_path(data.get("path"))
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    get_session_path("uploads")
+    watcher = HotFolderWatcher(
+        watch_path,
+        on_files=lambda paths: _ingest_hot_folder_files(session_id, grade_mode, paths),
+        accept=allowed_file,
+        keepalive=lambda: _touch_session_activity(session_id, "hot_folder"),
+    )
+    try:
+        start_watcher(session_id, watcher)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    app_logger.info(f"Bound hot folder {watch_path} to session {session_id} (grade={grade_mode})")
+    return jsonify({"success": True, "grade": grade_mode, **watcher.status()})
+
+
+@app.route("/hot_folder/stop", methods=["POST"])
+def stop_hot_folder():
+    if "session_id" not in session:
+        return jsonify({"error": "No active session"}), 400
+    watcher = stop_watcher(session["session_id"])
+    return jsonify({"success": True, "stopped": watcher is not None})
+
+
+@app.route("/hot_folder/status")
+def hot_folder_status():
+    watcher = get_watcher(session.get("session_id"))
+    if watcher is None:
+        return jsonify({"running": False})
+    return jsonify(watcher.status())
+
+
 # === API จัดการผลลัพธ์และเฉลย (ต้องระบุโหมด) ===
 @app.route("/clear_results_single", methods=["POST"])
 def clear_results_single():
@@ -945,6 +1746,7 @@ def clear_results_single():
     if "single_results" in session_data:
         del session_data["single_results"]
         save_session_data(session_data)
+        publish_change(session["session_id"], "results_cleared", mode="single")
     app_logger.info("Single mode results cleared")
     return jsonify({"message": "Results for single mode cleared."})
 
@@ -955,12 +1757,14 @@ def clear_results_multi():
     if "multi_results" in session_data:
         del session_data["multi_results"]
         save_session_data(session_data)
+        publish_change(session["session_id"], "results_cleared", mode="multi")
     app_logger.info("Multi mode results cleared")
     return jsonify({"message": "Results for multi mode cleared."})
 
 
 @app.route("/get_results_single")
 def get_results_single():
+    seq = change_log.current_seq(session["session_id"]) if "session_id" in session else None
     session_data = get_session_data()
     results = session_data.get("single_results", [])
     
@@ -1012,11 +1816,12 @@ def get_results_single():
     
     print(f"DEBUG - Final order: NOT_FOUND={len(not_found_group)}, FOUND={len(found_group_sorted)}")
     
-    return jsonify({"results": final_results})
+    return jsonify({"results": final_results, "seq": seq})
 
 
 @app.route("/get_results_multi")
 def get_results_multi():
+    seq = change_log.current_seq(session["session_id"]) if "session_id" in session else None
     session_data = get_session_data()
     results = session_data.get("multi_results", [])
     
@@ -1059,7 +1864,7 @@ def get_results_multi():
     # รวมผลลัพธ์: กลุ่มไม่พบชื่อ/รหัสอ่านไม่ได้ก่อน (ไม่ sort) + กลุ่มพบชื่อ+รหัสปกติ (sort แล้ว)
     final_results = not_found_group + found_group_sorted
     
-    return jsonify({"results": final_results})
+    return jsonify({"results": final_results, "seq": seq})
 
 
 @app.route("/view_answer_key_single")
@@ -1158,140 +1963,253 @@ def get_answer_key_multi():
         return jsonify({"has_answer_key": False, "error": str(e)}), 500
 
 
-@app.route("/download_results_single", methods=["POST"])
-def download_results_single():
-    data = request.get_json()
-    results_data = data.get("results")
-    output_filename = data.get("filename", "omr_results_single")
+def _download_results(mode):
+    """
+    ส่งออกผลลัพธ์จาก session data ที่บันทึกไว้ (ไม่ต้องส่งผลลัพธ์ทั้งหมดกลับมาจาก browser)
+    query: format=csv|xlsx|parquet, answers=1 เพื่อเพิ่ม matrix คำตอบรายข้อ, filename
+    """
+    data = request.get_json(silent=True) or {}
+    output_filename = request.args.get("filename") or data.get("filename") or f"omr_results_{mode}"
+    export_format = request.args.get("format", "csv").lower()
+    include_answers = request.args.get("answers", "").lower() in ("1", "true", "yes")
 
-    if not results_data:
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported export format: {export_format}"}), 400
+
+    # get_session_data คืนค่า {} เมื่อไม่มี session (ไม่ raise) จึงต้องตรวจเอง
+    if "session_id" not in session:
+        return jsonify({"error": "No active session"}), 400
+    session_data = get_session_data()
+    if not session_data.get(f"{mode}_results"):
         return jsonify({"error": "No results data provided"}), 400
 
-    formatted_data = []
-    for item in results_data:
-        # ใช้ student_name เป็นหลัก เพราะเป็นข้อมูลที่อัปเดตล่าสุด
-        student_name = item.get("student_name", "")
-        
-        # ถ้า student_name ว่างหรือเป็น "ไม่พบชื่อ" ให้ลองใช้ fname/lname
-        if not student_name or student_name in ["ไม่พบชื่อ", "ไม่พบชื่อในรายชื่อ"]:
-            fname = item.get("fname", "")
-            lname = item.get("lname", "")
-            if fname and lname:
-                student_name = f"{fname} {lname}".strip()
-            elif fname:
-                student_name = fname
-        
-        # แยกชื่อและนามสกุลจาก student_name
-        if " " in student_name:
-            fname, lname = student_name.split(" ", 1)
-        else:
-            fname, lname = student_name, ""
-            
-        formatted_data.append(
-            {
-                "student_id": item.get("student_id", ""),
-                "fname": fname,
-                "lname": lname,
-                "score": item.get("score", 0),
-                "total": item.get("total", 0),
-            }
-        )
+    questions = None
+    if include_answers:
+        answer_key, _ = load_answer_key(mode)
+        questions = question_columns(session_data, mode, answer_key)
 
-    output_df = pd.DataFrame(formatted_data)
-    # เรียงลำดับตาม student_id จากน้อยไปมาก
     try:
-        output_df["student_id_sort"] = output_df["student_id"].apply(lambda x: int(str(x).replace("-", "0")) if str(x).isdigit() or str(x).replace("-", "0").isdigit() else 999999999999)
-        output_df = output_df.sort_values("student_id_sort")
-        output_df = output_df.drop(columns=["student_id_sort"])
-    except Exception:
-        pass
-    csv_buffer = io.StringIO()
-    output_df.to_csv(csv_buffer, index=False, encoding="utf-8-sig")
-
-    csv_content = csv_buffer.getvalue()
-    mem = io.BytesIO()
-    mem.write("\ufeff".encode("utf-8"))
-    mem.write(csv_content.encode("utf-8"))
-    mem.seek(0)
-
-    app_logger.info(f"Downloaded single mode results as: {output_filename}.csv")
-    return send_file(
-        mem,
-        as_attachment=True,
-        download_name=f"{output_filename}.csv",
-        mimetype="text/csv; charset=utf-8",
-    )
+        body = stream_export(iter_export_rows(session_data, mode, questions), export_format)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 400
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    download_name = f"{output_filename}.{extension}"
+    app_logger.info(f"Downloaded {mode} mode results as: {download_name}")
+    response = Response(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    return response
 
 
-@app.route("/download_results_multi", methods=["POST"])
-def download_results_multi():
-    data = request.get_json()
-    results_data = data.get("results")
-    output_filename = data.get("filename", "omr_results_multi")
+@app.route("/download_results_single", methods=["GET", "POST"])
+def download_results_single():
+    return _download_results("single")
 
-    if not results_data:
-        return jsonify({"error": "No results data provided"}), 400
 
-    formatted_data = []
-    for item in results_data:
-        # ใช้ student_name เป็นหลัก เพราะเป็นข้อมูลที่อัปเดตล่าสุด
-        student_name = item.get("student_name", "")
-        
-        # ถ้า student_name ว่างหรือเป็น "ไม่พบชื่อ" ให้ลองใช้ fname/lname
-        if not student_name or student_name in ["ไม่พบชื่อ", "ไม่พบชื่อในรายชื่อ"]:
-            fname = item.get("fname", "")
-            lname = item.get("lname", "")
-            if fname and lname:
-                student_name = f"{fname} {lname}".strip()
-            elif fname:
-                student_name = fname
-        
-        # แยกชื่อและนามสกุลจาก student_name
-        if " " in student_name:
-            fname, lname = student_name.split(" ", 1)
+@app.route("/download_results_multi", methods=["GET", "POST"])
+def download_results_multi():
+    return _download_results("multi")
+
+
+# ตัวกรองสำหรับดาวน์โหลดรูปภาพที่ตรวจแล้ว
+IMAGE_EXPORT_FILTERS = {
+    "all": lambda r: True,
+    "issues": lambda r: r.get("has_issues", False) or "is_duplicate" not in r,
+    "duplicates": lambda r: r.get("is_duplicate", False),
+    "errors": lambda r: "is_duplicate" not in r,  # แถวที่ประมวลผลผิดพลาด
+    "attention": lambda r: r.get("needs_attention", False),  # ตรวจไม่สำเร็จ/เกินเวลา/อ่านตารางไม่ได้
+    "ok": lambda r: "is_duplicate" in r and not r.get("has_issues", False),
+}
+
+
+def _image_export_name(result, used_names, extension):
+    """ตั้งชื่อไฟล์ใน zip ตามรหัสนักศึกษา (เติมลำดับถ้าชื่อซ้ำ)"""
+    if "is_duplicate" in result:
+        base = secure_filename(str(result.get("student_id", ""))) or "unknown"
+    else:
+        base = f"ERROR_{os.path.splitext(result.get('student_file', ''))[0]}"
+    name = base
+    counter = 2
+    while name in used_names:
+        name = f"{base}_{counter}"
+        counter += 1
+    used_names.add(name)
+    return f"{name}{extension}"
+
+
+def _resolve_sheet_image(mode, result, session_upload_path, session_debug_path, answer_key):
+    """
+    หา path ของรูปที่ตรวจแล้วของแถวผลลัพธ์ คืนค่า (path, นามสกุลไฟล์) หรือ (None, None)
+    ถ้าไม่มีรูป highlight ความละเอียดเต็ม (ถูกลบตอนบีบอัดหรือคืนพื้นที่) จะวาดใหม่จากต้นฉบับ (lazy render)
+    ใช้เวอร์ชันเว็บ (JPEG ย่อขนาด) เฉพาะเมื่อวาดใหม่ไม่ได้
+    """
+    student_file = result.get("student_file", "")
+    upload_file = os.path.join(session_upload_path, student_file)
+    # นามสกุลตามเนื้อไฟล์จริง (รูปที่ถูกบีบอัดเป็น JPEG ยังใช้ชื่อเดิม)
+    stored_type = get_image_index(session_upload_path).stored_type(student_file)
+    upload_extension = stored_type[1] if stored_type else os.path.splitext(upload_file)[1].lower()
+    if "is_duplicate" not in result:
+        # ประมวลผลไม่สำเร็จ ส่งรูปต้นฉบับแทน
+        if os.path.exists(upload_file):
+            return upload_file, upload_extension
+        return None, None
+
+    highlighted_file = os.path.join(session_debug_path, f"highlighted_{mode}_{student_file}.png")
+    web_file = os.path.join(session_debug_path, f"web_highlighted_{mode}_{student_file}.png")
+    get_artifact_writer().flush(highlighted_file)
+    get_artifact_writer().flush(web_file)
+    if os.path.exists(highlighted_file):
+        return highlighted_file, ".png"
+    if os.path.exists(upload_file) and _render_highlighted(
+        mode, student_file, session_upload_path, session_debug_path, answer_key
+    ) and os.path.exists(highlighted_file):
+        return highlighted_file, ".png"
+    if os.path.exists(web_file):
+        return web_file, ".jpg"  # เวอร์ชันเว็บเป็น JPEG
+    if os.path.exists(upload_file):
+        return upload_file, upload_extension
+    app_logger.warning(f"No highlighted image for {student_file}")
+    return None, None
+
+
+def _render_highlighted(mode, student_file, session_upload_path, session_debug_path, answer_key):
+    """
+    สร้างรูป highlighted ใหม่ (ถูกลบเพื่อคืนพื้นที่ หรือยังไม่เคยสร้าง)
+    วาดจาก layout ที่เก็บตอนตรวจ รูปจึงตรงกับคะแนนที่บันทึกไว้แม้ต้นฉบับถูกบีบอัดแล้ว
+    แผ่นที่ตรวจก่อนมีการเก็บ layout จะถูกตรวจใหม่ทั้งแผ่น
+    """
+    try:
+        layout = load_layout(session_upload_path, student_file, mode)
+        if layout is None and answer_key is None:
+            return False  # ตรวจใหม่ไม่ได้เมื่อไม่มีเฉลย
+        with open(os.path.join(session_upload_path, student_file), "rb") as f:
+            image_bytes = f.read()
+        if layout is not None:
+            omr_system.render_from_layout(image_bytes, layout, student_file, mode, session_debug_path)
         else:
-            fname, lname = student_name, ""
-            
-        formatted_data.append(
-            {
-                "student_id": item.get("student_id", ""),
-                "fname": fname,
-                "lname": lname,
-                "score": item.get("score", 0),
-                "total": item.get("total", 0),
-                "status": item.get("status", ""),
-            }
-        )
+            omr_system.find_and_process_sheet(
+                image_bytes,
+                student_file,
+                mode=mode,
+                single_answer_key=answer_key if mode == "single" else None,
+                multi_answer_key=answer_key if mode == "multi" else None,
+                session_debug_folder=session_debug_path,
+            )
+        get_artifact_writer().flush(session_debug_path)
+        return True
+    except Exception as e:
+        app_logger.error(f"Could not render highlighted image for {student_file}: {e}")
+        return False
+
+
+def _download_images(mode):
+    """
+    ดาวน์โหลดรูปภาพที่ตรวจแล้วเป็นไฟล์ ZIP แบบ stream ตั้งชื่อตามรหัสนักศึกษา
+    query: filter=all|issues|duplicates|errors|attention|ok, filename
+    แผ่นที่ยังไม่มีรูป highlight จะถูกตรวจใหม่เพื่อสร้างรูปตอนที่ถูกเขียนลง zip
+    """
+    filter_name = request.args.get("filter", "all")
+    output_filename = request.args.get("filename") or f"omr_images_{mode}"
+    if filter_name not in IMAGE_EXPORT_FILTERS:
+        return jsonify({"error": f"Unknown filter: {filter_name}"}), 400
 
-    output_df = pd.DataFrame(formatted_data)
-    # เรียงลำดับตาม student_id จากน้อยไปมาก
     try:
-        output_df["student_id_sort"] = output_df["student_id"].apply(lambda x: int(str(x).replace("-", "0")) if str(x).isdigit() or str(x).replace("-", "0").isdigit() else 999999999999)
-        output_df = output_df.sort_values("student_id_sort")
-        output_df = output_df.drop(columns=["student_id_sort"])
-    except Exception:
-        pass
-    csv_buffer = io.StringIO()
-    output_df.to_csv(csv_buffer, index=False, encoding="utf-8-sig")
-
-    csv_content = csv_buffer.getvalue()
-    mem = io.BytesIO()
-    mem.write("\ufeff".encode("utf-8"))
-    mem.write(csv_content.encode("utf-8"))
-    mem.seek(0)
-
-    app_logger.info(f"Downloaded multi mode results as: {output_filename}.csv")
-    return send_file(
-        mem,
-        as_attachment=True,
-        download_name=f"{output_filename}.csv",
-        mimetype="text/csv; charset=utf-8",
-    )
+        session_data = get_session_data()
+        session_upload_path = get_session_path("uploads")
+        session_debug_path = get_session_path("debug_output")
+    except ValueError:
+        return jsonify({"error": "No active session"}), 400
+
+    results = [r for r in session_data.get(f"{mode}_results", []) if IMAGE_EXPORT_FILTERS[filter_name](r)]
+    if not results:
+        return jsonify({"error": "No images to download"}), 400
+    results.sort(key=lambda r: str(r.get("student_id", "")))
+
+    # โหลดเฉลยไว้ก่อนสำหรับสร้างรูปใหม่ (generator ทำงานนอก request context)
+    answer_key, _ = load_answer_key(mode)
+
+    def entries():
+        used_names = set()
+        for result in results:
+            path, extension = _resolve_sheet_image(
+                mode, result, session_upload_path, session_debug_path, answer_key
+            )
+            if path:
+                yield _image_export_name(result, used_names, extension), path
+
+    app_logger.info(f"Downloading {len(results)} {mode} mode images ({filter_name}) as zip")
+    response = Response(stream_zip(entries()), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(output_filename)}.zip"
+    return response
+
+
+@app.route("/download_images_single")
+def download_images_single():
+    return _download_images("single")
+
+
+@app.route("/download_images_multi")
+def download_images_multi():
+    return _download_images("multi")
+
+
+def _report_header(result):
+    """ข้อความ header ของแต่ละหน้าในรายงาน PDF"""
+    header = f"{result.get('student_id', '')}  {result.get('student_name', '')}"
+    header += f"  คะแนน {result.get('score', '')} / {result.get('total', '')}"
+    if result.get("is_duplicate"):
+        header += "  (รหัสซ้ำ)"
+    return header
+
+
+def _download_report(mode):
+    """
+    รายงาน PDF สำหรับพิมพ์: หนึ่งหน้าต่อแผ่นคำตอบ มี header รหัส ชื่อ และคะแนน
+    query: filter=all|issues|duplicates|errors|attention|ok, filename
+    """
+    filter_name = request.args.get("filter", "all")
+    output_filename = request.args.get("filename") or f"omr_report_{mode}"
+    if filter_name not in IMAGE_EXPORT_FILTERS:
+        return jsonify({"error": f"Unknown filter: {filter_name}"}), 400
+
+    try:
+        session_data = get_session_data()
+        session_upload_path = get_session_path("uploads")
+        session_debug_path = get_session_path("debug_output")
+    except ValueError:
+        return jsonify({"error": "No active session"}), 400
+
+    results = [r for r in session_data.get(f"{mode}_results", []) if IMAGE_EXPORT_FILTERS[filter_name](r)]
+    if not results:
+        return jsonify({"error": "No sheets to include in the report"}), 400
+    results.sort(key=lambda r: str(r.get("student_id", "")))
+
+    # โหลดเฉลยไว้ก่อนสำหรับสร้างรูปใหม่ (generator ทำงานนอก request context)
+    answer_key, _ = load_answer_key(mode)
+
+    def entries():
+        for result in results:
+            path, _ = _resolve_sheet_image(mode, result, session_upload_path, session_debug_path, answer_key)
+            yield _report_header(result), path
+
+    app_logger.info(f"Generating {mode} mode PDF report for {len(results)} sheets ({filter_name})")
+    response = Response(stream_pdf_report(entries()), mimetype="application/pdf")
+    response.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(output_filename)}.pdf"
+    return response
+
+
+@app.route("/download_report_single")
+def download_report_single():
+    return _download_report("single")
+
+
+@app.route("/download_report_multi")
+def download_report_multi():
+    return _download_report("multi")
 
 
 @app.route("/upload_student_list", methods=["POST"])
 def upload_student_list():
-    import csv
     import chardet
     try:
         if "student_list" not in request.files:
@@ -1321,57 +2239,12 @@ def upload_student_list():
             with open(student_list_path, "wb") as f:
                 f.write(file_bytes)
 
-        # ตรวจสอบและแปลงไฟล์ให้รองรับหลายรูปแบบ
-        students = []
-        with open(student_list_path, encoding="utf-8-sig") as f:
-            reader = csv.reader(f)
-            
-            # ตรวจสอบและข้าม header row
-            first_row = True
-            for row in reader:
-                if first_row:
-                    first_row = False
-                    # ตรวจสอบว่าแถวแรกเป็น header หรือไม่
-                    if (len(row) > 0 and 
-                        any(keyword in str(row[0]).upper() for keyword in ["STUDENT_CODE", "STUDENT_ID", "รหัส"]) or
-                        any(keyword in str(row[1]).upper() if len(row) > 1 else "" for keyword in ["FNAME_TH", "NAME", "ชื่อ"])):
-                        app_logger.info(f"Skipping header row: {row}")
-                        continue  # ข้าม header row
-                if not row or len(row) < 2:  # ข้ามแถวว่างหรือไม่ครบ
-                    continue
-                    
-                row = [col.strip() for col in row]
-                student_id = row[0]
-                
-                if len(row) >= 4:
-                    # รูปแบบ: รหัส, ชื่อ, นามสกุล, อื่นๆ
-                    fname = row[1]
-                    lname = row[2]
-                    fullname = fname + " " + lname
-                elif len(row) == 3:
-                    # รูปแบบ: รหัส, ชื่อ, นามสกุล
-                    fname = row[1]
-                    lname = row[2]
-                    fullname = fname + " " + lname
-                elif len(row) == 2:
-                    # รูปแบบ: รหัส, ชื่อเต็ม (รูปแบบของไฟล์ปัจจุบัน)
-                    fullname = row[1]
-                    fname = fullname
-                    lname = ""
-                else:
-                    continue
-                    
-                students.append({
-                    "student_id": student_id.strip(),
-                    "name": fullname.strip(),
-                    "fname": fname.strip(),
-                    "lname": lname.strip()
-                })
-
-        # บันทึก students ลง session_data
+        # parse รายชื่อครั้งเดียวตอนอัปโหลด และเก็บ index ไว้ใน cache
+        roster = build_roster(student_list_path)
+
         session_data = get_session_data()
         session_data["student_list_filename"] = file.filename
-        session_data["student_list"] = students  # เพิ่มบรรทัดนี้เพื่อบันทึกรายชื่อ
+        session_data.pop("student_list", None)  # รายชื่ออ่านจาก roster cache แทน
         save_session_data(session_data)
 
         app_logger.info(
@@ -1382,7 +2255,7 @@ def upload_student_list():
                 "success": True,
                 "message": "บันทึกรายชื่อนักเรียนสำเร็จ",
                 "filename": file.filename,
-                "count": len(students),
+                "count": len(roster),
             }
         )
     except ValueError:
@@ -1394,37 +2267,16 @@ def upload_student_list():
 
 @app.route("/view_student_list")
 def view_student_list():
-    import csv
     try:
         config_path = get_session_path("config")
         student_list_path = os.path.join(config_path, "student_list.csv")
         if not os.path.exists(student_list_path):
             return jsonify({"success": False, "message": "ไม่พบไฟล์รายชื่อนักศึกษา"})
 
-        students = []
-        with open(student_list_path, encoding="utf-8-sig") as f:
-            reader = csv.reader(f)
-            header = next(reader, None)  # ข้าม header
-            for row in reader:
-                row = [col.strip() for col in row]
-                if len(row) >= 4:
-                    student_id = row[0]
-                    fname = row[1]
-                    lname = row[2]
-                    fullname = fname + " " + lname
-                elif len(row) == 3:
-                    student_id = row[0]
-                    fname = row[1]
-                    lname = ""
-                    fullname = fname
-                elif len(row) == 2:
-                    student_id = row[0]
-                    fname = row[1]
-                    lname = ""
-                    fullname = fname
-                else:
-                    continue
-                students.append({"student_id": student_id, "name": fullname, "fname": fname, "lname": lname})
+        students = [
+            {"student_id": s["student_id"], "name": s["name"], "fname": s["fname"], "lname": s["lname"]}
+            for s in get_roster().students
+        ]
         return jsonify({"success": True, "data": students})
     except ValueError:
         return jsonify({"success": False, "message": "No active session"})
@@ -1458,8 +2310,10 @@ def delete_images():
             except Exception as e:
                 app_logger.error(f"Error deleting {filepath}: {e}")
 
-    msg = json.dumps({"event": "delete_images", "data": filenames})
-    announcer.announce(msg=f"data: {msg}\n\n")
+    get_image_index(session_upload_path).remove(filenames)
+    # พื้นที่ลดลง: สแกนใหม่ตอนตรวจโควตาครั้งถัดไป (ไม่ต้องรอรอบ sweep)
+    get_storage().invalidate(session["session_id"])
+    publish_change(session["session_id"], "delete_images", data=filenames, keys=filenames)
 
     return jsonify({"message": f"Deleted {deleted_count} files."})
 
@@ -1507,6 +2361,39 @@ def download_template():
     )
 
 
+@app.route("/capture_settings")
+def capture_settings():
+    """
+    ขนาดและคุณภาพรูปที่ engine ใช้ตรวจ ให้หน้าถ่ายภาพย่อและบีบอัดรูปบนมือถือก่อนอัปโหลด
+    (รูปที่ใหญ่กว่านี้จะถูกย่อบนเซิร์ฟเวอร์อยู่แล้ว จึงไม่ต้องส่งความละเอียดเต็ม)
+    """
+    return jsonify(
+        {
+            "max_dimension": PROCESSING_MAX_DIMENSION,
+            "jpeg_quality": CAPTURE_JPEG_QUALITY,
+            "mime_type": "image/jpeg",
+            "preview_max_dimension": PREVIEW_MAX_DIMENSION,
+        }
+    )
+
+
+@app.route("/check_sheet_preview", methods=["POST"])
+def check_sheet_preview():
+    """
+    ตรวจรูป preview ขนาดเล็ก (ส่ง body เป็นรูปโดยตรง) ว่าเห็นบล็อกรหัสและคอลัมน์คำตอบครบ 4 คอลัมน์ และไม่เบลอ
+    ให้หน้าถ่ายภาพแจ้งให้ถ่ายใหม่ก่อนอัปโหลดรูปเต็ม
+    """
+    if request.content_length and request.content_length > MAX_PREVIEW_SIZE:
+        return jsonify({"error": "Preview image is too large"}), 413
+    image_bytes = request.get_data(cache=False)
+    if not image_bytes:
+        return jsonify({"error": "No image"}), 400
+    try:
+        return jsonify(omr_system.check_sheet_presence(image_bytes))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @app.route("/check_pdf_support", methods=["GET"])
 def check_pdf_support():
     return jsonify(
@@ -1546,11 +2433,12 @@ def clean_images():
                 cleaned_files.append(filename)
 
     if cleaned_count > 0:
-        msg_data = {
-            "event": "images_cleaned",
-            "data": {"filenames": cleaned_files, "timestamp": int(time.time())},
-        }
-        announcer.announce(msg=f"data: {json.dumps(msg_data)}\n\n")
+        publish_change(
+            session["session_id"],
+            "images_cleaned",
+            data={"filenames": cleaned_files, "timestamp": int(time.time())},
+            keys=cleaned_files,
+        )
 
     return jsonify({"message": f"Cleaned {cleaned_count} images."})
 
@@ -1596,7 +2484,7 @@ def optimize_images():
                     "optimized_count": optimized_count,
                     "total_count": len(image_files),
                 }
-                announcer.announce(msg=f"data: {json.dumps(msg_data)}\n\n")
+                announcer.announce(msg=f"data: {json.dumps(msg_data)}\n\n", session_id=session["session_id"])
                 
         except Exception as e:
             app_logger.error(f"Error optimizing {filename}: {e}")
@@ -1626,15 +2514,53 @@ def get_student_list():
     return jsonify({"has_student_list": False, "filename": None})
 
 
+def _is_existing_session(session_id):
+    """
+    session_id จาก URL มีรูปแบบถูกต้องและมีโฟลเดอร์ uploads อยู่แล้ว
+    route ไฟล์ไม่ต้อง login จึงต้องไม่สร้างโฟลเดอร์หรือ cache ให้ session ที่ไม่มีจริง
+    """
+    return bool(SESSION_ID_PATTERN.match(session_id)) and os.path.isdir(os.path.join(UPLOAD_FOLDER, session_id))
+
+
 @app.route("/uploads/<session_id>/<filename>")
 def uploaded_file(session_id, filename):
+    if not _is_existing_session(session_id):
+        return jsonify({"error": "File not found"}), 404
     session_upload_path = os.path.join(app.config["UPLOAD_FOLDER"], session_id)
-    return send_from_directory(session_upload_path, filename)
+    path = os.path.join(session_upload_path, secure_filename(filename))
+    if filename.startswith("web_") and not os.path.exists(path):
+        # รูปย่อถูกลบเพื่อคืนพื้นที่: สร้างใหม่จากต้นฉบับ
+        original = os.path.join(session_upload_path, secure_filename(filename[4:]))
+        if os.path.exists(original):
+            try:
+                with Image.open(original) as img:
+                    web_image_data = create_web_optimized_image(img, max_width=800, quality=60)
+                with open(path, "wb") as f:
+                    f.write(web_image_data)
+            except Exception as e:
+                app_logger.warning(f"Could not regenerate {filename}: {e}")
+    get_storage().record_access(path)
+    # รูปที่ถูกบีบอัดเป็น JPEG ใช้ชื่อไฟล์เดิม: ส่ง MIME ตามเนื้อไฟล์ที่บันทึกใน index
+    stored_type = get_image_index(session_upload_path).stored_type(secure_filename(filename))
+    return send_from_directory(session_upload_path, filename, mimetype=stored_type[0] if stored_type else None)
 
 
 @app.route("/debug_output/<session_id>/<filename>")
 def debug_file(session_id, filename):
+    if not _is_existing_session(session_id):
+        return jsonify({"error": "File not found"}), 404
     session_debug_path = os.path.join(DEBUG_FOLDER, session_id)
+    path = os.path.join(session_debug_path, secure_filename(filename))
+    get_artifact_writer().flush(path)
+    match = HIGHLIGHTED_FILE_PATTERN.match(filename)
+    if match and not os.path.exists(path):
+        # รูปผลตรวจถูกลบเพื่อคืนพื้นที่: วาดใหม่จาก layout ที่เก็บตอนตรวจ
+        mode, student_file = match.group(2), match.group(3)
+        with _session_context(session_id):
+            answer_key, err = load_answer_key(mode)
+            if answer_key is not None:
+                _render_highlighted(mode, student_file, get_session_path("uploads"), session_debug_path, answer_key)
+    get_storage().record_access(path)
     return send_from_directory(session_debug_path, filename)
 
 
@@ -1709,10 +2635,12 @@ def generate_qr_code():
 @app.route("/clear_session", methods=["POST"])
 def clear_session():
     try:
-        # ล้างข้อมูลในโฟลเดอร์ uploads, debug_output, config ของ session ปัจจุบัน
-        for folder_type in ["uploads", "debug_output", "config"]:
-            folder_path = get_session_path(folder_type)
-            clear_folder(folder_path)
+        # ล้างข้อมูลในโฟลเดอร์ uploads, debug_output, config ของ session ปัจจุบัน (ลบไฟล์จริงในเบื้องหลัง)
+        if "session_id" not in session:
+            raise ValueError("Cannot clear session data without an active session.")
+        get_storage().discard_session(session["session_id"], recreate=True)
+        publish_change(session["session_id"], "clear")
+        _forget_session_state(session["session_id"])
         app_logger.info(f"Cleared data for session: {session.get('session_id')}")
         return jsonify({"success": True, "message": "Session data cleared, session_id preserved."})
     except Exception as e:
@@ -1720,6 +2648,103 @@ def clear_session():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+_compaction_lock = threading.Lock()
+_compaction_jobs = {}  # session_id -> {"running", "processed", "total", "report"}
+
+
+def _run_compaction(session_id):
+    """บีบอัดรูปต้นฉบับที่ตรวจแล้วของ session (เรียกจาก thread เบื้องหลัง)"""
+    job = _compaction_jobs[session_id]
+
+    def on_progress(processed, total):
+        job.update(processed=processed, total=total)
+
+    try:
+        with _session_context(session_id):
+            session_upload_path = get_session_path("uploads")
+            session_data = get_session_data()
+            graded_files = {
+                row.get("student_file")
+                for mode in ("single", "multi")
+                for row in session_data.get(f"{mode}_results", [])
+                if "is_duplicate" in row  # ข้ามแถวที่ประมวลผลผิดพลาด (อาจต้องตรวจใหม่ด้วยต้นฉบับ)
+            }
+            graded_files.discard(None)
+            # รูปที่ยังเขียนไม่เสร็จจะถูกเขียนหลังลบ ถ้าไม่รอก่อน
+            get_artifact_writer().flush(get_session_path("debug_output"))
+            report = compact_session(
+                session_upload_path,
+                get_session_path("debug_output"),
+                graded_files,
+                image_index=get_image_index(session_upload_path),
+                on_progress=on_progress,
+            )
+        get_storage().invalidate(session_id)
+        app_logger.info(f"Compacted session {session_id}: reclaimed {report['bytes_reclaimed']} bytes ({report})")
+    except Exception as e:
+        app_logger.error(f"Compaction of session {session_id} failed: {e}")
+        report = {"error": str(e)}
+    job.update(running=False, report=report)
+    msg_data = {"event": "compaction_done", "report": report, "session_id": session_id}
+    announcer.announce(msg=f"data: {json.dumps(msg_data)}\n\n", session_id=session_id)
+
+
+@app.route("/compact_session", methods=["GET", "POST"])
+def compact_session_storage():
+    """
+    POST: เริ่มบีบอัดพื้นที่ของ session ที่ตรวจเสร็จแล้ว (ย่อรูปต้นฉบับที่ตรวจแล้วเหลือความละเอียดที่ใช้ตรวจ
+    บีบอัดเป็น JPEG และลบรูปผลตรวจความละเอียดเต็ม/รูป debug ที่สร้างใหม่ได้) ทำงานในเบื้องหลัง
+    GET: สถานะและรายงานจำนวน byte ที่ได้คืนของครั้งล่าสุด
+    """
+    session_id = session.get("session_id")
+    if not session_id:
+        return jsonify({"error": "No active session"}), 400
+
+    with _compaction_lock:
+        job = _compaction_jobs.get(session_id)
+        if request.method == "GET":
+            return jsonify(job or {"running": False, "report": None})
+        if job and job["running"]:
+            return jsonify(job), 409
+        job = {"running": True, "processed": 0, "total": 0, "report": None}
+        _compaction_jobs[session_id] = job
+    threading.Thread(target=_run_compaction, args=(session_id,), daemon=True).start()
+    return jsonify(job), 202
+
+
+@app.route("/engine_stats")
+def engine_stats():
+    """จำนวนครั้งที่แต่ละ tier ของการหาบล็อกและเส้นตารางสำเร็จ (ตั้งแต่เริ่มเซิร์ฟเวอร์)"""
+    return jsonify(omr_system.tier_statistics())
+
+
+@app.route("/storage_status")
+def storage_status():
+    """พื้นที่ดิสก์ที่ session นี้และทั้งระบบใช้ เทียบกับโควตา และสถานะคิวเขียนรูปผลตรวจ"""
+    status = get_storage().status(session.get("session_id"))
+    status["artifact_writer"] = get_artifact_writer().status()
+    status["debug_bundles_written"] = get_debug_capture().bundles_written
+    return jsonify(status)
+
+
+@app.route("/sw.js")
+def service_worker():
+    """
+    service worker ต้องเสิร์ฟจาก root เพื่อควบคุมทุกหน้า
+    ใส่รายการไฟล์ที่มี fingerprint และเวอร์ชันไว้ต้นไฟล์ เนื้อไฟล์จึงเปลี่ยน (เบราว์เซอร์อัปเดต worker) เมื่อ static เปลี่ยน
+    """
+    precache_urls = [url_for("static", filename=filename) for filename in PRECACHE_ASSETS]
+    with open(os.path.join(app.static_folder, "js", "service_worker.js"), encoding="utf-8") as f:
+        source = f.read()
+    prelude = (
+        f"const CACHE_VERSION = {json.dumps(assets_version(app.static_folder))};\n"
+        f"const PRECACHE_URLS = {json.dumps(precache_urls)};\n"
+    )
+    response = Response(prelude + source, mimetype="application/javascript")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 @app.route("/favicon.ico")
 def favicon():
     return send_from_directory(
@@ -1827,17 +2852,14 @@ def get_student_name_by_id():
         if not student_id:
             return jsonify({"success": False, "error": "Missing student_id"}), 400
             
-        session_data = get_session_data()
-        student_list = session_data.get("student_list", [])
-        
-        # ค้นหานักศึกษาในรายชื่อ
-        for student in student_list:
-            if str(student.get("student_id", "")).strip() == str(student_id).strip():
-                return jsonify({
-                    "success": True,
-                    "student_name": student.get("name", ""),
-                    "student_id": student_id
-                })
+        # ค้นหานักศึกษาในรายชื่อ (hash lookup)
+        student = get_roster().get(student_id)
+        if student:
+            return jsonify({
+                "success": True,
+                "student_name": student["name"],
+                "student_id": student_id
+            })
         
         return jsonify({"success": False, "error": "Student not found"})
         
@@ -1856,96 +2878,34 @@ def get_available_students():
         
         app_logger.info(f"get_available_students called with mode: {mode}, current_student_id: {current_student_id}")
         
-        session_data = get_session_data()
-        student_list = session_data.get("student_list", [])
-        
-        if not student_list:
+        roster = get_roster()
+        if not len(roster):
             return jsonify({"success": False, "error": "No student list found"})
         
-        # ดึงรายชื่อที่ใช้งานแล้วจากผลลัพธ์
-        results_key = f"{mode}_results"
-        used_student_ids = set()
-        
-        if results_key in session_data:
-            for result in session_data[results_key]:
-                student_id = str(result.get("student_id", "")).strip()
-                if student_id and student_id != "ERROR" and student_id != "-":
-                    used_student_ids.add(student_id)
-        
-        app_logger.info(f"Found {len(used_student_ids)} used student IDs: {list(used_student_ids)}")
+        # ดึงรายชื่อที่ใช้งานแล้วจากผลลัพธ์ (cache ตาม mtime ของ session data)
+        used_student_ids = set(get_used_student_ids(get_session_data(), mode))
         
         # ถ้ากำลังแก้ไขนักศึกษาคนใดคนหนึ่ง ให้ไม่นับรหัสเดิมของเขาเป็นที่ใช้งานแล้ว
         if current_student_id:
             used_student_ids.discard(str(current_student_id).strip())
-            app_logger.info(f"Removed current student {current_student_id} from used list. Remaining: {list(used_student_ids)}")
         
-        # สร้างรายชื่อที่ยังไม่ได้ใช้งาน (ข้าม header row)
-        available_students = []
-        for i, student in enumerate(student_list):
-            # ข้ามแถวแรกที่เป็น header
-            if i == 0:
-                # ตรวจสอบว่าแถวแรกเป็น header หรือไม่
-                student_id_value = str(student.get("student_id", "")).strip().lower()
-                name_value = str(student.get("name", "")).strip().lower()
-                
-                # รายการคำที่บ่งบอกว่าเป็น header
-                header_keywords_id = [
-                    "student_id", "student_code", "รหัสนักศึกษา", "รหัส", "id", "รหัสประจำตัว",
-                    "code", "std_code", "student_no"
-                ]
-                header_keywords_name = [
-                    "name", "ชื่อ", "student_name", "ชื่อนักศึกษา", "ชื่อ-สกุล", "ชื่อสกุล",
-                    "fname_th", "std_lname_th", "firstname", "lastname", "fullname"
-                ]
-                
-                # ตรวจสอบทั้งค่าตรงและค่าที่มีคำสำคัญ
-                is_header = (
-                    student_id_value in header_keywords_id or 
-                    name_value in header_keywords_name or
-                    any(keyword in student_id_value for keyword in ["student_code", "student_id", "code"]) or
-                    any(keyword in name_value for keyword in ["fname_th", "std_lname_th", "name"])
-                )
-                
-                if is_header:
-                    app_logger.info(f"Skipping header row: student_id='{student_id_value}', name='{name_value}'")
-                    continue  # ข้าม header row
-            
-            student_id = str(student.get("student_id", "")).strip()
-            student_name = str(student.get("name", "")).strip()
-            
-            # ตรวจสอบว่าเป็นข้อมูลที่ถูกต้อง (ไม่ใช่ header หรือข้อมูลเปล่า)
-            header_keywords = [
-                "student_id", "student_code", "รหัสนักศึกษา", "รหัส", "id", 
-                "fname_th", "std_lname_th", "name", "ชื่อ", "code"
-            ]
-            
-            # ตรวจสอบว่าไม่ใช่ header และไม่ใช่ข้อมูลเปล่า
-            is_valid_student = (
-                student_id and student_name and 
-                student_id not in used_student_ids and
-                student_id.lower() not in header_keywords and
-                student_name.lower() not in header_keywords and
-                not any(keyword in student_id.lower() for keyword in ["student_code", "student_id", "fname_th", "std_lname_th"]) and
-                not any(keyword in student_name.lower() for keyword in ["student_code", "student_id", "fname_th", "std_lname_th"]) and
-                len(student_id) > 3  # รหัสนักศึกษาต้องมีความยาวมากกว่า 3 ตัวอักษร
-            )
-            
-            if is_valid_student:
-                available_students.append({
-                    "student_id": student_id,
-                    "name": student_name,
-                    "display_text": f"{student_id} - {student_name}"
-                })
-        
-        # เรียงตามรหัสนักศึกษา
-        available_students.sort(key=lambda x: x["student_id"])
+        # รายชื่อที่เลือกได้ถูกกรอง header และเรียงตามรหัสไว้แล้วตอน parse
+        available_students = [
+            {
+                "student_id": student["student_id"],
+                "name": student["name"],
+                "display_text": f"{student['student_id']} - {student['name']}"
+            }
+            for student in roster.selectable
+            if student["student_id"] not in used_student_ids
+        ]
         
-        app_logger.info(f"Returning {len(available_students)} available students out of {len(student_list)} total")
+        app_logger.info(f"Returning {len(available_students)} available students out of {len(roster)} total")
         
         return jsonify({
             "success": True,
             "students": available_students,
-            "total_students": len(student_list),
+            "total_students": len(roster),
             "used_count": len(used_student_ids),
             "available_count": len(available_students)
         })
@@ -1955,14 +2915,235 @@ def get_available_students():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-@app.route("/update_student_score", methods=["POST"])
+@app.route("/search_students")
+def search_students():
+    """ค้นหานักศึกษาด้วย prefix ของรหัส สำหรับช่องเลือกรหัสในหน้าแก้ไขคะแนน"""
+    prefix = request.args.get("q", "").strip()
+    mode = request.args.get("mode", "single")
+    available_only = request.args.get("available_only", "true").lower() == "true"
+    current_student_id = request.args.get("current_student_id", "").strip()
+    limit = min(request.args.get("limit", 20, type=int), 200)
+
+    try:
+        roster = get_roster()
+        exclude = None
+        if available_only:
+            exclude = set(get_used_student_ids(get_session_data(), mode))
+            exclude.discard(current_student_id)
+
+        students = [
+            {
+                "student_id": student["student_id"],
+                "name": student["name"],
+                "display_text": f"{student['student_id']} - {student['name']}"
+            }
+            for student in roster.prefix_search(prefix, exclude=exclude, limit=limit)
+        ]
+        return jsonify({"success": True, "students": students})
+    except ValueError:
+        return jsonify({"success": False, "error": "No active session"}), 400
+    except Exception as e:
+        app_logger.error(f"Error searching students: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+def _grade_answers(answer_key, answers):
+    """คำนวณคะแนนใหม่จากคำตอบที่แก้ไข คืนค่า (คะแนน, คำตอบสำหรับบันทึก, จำนวนข้อที่กาหลายคำตอบ)"""
+    score = 0
+    multiple_answers_count = 0
+    answers_for_storage = {}
+    for q_num_str, student_data in answers.items():
+        q_num = int(q_num_str)
+        student_answers = set(student_data.get("answers", []))
+
+        # ตรวจด้วย bitmask ของเฉลยที่คอมไพล์แล้ว
+        status = answer_key.grade(q_num, student_answers)
+        if status == "correct":
+            score += 1
+        elif status == "multiple_answers":
+            multiple_answers_count += 1
+
+        answers_for_storage[str(q_num)] = {
+            "answers": list(student_answers),
+            "status": status,
+            "has_multiple_answers": len(student_answers) > 1,
+        }
+    return score, answers_for_storage, multiple_answers_count
+
+
+def _invalid_answers(answers):
+    """ข้อความผิดพลาดของคำตอบที่แก้ไข (เลขข้อหรือตัวเลือกไม่ถูกต้อง) หรือ None ถ้าถูกต้องทั้งหมด"""
+    for q_num, student_data in answers.items():
+        try:
+            if int(q_num) < 1:
+                raise ValueError
+        except (TypeError, ValueError):
+            return f"เลขข้อ {q_num!r} ไม่ถูกต้อง"
+        if not isinstance(student_data, dict):
+            return f"ข้อ {q_num}: รูปแบบคำตอบไม่ถูกต้อง"
+        try:
+            validate_choices(student_data.get("answers", []))
+        except ValueError as e:
+            return f"ข้อ {q_num}: {e}"
+    return None
+
+
+def _find_result_row(results, rows_by_file, correction):
+    """หาแถวผลลัพธ์ที่จะแก้ไข: ใช้ student_file ก่อน แล้วค่อยใช้รหัสเดิม/รหัสใหม่"""
+    student_file = correction.get("student_file")
+    if student_file:
+        return rows_by_file.get(student_file)
+    for key in ("original_student_id", "student_id"):
+        student_id = correction.get(key)
+        if student_id:
+            row = next((r for r in results if str(r.get("student_id", "")) == str(student_id)), None)
+            if row is not None:
+                return row
+    return None
+
+
+def _apply_score_corrections(session_data, mode, answer_key, corrections):
+    """
+    แก้ไขรหัสนักศึกษาและคำตอบหลายรายการใน session_data (ยังไม่บันทึก)
+    แต่ละรายการ: student_file (หรือ original_student_id), student_id ใหม่, student_name,
+    answers (คำตอบทั้งหมด) หรือ overrides ({ข้อ: [ตัวเลือก]}) เฉพาะข้อที่แก้
+    คืนค่า (student_file ที่เปลี่ยน, รายละเอียดของแต่ละรายการ, ข้อผิดพลาด)
+    """
+    results = session_data.get(f"{mode}_results", [])
+    rows_by_file = {r.get("student_file"): r for r in results}
+    detailed_answers = session_data.setdefault(f"{mode}_detailed_answers", {})
+    roster = get_roster()
+    changed_files = set()
+    applied = []
+    errors = []
+
+    # ตรวจทุกรายการก่อนแก้ไขอะไร: ถ้ามีรายการใดผิดพลาด session data และ index ยังเหมือนเดิม
+    resolved = []
+    for index, correction in enumerate(corrections):
+        row = _find_result_row(results, rows_by_file, correction)
+        if row is None:
+            errors.append({"index": index, "error": "Student not found in results"})
+            continue
+
+        old_id = str(row.get("student_id", ""))
+        answers = correction.get("answers")
+        overrides = correction.get("overrides") or {}
+        if not isinstance(answers, (dict, type(None))) or not isinstance(overrides, dict):
+            errors.append({"index": index, "error": "answers และ overrides ต้องเป็น object {ข้อ: ...}"})
+            continue
+        if answers is None:
+            stored = detailed_answers.get(old_id, {})
+            answers = {str(q): {"answers": d.get("answers", [])} for q, d in stored.items()}
+        else:
+            answers = {str(q): d for q, d in answers.items()}
+        for q_num, choices in overrides.items():
+            answers[str(q_num)] = {"answers": choices}
+        if not answers:
+            errors.append({"index": index, "error": f"No answers found for student {old_id}"})
+            continue
+        answers_error = _invalid_answers(answers)
+        if answers_error:
+            errors.append({"index": index, "error": answers_error})
+            continue
+        resolved.append((correction, row, old_id, answers))
+    if errors:
+        return changed_files, applied, errors, None
+
+    # แก้ไขสำเนาของ index ใน cache (ถ้าเกิดข้อผิดพลาดกลางทาง index ใน cache ไม่ถูกแก้ไขไปบางส่วน)
+    duplicate_index = get_duplicate_index(session_data, mode).copy()
+    for correction, row, old_id, answers in resolved:
+        new_id = str(correction.get("student_id") or old_id).strip()
+        new_score, answers_for_storage, multiple_answers_count = _grade_answers(answer_key, answers)
+        detailed_answers[new_id] = answers_for_storage
+
+        row["student_id"] = new_id
+        student_name = correction.get("student_name")
+        if student_name and student_name != "ไม่พบชื่อในรายชื่อ":
+            row["student_name"] = student_name
+        elif new_id != old_id and roster.get(new_id):
+            row["student_name"] = roster.get(new_id)["name"]
+        row["score"] = new_score
+        row["total"] = len(answer_key)
+        if mode == "single":
+            row["multiple_answers_count"] = multiple_answers_count
+        if new_id != old_id:
+            row.pop("possible_reshot_of", None)  # แก้รหัสแล้ว ไม่ใช่แผ่นเดียวกับไฟล์เดิม
+
+        changed_files.add(row.get("student_file"))
+        if "is_duplicate" in row:
+            changed_files |= duplicate_index.reassign(row.get("student_file"), new_id)
+        applied.append({
+            "student_file": row.get("student_file"),
+            "original_student_id": old_id,
+            "student_id": new_id,
+            "new_score": new_score,
+        })
 
+    # ตั้งค่าสถานะรหัสซ้ำเฉพาะแถวที่ได้รับผลกระทบ
+    for student_file in changed_files:
+        if student_file in rows_by_file:
+            apply_duplicate_flags(rows_by_file[student_file], duplicate_index, mode)
+    return changed_files, applied, errors, duplicate_index
+
+
+def _commit_score_corrections(mode, corrections):
+    """
+    แก้ไขหลายรายการใน transaction เดียว: โหลดเฉลยและ session data ครั้งเดียว
+    ถ้ามีรายการใดผิดพลาดจะไม่บันทึกอะไรเลย
+    คืนค่า (response dict, status code)
+    """
+    answer_key, err = load_answer_key(mode)
+    if err:
+        return {"success": False, "error": err}, 400
+
+    with score_update_lock:
+        session_data = get_session_data()
+        changed_files, applied, errors, duplicate_index = _apply_score_corrections(
+            session_data, mode, answer_key, corrections
+        )
+        if errors:
+            return {"success": False, "error": "Some corrections could not be applied", "errors": errors}, 400
+        save_session_data(session_data)
+        remember_duplicate_index(mode, duplicate_index)
+
+    changed_rows = [
+        r for r in session_data.get(f"{mode}_results", []) if r.get("student_file") in changed_files
+    ]
+    seq = None
+    if changed_rows:
+        seq = publish_change(
+            session["session_id"], "result_updated", data=changed_rows, mode=mode, keys=changed_files
+        )
+    return {"success": True, "applied": applied, "rows": changed_rows, "seq": seq}, 200
+
+
+@app.route("/get_conflicts")
+def get_conflicts():
+    """รายการรหัสนักศึกษาที่ซ้ำกันพร้อมแถวผลลัพธ์ของแต่ละไฟล์"""
+    mode = request.args.get("mode", "single")
+    try:
+        # index ใน cache ถูกแก้ไขภายใต้ score_update_lock: อ่าน snapshot ภายใต้ล็อกเดียวกัน
+        with score_update_lock:
+            session_data = get_session_data()
+            conflicts_by_id = get_duplicate_index(session_data, mode).conflicts()
+    except ValueError:
+        return jsonify({"error": "No active session"}), 400
+
+    rows_by_file = {r.get("student_file"): r for r in session_data.get(f"{mode}_results", [])}
+    conflicts = [
+        {"student_id": student_id, "rows": [rows_by_file[f] for f in files if f in rows_by_file]}
+        for student_id, files in sorted(conflicts_by_id.items())
+    ]
+    seq = change_log.current_seq(session["session_id"])
+    return jsonify({"conflicts": conflicts, "seq": seq})
+
+
+@app.route("/update_student_score", methods=["POST"])
 def update_student_score():
     """อัพเดตคะแนนของนักศึกษา"""
     try:
         data = request.get_json()
         student_id = data.get("student_id")
-        student_name = data.get("student_name")
         mode = data.get("mode")
         original_student_id = data.get("original_student_id")
         # Front-end sends the entire answer object
@@ -1973,136 +3154,29 @@ def update_student_score():
             
         app_logger.info(f"Received update request - student_id: {student_id}, original_id: {original_student_id}, mode: {mode}")
 
-        # โหลด answer key
-        answer_key, err = load_answer_key(mode)
-        if err:
-            return jsonify({"success": False, "error": err}), 400
-
-        # คำนวณคะแนนใหม่และอัปเดตสถานะ
-        new_score = 0
-        total_questions = len(answer_key)
-        updated_answers_for_storage = {}
-        multiple_answers_count = 0  # นับจำนวนข้อที่กาหลายคำตอบ
-
-        for q_num_str, student_data in answers_from_fe.items():
-            q_num = int(q_num_str)
-            student_answers = set(student_data.get("answers", []))
-            has_multiple_answers = len(student_answers) > 1  # ตรวจสอบว่ามีการกาหลายคำตอบหรือไม่
-
-            correct_answer = answer_key.get(q_num)
-            status = "incorrect"
-
-            if correct_answer is not None:
-                if mode == "single":
-                    if (
-                        len(student_answers) == 1
-                        and list(student_answers)[0] == correct_answer
-                    ):
-                        status = "correct"
-                    elif has_multiple_answers:
-                        status = "multiple_answers"
-                        multiple_answers_count += 1
-                else:  # multi mode
-                    correct_set = set(correct_answer)
-                    if student_answers == correct_set:
-                        status = "correct"
-                    elif student_answers and student_answers.issubset(correct_set):
-                        status = "partial"
-
-            if status == "correct":
-                new_score += 1
-
-            updated_answers_for_storage[q_num] = {
-                "answers": list(student_answers),
-                "status": status,
-                "has_multiple_answers": has_multiple_answers,
-            }
-
-        # บันทึกข้อมูลลง session
-        session_data = get_session_data()
-
-        # อัพเดตข้อมูลคำตอบรายละเอียด
-        detailed_answers_key = f"{mode}_detailed_answers"
-        if detailed_answers_key not in session_data:
-            session_data[detailed_answers_key] = {}
-        session_data[detailed_answers_key][student_id] = updated_answers_for_storage
-        
-        app_logger.info(f"Updating score for student_id: {student_id}, student_name: {student_name}")
-
-        # อัพเดตคะแนนในผลลัพธ์หลัก
-        results_key = f"{mode}_results"
-        student_found = False
-        if results_key in session_data:
-            for i, result in enumerate(session_data[results_key]):
-                # ค้นหาด้วย student_id เดิมหรือใหม่
-                current_id = str(result.get("student_id", ""))
-                if (current_id == str(student_id) or 
-                    (original_student_id and current_id == str(original_student_id))):
-                    
-                    if not original_student_id:
-                        original_student_id = result.get("student_id")  # เก็บค่าเดิมไว้
-                    
-                    # อัพเดตรหัสนักศึกษา
-                    session_data[results_key][i]["student_id"] = student_id  # อัพเดทเป็นค่าใหม่
-                    if student_name and student_name != 'ไม่พบชื่อในรายชื่อ':
-                        session_data[results_key][i]["student_name"] = student_name
-                    session_data[results_key][i]["score"] = new_score
-                    session_data[results_key][i]["total"] = total_questions
-                    
-                    # ตรวจสอบและอัพเดตสถานะ is_duplicate
-                    # 1. ตรวจสอบว่ารหัสใหม่ซ้ำกับรหัสอื่นหรือไม่
-                    new_id_is_duplicate = False
-                    for other_result in session_data[results_key]:
-                        if (str(other_result.get("student_id", "")) == str(student_id) and 
-                            other_result.get("student_file") != result.get("student_file")):
-                            new_id_is_duplicate = True
-                            # ตั้งแฟล็กรหัสซ้ำให้กระดาษที่มีรหัสเดียวกันด้วย
-                            other_result["is_duplicate"] = True
-                            break
-                    
-                    # 2. ตรวจสอบว่ารหัสเดิมยังมีกระดาษอื่นที่ซ้ำกันหรือไม่
-                    old_id_count = 0
-                    old_id_papers = []
-                    if original_student_id and str(original_student_id) != str(student_id):
-                        for j, other_result in enumerate(session_data[results_key]):
-                            if str(other_result.get("student_id", "")) == str(original_student_id):
-                                old_id_count += 1
-                                old_id_papers.append(j)
-                        
-                        # ถ้ารหัสเดิมเหลือแค่ 1 ใบ ให้เปลี่ยน is_duplicate = false
-                        if old_id_count == 1:
-                            session_data[results_key][old_id_papers[0]]["is_duplicate"] = False
-                            app_logger.info(f"Removed duplicate flag from student ID {original_student_id} (only 1 paper left)")
-                    
-                    # 3. ตั้งค่า is_duplicate สำหรับกระดาษที่แก้ไข
-                    session_data[results_key][i]["is_duplicate"] = new_id_is_duplicate
-                    
-                    # อัพเดตข้อมูลการกาหลายคำตอบและ has_issues
-                    if mode == "single":
-                        session_data[results_key][i]["multiple_answers_count"] = multiple_answers_count
-                        session_data[results_key][i]["has_issues"] = multiple_answers_count > 0 or new_id_is_duplicate
-                    else:  # multi mode
-                        session_data[results_key][i]["has_issues"] = new_id_is_duplicate
-                    
-                    student_found = True
-                    app_logger.info(f"Updated student at index {i}: {session_data[results_key][i]}")
-                    app_logger.info(f"Duplicate status - Old ID: {original_student_id} (count: {old_id_count}), New ID: {student_id} (is_duplicate: {new_id_is_duplicate})")
-                    break
-            
-            if not student_found:
-                app_logger.warning(f"Student with ID {student_id} (original: {original_student_id}) not found in results")
-                # แสดงรายการ student_id ทั้งหมดเพื่อ debug
-                all_ids = [str(r.get("student_id", "")) for r in session_data[results_key]]
-                app_logger.info(f"Available student IDs: {all_ids}")
-
-        save_session_data(session_data)
-
+        correction = {
+            "student_file": data.get("student_file"),
+            "original_student_id": original_student_id,
+            "student_id": student_id,
+            "student_name": data.get("student_name"),
+            "answers": answers_from_fe,
+        }
+        result, status_code = _commit_score_corrections(mode, [correction])
+        if not result["success"]:
+            app_logger.warning(f"Student with ID {student_id} (original: {original_student_id}) not updated: {result}")
+            return jsonify(result), status_code
+
+        applied = result["applied"][0]
+        # total ถูกเขียนลงแถวแล้วตอนแก้ไข ไม่ต้องโหลดเฉลยซ้ำ
+        row = next(r for r in result["rows"] if r.get("student_file") == applied["student_file"])
         return jsonify(
             {
                 "success": True,
-                "new_score": new_score,
-                "total": total_questions,
-                "original_student_id": original_student_id,
+                "new_score": applied["new_score"],
+                "total": row["total"],
+                "original_student_id": applied["original_student_id"],
+                "rows": result["rows"],
+                "seq": result["seq"],
                 "message": "Score updated successfully",
             }
         )
@@ -2114,6 +3188,35 @@ def update_student_score():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/update_student_scores_batch", methods=["POST"])
+def update_student_scores_batch():
+    """แก้ไขรหัสนักศึกษาและคำตอบหลายรายการในคำขอเดียว คืนค่าเฉพาะแถวที่เปลี่ยน"""
+    try:
+        data = request.get_json() or {}
+        mode = data.get("mode")
+        corrections = data.get("corrections")
+
+        if mode not in ("single", "multi") or not isinstance(corrections, list) or not corrections:
+            return jsonify({"success": False, "error": "Missing required data"}), 400
+        try:
+            get_session_path("config")
+        except ValueError:
+            return jsonify({"success": False, "error": "No active session"}), 400
+
+        result, status_code = _commit_score_corrections(mode, corrections)
+        app_logger.info(
+            f"Batch score update ({mode}): {len(corrections)} corrections, "
+            f"{len(result.get('rows', []))} rows changed"
+        )
+        return jsonify(result), status_code
+
+    except Exception as e:
+        app_logger.error(
+            f"Error updating student scores: {e} | {traceback.format_exc()}"
+        )
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @app.route("/get_server_info")
 def get_server_info():
     """ดึงข้อมูลเซิร์ฟเวอร์ปัจจุบัน"""
@@ -2142,9 +3245,11 @@ if __name__ == "__main__":
     
     # Start cleanup thread once
     if not CLEANUP_THREAD_STARTED:
-        t = threading.Thread(target=_cleanup_inactive_sessions_loop, daemon=True)
+        t = threading.Thread(target=_cleanup_inactive_sessions_loop, args=(_forget_session_state,), daemon=True)
         t.start()
         CLEANUP_THREAD_STARTED = True
+    # นับพื้นที่ดิสก์ ลบไฟล์ที่สร้างใหม่ได้เมื่อเกินโควตา และลบโฟลเดอร์ของ session ที่ถูกล้าง
+    get_storage().start()
     
     # อ่านค่าจาก environment variables
     host = os.environ.get('SERVER_HOST', '0.0.0.0')
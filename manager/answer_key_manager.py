@@ -0,0 +1,221 @@
+import csv
+import hashlib
+import io
+import os
+import struct
+import threading
+
+import numpy as np
+
+from manager.logging_manager import get_logger
+from manager.session_manager import get_session_path
+
+# รูปแบบไฟล์ไบนารีของเฉลยที่คอมไพล์แล้ว:
+# magic(4) | version(1) | mode(1) | sha256 ของไฟล์ CSV(32) | จำนวนช่อง(2) | bitmask ต่อข้อ (uint8)
+COMPILED_MAGIC = b"OMRK"
+COMPILED_VERSION = 1
+COMPILED_HEADER = struct.Struct("<4sBB32sH")
+MODE_CODES = {"single": 1, "multi": 2}
+MAX_CHOICES = 8  # bitmask แบบ uint8 รองรับได้สูงสุด 8 ตัวเลือก
+
+_cache_lock = threading.Lock()
+_compiled_cache = {}  # csv path -> (file version, CompiledAnswerKey)
+
+
+class CompiledAnswerKey:
+    """
+    เฉลยที่คอมไพล์เป็น bitmask ต่อข้อ (bit 0 = ตัวเลือก 1)
+    ใช้แทน dict เดิมได้ (get/items/len) และตรวจคำตอบได้ O(1) ต่อข้อ
+    """
+
+    def __init__(self, mode, masks, content_hash):
+        self.mode = mode
+        self.masks = masks  # np.ndarray[uint8] index ตามเลขข้อ (index 0 ไม่ใช้)
+        self.content_hash = content_hash
+        self.questions = [int(q) for q in np.flatnonzero(masks)]
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __contains__(self, q_num):
+        return self.mask(q_num) != 0
+
+    @property
+    def num_questions(self):
+        return len(self.questions)
+
+    def mask(self, q_num):
+        if 0 < q_num < len(self.masks):
+            return int(self.masks[q_num])
+        return 0
+
+    def get(self, q_num, default=None):
+        """คืนค่าเฉลยแบบเดิม: int สำหรับโหมด single และ set สำหรับโหมด multi"""
+        mask = self.mask(q_num)
+        if not mask:
+            return default
+        choices = mask_to_choices(mask)
+        return choices[0] if self.mode == "single" else set(choices)
+
+    def items(self):
+        for q_num in self.questions:
+            yield q_num, self.get(q_num)
+
+    def grade(self, q_num, student_answers):
+        """ตรวจคำตอบของข้อ q_num คืนค่าสถานะ (correct, partial, multiple_answers, no_key, incorrect)"""
+        key_mask = self.mask(q_num)
+        answer_mask = choices_to_mask(student_answers)
+
+        if self.mode == "single":
+            if key_mask and answer_mask == key_mask:
+                return "correct"
+            if answer_mask & (answer_mask - 1):  # กามากกว่า 1 คำตอบ
+                return "multiple_answers"
+            return "incorrect"
+
+        if not key_mask:
+            return "no_key"
+        if answer_mask == key_mask:
+            return "correct"
+        if answer_mask and not (answer_mask & ~key_mask):
+            return "partial"
+        return "incorrect"
+
+    def to_bytes(self):
+        header = COMPILED_HEADER.pack(
+            COMPILED_MAGIC, COMPILED_VERSION, MODE_CODES[self.mode], self.content_hash, len(self.masks)
+        )
+        return header + self.masks.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, mode_code, content_hash, count = COMPILED_HEADER.unpack_from(data)
+        if magic != COMPILED_MAGIC or version != COMPILED_VERSION:
+            raise ValueError("Unsupported compiled answer key format")
+        mode = next(m for m, code in MODE_CODES.items() if code == mode_code)
+        masks = np.frombuffer(data, dtype=np.uint8, count=count, offset=COMPILED_HEADER.size).copy()
+        return cls(mode, masks, content_hash)
+
+
+def validate_choices(choices):
+    """แปลงตัวเลือกเป็น int และตรวจว่าอยู่ในช่วง 1..MAX_CHOICES (ValueError ถ้าไม่ถูกต้อง)"""
+    if isinstance(choices, (str, bytes)) or not hasattr(choices, "__iter__"):
+        raise ValueError(f"คำตอบต้องเป็นรายการตัวเลือก ไม่ใช่ {choices!r}")
+    validated = []
+    for choice in choices:
+        try:
+            value = int(choice)
+        except (TypeError, ValueError):
+            raise ValueError(f"ตัวเลือก {choice!r} ไม่ใช่ตัวเลข") from None
+        if not 1 <= value <= MAX_CHOICES:
+            raise ValueError(f"ตัวเลือก {value} ต้องอยู่ระหว่าง 1 ถึง {MAX_CHOICES}")
+        validated.append(value)
+    return validated
+
+
+def choices_to_mask(choices):
+    mask = 0
+    for choice in validate_choices(choices):
+        mask |= 1 << (choice - 1)
+    return mask
+
+
+def mask_to_choices(mask):
+    return [bit + 1 for bit in range(MAX_CHOICES) if mask & (1 << bit)]
+
+
+def compile_answer_key_bytes(csv_bytes, mode):
+    """แปลงเนื้อหา CSV (ข้อ, คำตอบ) เป็น CompiledAnswerKey โดยไม่ใช้ pandas"""
+    key = {}
+    reader = csv.reader(io.StringIO(csv_bytes.decode("utf-8-sig")))
+    for row in reader:
+        if not row or not any(col.strip() for col in row):
+            continue
+        q_num = int(row[0])
+        answers = [int(ans) for ans in row[1].strip().split("&")]
+        if mode == "single" and len(answers) != 1:
+            raise ValueError(f"ข้อ {q_num} ต้องมีคำตอบเดียวในโหมด single")
+        if q_num < 1 or any(not 1 <= ans <= MAX_CHOICES for ans in answers):
+            raise ValueError(f"ข้อ {q_num} มีค่าไม่ถูกต้อง")
+        key[q_num] = choices_to_mask(answers)
+
+    masks = np.zeros(max(key, default=0) + 1, dtype=np.uint8)
+    for q_num, mask in key.items():
+        masks[q_num] = mask
+    return CompiledAnswerKey(mode, masks, hashlib.sha256(csv_bytes).digest())
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _compiled_path(key_path):
+    return os.path.splitext(key_path)[0] + ".bin"
+
+
+def compile_answer_key(key_path, mode):
+    """
+    คอมไพล์ไฟล์เฉลยและบันทึกเป็นไฟล์ไบนารีข้างไฟล์ CSV (เรียกตอนอัปโหลด/บันทึกเฉลย)
+    เขียนไฟล์ชั่วคราวแล้ว os.replace เพื่อให้การเปลี่ยนเฉลยเป็นแบบ atomic
+    """
+    version = _file_version(key_path)
+    with open(key_path, "rb") as f:
+        compiled = compile_answer_key_bytes(f.read(), mode)
+
+    compiled_path = _compiled_path(key_path)
+    tmp_path = f"{compiled_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(compiled.to_bytes())
+    os.replace(tmp_path, compiled_path)
+
+    with _cache_lock:
+        _compiled_cache[key_path] = (version, compiled)
+    return compiled
+
+
+def _load_compiled(key_path, mode):
+    version = _file_version(key_path)
+    with _cache_lock:
+        cached = _compiled_cache.get(key_path)
+    if cached and cached[0] == version and cached[1].mode == mode:
+        return cached[1]
+
+    # ไฟล์ CSV เปลี่ยนหรือยังไม่มีใน memory: ใช้ไฟล์ไบนารีถ้า hash ตรงกับเนื้อหา CSV ปัจจุบัน
+    with open(key_path, "rb") as f:
+        content_hash = hashlib.sha256(f.read()).digest()
+    try:
+        with open(_compiled_path(key_path), "rb") as f:
+            compiled = CompiledAnswerKey.from_bytes(f.read())
+        if compiled.content_hash == content_hash and compiled.mode == mode:
+            with _cache_lock:
+                _compiled_cache[key_path] = (version, compiled)
+            return compiled
+    except (OSError, ValueError, struct.error, StopIteration):
+        pass
+    return compile_answer_key(key_path, mode)
+
+
+def load_answer_key(mode):
+    try:
+        config_path = get_session_path("config")
+        key_path = os.path.join(config_path, f"answer_key_{mode}.csv")
+    except ValueError:
+        return None, "No active session to load answer key from."
+
+    if not os.path.exists(key_path):
+        return None, f"ไม่พบไฟล์เฉลยสำหรับโหมด {mode}"
+
+    try:
+        return _load_compiled(key_path, mode), None
+    except Exception as e:
+        return None, f"ผิดพลาดในการอ่านไฟล์เฉลย {mode}: {e}"
+
+
+def refresh_answer_key(mode):
+    """คอมไพล์เฉลยใหม่หลังจากไฟล์ CSV ถูกเขียน (ไม่ทำให้การอัปโหลดล้มเหลวถ้าเฉลยไม่ถูกต้อง)"""
+    key_path = os.path.join(get_session_path("config"), f"answer_key_{mode}.csv")
+    try:
+        compile_answer_key(key_path, mode)
+    except Exception as e:
+        get_logger().warning(f"Could not compile {mode} answer key: {e}")
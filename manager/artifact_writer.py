@@ -0,0 +1,153 @@
+import atexit
+import os
+import threading
+import time
+from queue import Queue
+
+import cv2
+from PIL import Image
+
+from manager.image_util import create_web_optimized_image
+from manager.logging_manager import get_logger
+
+
+def _int_from_env(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        get_logger().warning(f"Invalid {name}, using {default}")
+        return default
+
+
+# ตั้งค่าได้ผ่าน environment
+ARTIFACT_QUEUE_SIZE = _int_from_env("OMR_ARTIFACT_QUEUE_SIZE", 8)  # รูปที่รอเขียนได้สูงสุด (รูปละ ~12MB ที่ 2000px)
+ARTIFACT_WORKERS = _int_from_env("OMR_ARTIFACT_WORKERS", 2)  # cv2 ปล่อย GIL ระหว่าง encode จึงเขียนขนานกันได้จริง
+PNG_COMPRESSION = _int_from_env("OMR_ARTIFACT_PNG_COMPRESSION", 1)  # 0-9 (ค่ามาก = ไฟล์เล็กแต่ encode ช้า)
+WEB_JPEG_QUALITY = _int_from_env("OMR_ARTIFACT_WEB_QUALITY", 60)
+DEBUG_IMAGE_FORMAT = os.environ.get("OMR_DEBUG_IMAGE_FORMAT", "png").lower()  # รูปใน bundle debug: png หรือ jpg
+DEBUG_JPEG_QUALITY = _int_from_env("OMR_DEBUG_JPEG_QUALITY", 85)
+WEB_MAX_WIDTH = 800
+
+
+def encode_params(path):
+    """พารามิเตอร์การบีบอัดของ cv2.imwrite ตามนามสกุลไฟล์"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    if ext in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, DEBUG_JPEG_QUALITY]
+    return []
+
+
+class ArtifactWriter:
+    """
+    เขียนรูปผลตรวจและรูป debug ใน thread เบื้องหลัง การตรวจแผ่นถัดไปจึงไม่ต้องรอ encode และเขียนดิสก์
+    คิวมีขนาดจำกัด (submit รอเมื่อคิวเต็ม ไม่ให้ memory โตไม่จำกัด)
+    ต้องเรียก flush() ก่อนส่ง URL หรืออ่านไฟล์ที่เพิ่ง submit
+    """
+
+    def __init__(self, queue_size=ARTIFACT_QUEUE_SIZE, workers=ARTIFACT_WORKERS):
+        self._queue = Queue(maxsize=max(1, queue_size))
+        self._pending = {}  # path -> จำนวนงานที่ยังเขียนไม่เสร็จ
+        self._condition = threading.Condition()
+        self.written = 0
+        self.failed = 0
+        self.encode_seconds = 0.0
+        for _ in range(max(1, workers)):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def write_image(self, path, image):
+        """เขียนรูป BGR ด้วย cv2 (รูปแบบและการบีบอัดตามนามสกุลไฟล์)"""
+        self._submit(path, lambda: self._encode_cv2(path, image))
+
+    def write_web_image(self, path, image, max_width=WEB_MAX_WIDTH, quality=None):
+        """เขียนรูป BGR เป็น JPEG ขนาดเล็กสำหรับแสดงบนเว็บ"""
+        quality = WEB_JPEG_QUALITY if quality is None else quality
+        self._submit(path, lambda: create_web_optimized_image(
+            Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)), max_width=max_width, quality=quality
+        ))
+
+    def write_encoded(self, path, encode):
+        """เขียนไฟล์จาก bytes ที่ encode() สร้างใน thread เบื้องหลัง (เช่น bundle debug)"""
+        self._submit(path, encode)
+
+    @staticmethod
+    def _encode_cv2(path, image):
+        ext = os.path.splitext(path)[1].lower() or ".png"
+        ok, encoded = cv2.imencode(ext, image, encode_params(path))
+        if not ok:
+            raise ValueError(f"Could not encode {path}")
+        return encoded.tobytes()
+
+    def _submit(self, path, encode):
+        path = os.path.abspath(path)
+        with self._condition:
+            self._pending[path] = self._pending.get(path, 0) + 1
+        self._queue.put((path, encode))
+
+    def _worker(self):
+        while True:
+            path, encode = self._queue.get()
+            try:
+                start = time.perf_counter()
+                data = encode()
+                # เขียนไฟล์ชั่วคราวแล้ว rename ผู้อ่านจึงไม่เห็นไฟล์ที่เขียนไม่เสร็จ
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                with self._condition:
+                    self.encode_seconds += time.perf_counter() - start
+                    self.written += 1
+            except Exception as e:
+                with self._condition:
+                    self.failed += 1
+                get_logger().error(f"Could not write artifact {path}: {e}")
+            finally:
+                with self._condition:
+                    remaining = self._pending.get(path, 1) - 1
+                    if remaining:
+                        self._pending[path] = remaining
+                    else:
+                        self._pending.pop(path, None)
+                    self._condition.notify_all()
+
+    def flush(self, prefix=None, timeout=None):
+        """
+        รอจนรูปที่ submit แล้วถูกเขียนเสร็จ (prefix = path ของไฟล์หรือโฟลเดอร์ ถ้าไม่ระบุรอทุกไฟล์)
+        คืนค่า False ถ้าหมดเวลา timeout ก่อน
+        """
+        if prefix is not None:
+            prefix = os.path.abspath(prefix)
+
+        def done():
+            if prefix is None:
+                return not self._pending
+            return not any(path == prefix or path.startswith(prefix + os.sep) for path in self._pending)
+
+        with self._condition:
+            return self._condition.wait_for(done, timeout)
+
+    def status(self):
+        with self._condition:
+            pending = sum(self._pending.values())
+        return {
+            "pending": pending,
+            "written": self.written,
+            "failed": self.failed,
+            "encode_seconds": round(self.encode_seconds, 3),
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_artifact_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ArtifactWriter()
+            # เขียนรูปที่ค้างในคิวให้เสร็จก่อนปิดโปรแกรม (worker เป็น daemon thread)
+            atexit.register(_writer.flush, timeout=30)
+        return _writer
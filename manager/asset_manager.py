@@ -0,0 +1,49 @@
+import hashlib
+import os
+import threading
+
+FINGERPRINT_LENGTH = 12
+# ไฟล์ที่ service worker โหลดเก็บไว้ตั้งแต่ติดตั้ง (หน้าจอใช้งานได้แม้เน็ตหลุด)
+PRECACHE_ASSETS = [
+    "css/shared.css",
+    "css/style.css",
+    "js/chunked_upload.js",
+    "js/upload_queue.js",
+    "js/main.js",
+    "js/capture.js",
+    "favicon.ico",
+]
+
+_fingerprints_lock = threading.Lock()
+_fingerprints = {}  # path -> (mtime_ns, size, fingerprint)
+
+
+def static_fingerprint(static_folder, filename):
+    """hash ของเนื้อไฟล์ static (คำนวณใหม่เมื่อไฟล์เปลี่ยน) คืนค่า None ถ้าไม่พบไฟล์"""
+    path = os.path.join(static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+    if cached and cached[:2] == signature:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(block)
+    fingerprint = digest.hexdigest()[:FINGERPRINT_LENGTH]
+    with _fingerprints_lock:
+        _fingerprints[path] = signature + (fingerprint,)
+    return fingerprint
+
+
+def assets_version(static_folder, filenames=PRECACHE_ASSETS):
+    """เวอร์ชันรวมของไฟล์ที่ precache เปลี่ยนเมื่อไฟล์ใดไฟล์หนึ่งเปลี่ยน (ใช้ตั้งชื่อ cache)"""
+    digest = hashlib.sha256()
+    for filename in filenames:
+        digest.update(f"{filename}={static_fingerprint(static_folder, filename)}\n".encode())
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
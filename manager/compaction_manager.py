@@ -0,0 +1,91 @@
+import io
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+from manager.image_store import content_hash
+from manager.logging_manager import get_logger
+from manager.omr import PROCESSING_MAX_DIMENSION
+
+COMPACT_JPEG_QUALITY = 90  # คุณภาพ JPEG ของรูปต้นฉบับหลังบีบอัด (ยังอ่านวงกลมที่ฝนได้เหมือนเดิม)
+COMPACTABLE_EXTENSIONS = {".png", ".jpg", ".jpeg"}  # TIFF ถูกบีบอัดแบบ Group4/deflate ตั้งแต่นำเข้าแล้ว
+# รูปใน debug_output ที่ไม่ต้องเก็บหลังตรวจเสร็จ (เก็บ web_highlighted ไว้แสดงผล รูปความละเอียดเต็มวาดใหม่จาก layout ตอน export)
+DISCARDABLE_ARTIFACT_PREFIXES = ("highlighted_", "DEBUG_")
+
+
+def transcode_original(path, max_dimension=PROCESSING_MAX_DIMENSION, quality=COMPACT_JPEG_QUALITY):
+    """
+    ย่อรูปต้นฉบับให้เท่าความละเอียดที่ engine ใช้ตรวจ และบีบอัดเป็น JPEG เขียนทับไฟล์เดิม (ชื่อไฟล์เดิม
+    เพราะผลตรวจ, URL และ index อ้างอิงชื่อนี้ ผู้เรียกต้องบันทึกรูปแบบและ hash ใหม่ลง ImageIndex)
+    คืนค่า (จำนวน byte ที่ลดลง, sha256 ของไฟล์ใหม่) หรือ (0, None) ถ้าไฟล์ใหม่ไม่เล็กกว่าเดิม
+    """
+    size_before = os.path.getsize(path)
+    with Image.open(path) as img:
+        # หมุนตาม EXIF ให้ตรงกับที่ cv2.imdecode เห็น เพราะไฟล์ใหม่ไม่มี EXIF
+        image = ImageOps.exif_transpose(img).convert("RGB")
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality, optimize=True)
+    if buffer.tell() >= size_before:
+        return 0, None
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, path)
+    return size_before - buffer.tell(), content_hash(buffer.getvalue())
+
+
+def compact_session(upload_path, debug_path, graded_files, image_index=None, on_progress=None):
+    """
+    บีบอัดรูปต้นฉบับที่ตรวจแล้ว และลบรูปผลตรวจความละเอียดเต็ม/รูป debug ของ session
+    graded_files คือชื่อไฟล์ต้นฉบับที่มีผลตรวจแล้ว (ไฟล์ที่ยังไม่ตรวจไม่ถูกแตะต้อง)
+    คืนค่ารายงาน {transcoded, skipped, failed, artifacts_removed, bytes_transcoded, bytes_artifacts, bytes_reclaimed}
+    """
+    report = {
+        "transcoded": 0,
+        "skipped": 0,
+        "failed": 0,
+        "artifacts_removed": 0,
+        "bytes_transcoded": 0,
+        "bytes_artifacts": 0,
+    }
+    graded_files = sorted(graded_files)
+    for position, filename in enumerate(graded_files, 1):
+        path = os.path.join(upload_path, filename)
+        already_compacted = image_index is not None and image_index.is_compacted(filename)
+        if already_compacted or os.path.splitext(filename)[1].lower() not in COMPACTABLE_EXTENSIONS \
+                or not os.path.exists(path):
+            report["skipped"] += 1
+        else:
+            try:
+                reclaimed, digest = transcode_original(path)
+            except Exception as e:
+                get_logger().warning(f"Could not compact {path}: {e}")
+                report["failed"] += 1
+                continue
+            if image_index is not None:
+                image_index.mark_compacted(filename, "jpeg" if digest else None, digest)
+            if reclaimed:
+                report["transcoded"] += 1
+                report["bytes_transcoded"] += reclaimed
+            else:
+                report["skipped"] += 1
+        if on_progress:
+            on_progress(position, len(graded_files))
+
+    if os.path.isdir(debug_path):
+        for entry in os.scandir(debug_path):
+            if entry.is_file() and entry.name.startswith(DISCARDABLE_ARTIFACT_PREFIXES):
+                size = entry.stat().st_size
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    get_logger().warning(f"Could not remove {entry.path}: {e}")
+                    continue
+                report["artifacts_removed"] += 1
+                report["bytes_artifacts"] += size
+
+    report["bytes_reclaimed"] = report["bytes_transcoded"] + report["bytes_artifacts"]
+    return report
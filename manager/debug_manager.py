@@ -0,0 +1,198 @@
+import io
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+
+import cv2
+
+from manager.artifact_writer import DEBUG_IMAGE_FORMAT, encode_params, get_artifact_writer
+from manager.logging_manager import get_logger
+
+# นโยบายเก็บข้อมูล debug ต่อ session
+#   off = ไม่เก็บ, failed = แผ่นที่ตรวจไม่สำเร็จหรืออ่านรหัสไม่ได้, issues = failed + แผ่นที่มีปัญหา (กาหลายคำตอบ), all = ทุกแผ่น
+DEBUG_POLICIES = ("off", "failed", "issues", "all")
+DEFAULT_DEBUG_POLICY = os.environ.get("OMR_DEBUG_CAPTURE", "off").lower()
+try:
+    DEFAULT_SAMPLE_RATE = float(os.environ.get("OMR_DEBUG_SAMPLE_RATE", 0))  # สัดส่วนแผ่นอื่นที่สุ่มเก็บเพิ่ม (0-1)
+except ValueError:
+    DEFAULT_SAMPLE_RATE = 0.0
+BUNDLE_PREFIX = "DEBUG_"  # ขึ้นต้นเหมือนรูป debug เดิม (ถูกลบตอนบีบอัด session และลบได้เมื่อเกินโควตา)
+
+
+def bundle_name(mode, sheet_filename):
+    """ชื่อไฟล์ bundle ของแผ่น (zip หนึ่งไฟล์ต่อแผ่น ใน debug_output ของ session)"""
+    return f"{BUNDLE_PREFIX}{mode}_{sheet_filename}.zip"
+
+
+class DebugTrace:
+    """
+    ข้อมูลระหว่างตรวจหนึ่งแผ่น: รูป mask/ภาพกลางทาง, เส้นตารางที่พบ และเวลาของแต่ละขั้นตอน
+    เก็บเพียง reference ของ array ที่ engine สร้างอยู่แล้ว การ encode เกิดขึ้นเมื่อตัดสินใจเก็บ bundle เท่านั้น
+    """
+
+    enabled = True
+
+    def __init__(self, mode, sheet_filename, settings):
+        self.mode = mode
+        self.sheet_filename = sheet_filename
+        self.settings = settings  # นโยบายที่ใช้ตัดสินใจเก็บ bundle ของแผ่นนี้
+        self.images = {}  # ชื่อ -> array (BGR หรือ mask)
+        self.info = {}
+        self.timings = {}  # ขั้นตอน -> ms
+        self._started = self._last = time.perf_counter()
+
+    def image(self, name, image):
+        self.images[name] = image
+
+    def data(self, key, value):
+        self.info[key] = value
+
+    def mark(self, stage):
+        """บันทึกเวลาที่ใช้ตั้งแต่ mark ครั้งก่อนเป็นเวลาของขั้นตอน stage"""
+        now = time.perf_counter()
+        self.timings[stage] = round((now - self._last) * 1000, 2)
+        self._last = now
+
+    def build_bundle(self, outcome):
+        """zip ที่มี trace.json และรูปทั้งหมด (รูปถูกบีบอัดแล้วจึงเก็บแบบไม่บีบอัดซ้ำ)"""
+        ext = ".jpg" if DEBUG_IMAGE_FORMAT in ("jpg", "jpeg") else ".png"
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as bundle:
+            trace = {
+                "sheet": self.sheet_filename,
+                "mode": self.mode,
+                "outcome": outcome,
+                "timings_ms": self.timings,
+                "total_ms": round((self._last - self._started) * 1000, 2),
+                "info": self.info,
+                "images": [],
+            }
+            for name, image in self.images.items():
+                ok, encoded = cv2.imencode(ext, image, encode_params(ext))
+                if not ok:
+                    continue
+                bundle.writestr(f"{name}{ext}", encoded.tobytes())
+                trace["images"].append(f"{name}{ext}")
+            bundle.writestr("trace.json", json.dumps(trace, ensure_ascii=False, indent=1, default=str))
+        return buffer.getvalue()
+
+
+class _NullTrace:
+    """trace ที่ไม่เก็บอะไร (ค่าเริ่มต้นของ engine) ทุก method ไม่ทำอะไรเลย"""
+
+    enabled = False
+
+    def image(self, name, image):
+        pass
+
+    def data(self, key, value):
+        pass
+
+    def mark(self, stage):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class DebugCapture:
+    """นโยบายเก็บข้อมูล debug แยกตาม session (ไม่กระทบ session อื่นที่ตรวจพร้อมกัน)"""
+
+    def __init__(self, default_policy=DEFAULT_DEBUG_POLICY, default_sample_rate=DEFAULT_SAMPLE_RATE):
+        if default_policy not in DEBUG_POLICIES:
+            get_logger().warning(f"Invalid OMR_DEBUG_CAPTURE {default_policy}, using off")
+            default_policy = "off"
+        self.default = {"policy": default_policy, "sample_rate": min(max(default_sample_rate, 0.0), 1.0)}
+        self._settings = {}  # session_id -> {"policy", "sample_rate"}
+        self._lock = threading.Lock()
+        self.bundles_written = 0
+
+    def settings(self, session_id):
+        with self._lock:
+            return dict(self._settings.get(session_id, self.default))
+
+    def configure(self, session_id, policy=None, sample_rate=None):
+        """ตั้งค่าของ session คืนค่าการตั้งค่าใหม่ (ValueError ถ้าค่าไม่ถูกต้อง)"""
+        settings = self.settings(session_id)
+        if policy is not None:
+            if policy not in DEBUG_POLICIES:
+                raise ValueError(f"policy ต้องเป็นหนึ่งใน {', '.join(DEBUG_POLICIES)}")
+            settings["policy"] = policy
+        if sample_rate is not None:
+            sample_rate = float(sample_rate)
+            if not 0 <= sample_rate <= 1:
+                raise ValueError("sample_rate ต้องอยู่ระหว่าง 0 ถึง 1")
+            settings["sample_rate"] = sample_rate
+        with self._lock:
+            self._settings[session_id] = settings
+        return dict(settings)
+
+    def forget(self, session_id):
+        """ลบการตั้งค่าของ session ที่ถูกล้างหรือหมดอายุ"""
+        with self._lock:
+            self._settings.pop(session_id, None)
+
+    def start_trace(self, session_id, mode, sheet_filename, policy=None):
+        """trace สำหรับแผ่นนี้ หรือ None ถ้า session ไม่ได้เปิดเก็บข้อมูล (engine ไม่ทำงานเพิ่มเลย)"""
+        settings = self.settings(session_id)
+        if policy is not None:
+            settings = {"policy": policy, "sample_rate": 0.0}
+        if settings["policy"] == "off" and not settings["sample_rate"]:
+            return None
+        return DebugTrace(mode, sheet_filename, settings)
+
+    def finish(self, trace, session_debug_path, result=None, error=None):
+        """
+        ตัดสินใจตามนโยบายว่าจะเก็บ bundle ของแผ่นนี้หรือไม่ แล้วส่งให้ ArtifactWriter เขียนในเบื้องหลัง
+        คืนค่าชื่อไฟล์ bundle หรือ None
+        """
+        if trace is None:
+            return None
+        failed = error is not None or result is None or not str(result.get("student_id", "")).isdigit()
+        has_issues = failed or bool(result.get("has_issues"))
+        policy = trace.settings["policy"]
+        keep = (
+            policy == "all"
+            or (policy == "failed" and failed)
+            or (policy == "issues" and has_issues)
+            or random.random() < trace.settings["sample_rate"]
+        )
+        if not keep:
+            return None
+
+        outcome = {"failed": failed, "has_issues": has_issues}
+        if error is not None:
+            outcome["error"] = str(error)
+        if result is not None:
+            outcome.update({key: result.get(key) for key in ("student_id", "score", "multiple_answers_count")})
+        filename = bundle_name(trace.mode, trace.sheet_filename)
+        get_artifact_writer().write_encoded(
+            os.path.join(session_debug_path, filename), lambda: trace.build_bundle(outcome)
+        )
+        with self._lock:
+            self.bundles_written += 1
+        return filename
+
+    @staticmethod
+    def list_bundles(session_debug_path):
+        if not os.path.isdir(session_debug_path):
+            return []
+        return sorted(
+            entry.name for entry in os.scandir(session_debug_path)
+            if entry.is_file() and entry.name.startswith(BUNDLE_PREFIX) and entry.name.endswith(".zip")
+        )
+
+
+_capture = None
+_capture_lock = threading.Lock()
+
+
+def get_debug_capture():
+    global _capture
+    with _capture_lock:
+        if _capture is None:
+            _capture = DebugCapture()
+        return _capture
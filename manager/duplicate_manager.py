@@ -0,0 +1,165 @@
+import os
+import threading
+
+from manager.session_manager import STATIC_FOLDER, get_session_path
+
+SESSION_DATA_FILENAME = "session_data.json"
+
+# รหัสที่ไม่นับเป็นรหัสซ้ำ (อ่านรหัสไม่ได้หรือประมวลผลผิดพลาด)
+NON_DUPLICATE_IDS = {"", "ERROR", "Error Reading ID"}
+
+_cache_lock = threading.Lock()
+_index_cache = {}  # (session_data path, mode) -> (version, DuplicateIndex)
+
+
+class DuplicateIndex:
+    """
+    index จากรหัสนักศึกษาไปยังไฟล์กระดาษคำตอบที่ใช้รหัสนั้น
+    เพิ่ม/เปลี่ยนรหัส/ลบ ได้ใน O(1) และคืนค่าไฟล์ที่สถานะรหัสซ้ำเปลี่ยน
+    """
+
+    def __init__(self):
+        self.files_by_id = {}  # student_id -> {student_file: None} (เรียงตามลำดับที่เพิ่ม)
+        self.id_by_file = {}  # student_file -> student_id
+
+    @classmethod
+    def from_results(cls, results):
+        index = cls()
+        for result in results:
+            if "is_duplicate" in result:  # ข้ามแถวที่ประมวลผลผิดพลาด
+                index.add(result.get("student_file"), result.get("student_id"))
+        return index
+
+    def copy(self):
+        """สำเนาที่แก้ไขได้โดยไม่กระทบ index ใน cache (ใช้ระหว่างแก้ไขที่อาจไม่ถูกบันทึก)"""
+        index = DuplicateIndex()
+        index.files_by_id = {student_id: dict(group) for student_id, group in self.files_by_id.items()}
+        index.id_by_file = dict(self.id_by_file)
+        return index
+
+    def _group(self, student_id):
+        if student_id in NON_DUPLICATE_IDS:
+            return None
+        return self.files_by_id.get(student_id)
+
+    def is_duplicate(self, student_id):
+        group = self._group(str(student_id))
+        return group is not None and len(group) > 1
+
+    def files(self, student_id):
+        return list(self.files_by_id.get(str(student_id), ()))
+
+    def add(self, student_file, student_id):
+        """เพิ่มไฟล์เข้ากลุ่มของรหัส คืนค่าไฟล์ที่สถานะรหัสซ้ำเปลี่ยน"""
+        if student_file in self.id_by_file:
+            return self.reassign(student_file, student_id)
+        student_id = str(student_id)
+        self.id_by_file[student_file] = student_id
+        group = self.files_by_id.setdefault(student_id, {})
+        group[student_file] = None
+        if student_id in NON_DUPLICATE_IDS or len(group) == 1:
+            return set()
+        if len(group) == 2:
+            return set(group)  # ไฟล์แรกกลายเป็นรหัสซ้ำด้วย
+        return {student_file}
+
+    def remove(self, student_file):
+        """ลบไฟล์ออกจาก index คืนค่าไฟล์ที่สถานะรหัสซ้ำเปลี่ยน"""
+        student_id = self.id_by_file.pop(student_file, None)
+        if student_id is None:
+            return set()
+        group = self.files_by_id[student_id]
+        del group[student_file]
+        if not group:
+            del self.files_by_id[student_id]
+        if student_id in NON_DUPLICATE_IDS:
+            return set()
+        if len(group) == 1:
+            return {student_file} | set(group)  # ไฟล์ที่เหลือไม่ซ้ำแล้ว
+        return {student_file} if group else set()
+
+    def reassign(self, student_file, student_id):
+        """เปลี่ยนรหัสของไฟล์ คืนค่าไฟล์ที่สถานะรหัสซ้ำเปลี่ยน"""
+        student_id = str(student_id)
+        if self.id_by_file.get(student_file) == student_id:
+            return set()
+        was_duplicate = self.is_duplicate(self.id_by_file.get(student_file, ""))
+        changed = self.remove(student_file)
+        changed |= self.add(student_file, student_id)
+        # ไฟล์ที่ย้ายจากกลุ่มซ้ำไปกลุ่มซ้ำยังมีสถานะเหมือนเดิม
+        if was_duplicate == self.is_duplicate(student_id):
+            changed.discard(student_file)
+        else:
+            changed.add(student_file)
+        return changed
+
+    def conflicts(self):
+        """กลุ่มรหัสที่ซ้ำกัน {student_id: [student_file, ...]}"""
+        return {
+            student_id: list(group)
+            for student_id, group in self.files_by_id.items()
+            if len(group) > 1 and student_id not in NON_DUPLICATE_IDS
+        }
+
+
+def apply_duplicate_flags(result, index, mode):
+    """ตั้งค่า is_duplicate และ has_issues ของแถวผลลัพธ์ตาม index"""
+    if "is_duplicate" not in result:
+        return
+    is_duplicate = index.is_duplicate(result.get("student_id", ""))
+    result["is_duplicate"] = is_duplicate
+    # ใน multi mode การกาหลายคำตอบเป็นเรื่องปกติ มีเพียงรหัสซ้ำและคอลัมน์ที่อ่านไม่ได้ที่เป็นปัญหา
+    result["has_issues"] = (
+        is_duplicate
+        or result.get("unreadable_count", 0) > 0
+        or (mode == "single" and result.get("multiple_answers_count", 0) > 0)
+    )
+
+
+def _session_file():
+    return os.path.join(get_session_path("config"), SESSION_DATA_FILENAME)
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_duplicate_index(session_data, mode):
+    """
+    คืนค่า DuplicateIndex ของโหมดนั้นจาก cache (สร้างใหม่จากผลลัพธ์เมื่อ session_data.json เปลี่ยนจากภายนอก)
+    """
+    session_file = _session_file()
+    version = _file_version(session_file)
+    with _cache_lock:
+        cached = _index_cache.get((session_file, mode))
+    if version is not None and cached and cached[0] == version:
+        return cached[1]
+    return DuplicateIndex.from_results(session_data.get(f"{mode}_results", []))
+
+
+def remember_duplicate_index(mode, index):
+    """เก็บ index ลง cache หลังบันทึก session data (เรียกหลัง save_session_data)"""
+    session_file = _session_file()
+    version = _file_version(session_file)
+    if version is None:
+        return
+    with _cache_lock:
+        _index_cache[(session_file, mode)] = (version, index)
+
+
+def forget_duplicate_index(mode):
+    """ลบ index ออกจาก cache (ใช้เมื่อแก้ไขไม่สำเร็จและไม่ได้บันทึก)"""
+    with _cache_lock:
+        _index_cache.pop((_session_file(), mode), None)
+
+
+def forget_session_indexes(session_id):
+    """ลบ index ทุกโหมดของ session ที่ถูกล้างหรือหมดอายุ"""
+    prefix = os.path.join(STATIC_FOLDER, session_id) + os.sep
+    with _cache_lock:
+        for key in [key for key in _index_cache if key[0].startswith(prefix)]:
+            del _index_cache[key]
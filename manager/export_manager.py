@@ -0,0 +1,274 @@
+import csv
+import io
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape
+
+EXPORT_COLUMNS = ["student_id", "fname", "lname", "score", "total"]
+MULTI_EXPORT_COLUMNS = EXPORT_COLUMNS + ["status"]  # multi mode ส่งออกสถานะ (เช่น partial) เหมือนไฟล์ CSV เดิม
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+INTEGER_COLUMNS = {"score", "total"}
+NOT_FOUND_NAMES = ["ไม่พบชื่อ", "ไม่พบชื่อในรายชื่อ"]
+
+STREAM_CHUNK_SIZE = 64 * 1024
+PARQUET_BATCH_ROWS = 1000  # จำนวนแถวต่อ row group ของ Parquet
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # ไฟล์ที่ใหญ่กว่านี้จะถูกเขียนลงดิสก์แทน memory
+
+
+def _split_name(item):
+    """แยกชื่อและนามสกุล โดยใช้ student_name เป็นหลักเพราะเป็นข้อมูลที่อัปเดตล่าสุด"""
+    student_name = item.get("student_name", "") or ""
+    # ถ้า student_name ว่างหรือเป็น "ไม่พบชื่อ" ให้ลองใช้ fname/lname
+    if not student_name or student_name in NOT_FOUND_NAMES:
+        fname = item.get("fname", "")
+        lname = item.get("lname", "")
+        if fname and lname:
+            student_name = f"{fname} {lname}".strip()
+        elif fname:
+            student_name = fname
+
+    if " " in student_name:
+        return student_name.split(" ", 1)
+    return student_name, ""
+
+
+def _student_id_sort_key(item):
+    """เรียงตาม student_id แบบตัวเลข (รหัสที่อ่านไม่ได้อยู่ท้ายสุด)"""
+    student_id = str(item.get("student_id", "")).replace("-", "0")
+    return int(student_id) if student_id.isdigit() else 999999999999
+
+
+def question_columns(session_data, mode, answer_key=None):
+    """เลขข้อของคอลัมน์ matrix คำตอบ (ใช้จากเฉลย ถ้าไม่มีใช้ข้อที่ปรากฏในคำตอบ)"""
+    if answer_key is not None and len(answer_key):
+        return list(answer_key.questions)
+    questions = set()
+    for answers in session_data.get(f"{mode}_detailed_answers", {}).values():
+        questions.update(int(q) for q in answers)
+    return sorted(questions)
+
+
+def iter_export_rows(session_data, mode, questions=None):
+    """
+    สร้างแถวสำหรับส่งออกทีละแถว (แถวแรกเป็น header)
+    ถ้าระบุ questions จะเพิ่มคอลัมน์คำตอบของแต่ละข้อ (คั่นหลายคำตอบด้วย & แบบไฟล์เฉลย)
+    """
+    header = list(MULTI_EXPORT_COLUMNS if mode == "multi" else EXPORT_COLUMNS)
+    if questions:
+        header += [f"q{q}" for q in questions]
+    yield header
+
+    detailed_answers = session_data.get(f"{mode}_detailed_answers", {})
+    for item in sorted(session_data.get(f"{mode}_results", []), key=_student_id_sort_key):
+        fname, lname = _split_name(item)
+        row = [item.get("student_id", ""), fname, lname, item.get("score", 0), item.get("total", 0)]
+        if mode == "multi":
+            row.append(item.get("status", ""))
+        if questions:
+            answers = detailed_answers.get(str(item.get("student_id", "")), {})
+            for q in questions:
+                choices = answers.get(str(q), {}).get("answers", [])
+                row.append("&".join(str(c) for c in sorted(choices)))
+        yield row
+
+
+def stream_csv(rows):
+    """เขียน CSV ทีละแถว (มี BOM เพื่อให้ Excel อ่านภาษาไทยได้)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    yield "\ufeff".encode("utf-8")
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _stream_file(fileobj):
+    fileobj.seek(0)
+    try:
+        while True:
+            chunk = fileobj.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _xlsx_cell(ref, value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+_XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="results" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def stream_xlsx(rows):
+    """
+    เขียนไฟล์ XLSX แบบ inline string ทีละแถวลงไฟล์ชั่วคราว (ไม่ต้องใช้ openpyxl)
+    แล้วส่งออกเป็นชิ้น ๆ
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with zipfile.ZipFile(spool, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for row_number, row in enumerate(rows, start=1):
+                cells = "".join(
+                    _xlsx_cell(f"{_column_letter(i)}{row_number}", value) for i, value in enumerate(row)
+                )
+                sheet.write(f'<row r="{row_number}">{cells}</row>'.encode("utf-8"))
+            sheet.write(b"</sheetData></worksheet>")
+    return _stream_file(spool)
+
+
+def stream_parquet(rows):
+    """
+    เขียนไฟล์ Parquet เป็น row group ละ PARQUET_BATCH_ROWS แถว
+    ต้องติดตั้ง pyarrow (ไม่ได้อยู่ใน requirements เพราะเป็นแพ็กเกจขนาดใหญ่)
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("การส่งออก Parquet ต้องติดตั้ง pyarrow (pip install pyarrow)")
+
+    rows = iter(rows)
+    header = next(rows)
+    # คะแนนเป็นตัวเลข (null สำหรับแผ่นที่ประมวลผลผิดพลาด) คอลัมน์อื่นเก็บเป็น string
+    schema = pa.schema(
+        [pa.field(name, pa.int64() if name in INTEGER_COLUMNS else pa.string()) for name in header]
+    )
+
+    def to_batch(batch_rows):
+        columns = list(zip(*batch_rows))
+        arrays = []
+        for field, values in zip(schema, columns):
+            if field.type == pa.int64():
+                arrays.append(pa.array([v if isinstance(v, int) else None for v in values], pa.int64()))
+            else:
+                arrays.append(pa.array([str(v) for v in values], pa.string()))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with pq.ParquetWriter(spool, schema) as writer:
+        batch_rows = []
+        for row in rows:
+            batch_rows.append(row)
+            if len(batch_rows) >= PARQUET_BATCH_ROWS:
+                writer.write_batch(to_batch(batch_rows))
+                batch_rows = []
+        if batch_rows:
+            writer.write_batch(to_batch(batch_rows))
+    return _stream_file(spool)
+
+
+def stream_export(rows, export_format):
+    """เลือกตัวเขียนตามรูปแบบไฟล์ คืนค่า generator ของ bytes"""
+    if export_format == "csv":
+        return stream_csv(rows)
+    if export_format == "xlsx":
+        return stream_xlsx(rows)
+    if export_format == "parquet":
+        return stream_parquet(rows)
+    raise ValueError(f"Unsupported export format: {export_format}")
+
+
+class _ZipStreamSink:
+    """ปลายทางของ zipfile ที่เก็บ bytes ไว้ชั่วคราวจนกว่าจะถูกส่งออก (ไม่รองรับ seek)"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """
+    สร้างไฟล์ ZIP แบบ stream ทีละไฟล์ โดยไม่สร้าง archive ทั้งก้อนใน memory หรือบนดิสก์
+    entries: iterable ของ (ชื่อไฟล์ใน zip, path) ซึ่งถูกอ่านทีละรายการระหว่างส่งข้อมูล
+    (entries ที่เป็น generator จึงเตรียมไฟล์แบบ lazy ได้)
+    รูปภาพถูกบีบอัดอยู่แล้วจึงเก็บแบบ ZIP_STORED
+    """
+    sink = _ZipStreamSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        for arcname, path in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(path, "rb") as src, archive.open(zinfo, "w") as dst:
+                while True:
+                    chunk = src.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()  # central directory
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import threading
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat
+
+from manager.logging_manager import get_logger
+
+INDEX_FILENAME = ".image_index.json"  # ไฟล์ซ่อนในโฟลเดอร์ uploads ของ session
+LAYOUT_FOLDER = ".layouts"  # ตำแหน่งบล็อกและกรอบคำตอบที่ตรวจได้ของแต่ละแผ่น (ใช้วาดรูปผลตรวจใหม่)
+STORED_FORMATS = {"jpeg": ("image/jpeg", ".jpg")}  # รูปแบบไฟล์หลังบีบอัด -> (MIME, นามสกุล)
+CONTENT_NAME_LENGTH = 32  # จำนวนตัวอักษรของ sha256 ที่ใช้เป็นชื่อไฟล์
+HASH_READ_SIZE = 256 * 1024
+PHASH_SIZE = 16  # difference hash ขนาด 16x16 = 256 bit
+# รูปที่ hash ต่างกันไม่เกินจำนวน bit นี้อาจเป็นการถ่ายกระดาษแผ่นเดียวกันซ้ำ
+# (กระดาษต่างคนที่ถ่ายมุมเดียวกันก็ต่างกันเพียง 12-22 bit จึงต้องยืนยันด้วยผลตรวจ)
+NEAR_DUPLICATE_DISTANCE = 16
+SHARPNESS_MAX_DIMENSION = 1000  # ย่อรูปก่อนวัดความคมชัด เพื่อเทียบรูปต่างความละเอียดได้
+
+
+def content_hash(source):
+    """sha256 ของ bytes หรือไฟล์บนดิสก์ (อ่านทีละส่วน)"""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    else:
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(HASH_READ_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def content_addressed_name(digest, ext):
+    return f"{digest[:CONTENT_NAME_LENGTH]}.{ext}"
+
+
+def perceptual_hash(img):
+    """difference hash: เปรียบเทียบความสว่างของพิกเซลที่อยู่ติดกัน ทนต่อการย่อ/บีบอัดใหม่และแสงที่ต่างเล็กน้อย"""
+    gray = ImageOps.exif_transpose(img).convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.BILINEAR)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(PHASH_SIZE):
+        offset = row * (PHASH_SIZE + 1)
+        for col in range(PHASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{PHASH_SIZE * PHASH_SIZE // 4}x}"
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+def capture_sharpness(img):
+    """ความแปรปรวนของขอบภาพ (ค่ามาก = คมชัด) ใช้เลือกรูปที่ดีที่สุดในกลุ่มรูปที่ถ่ายซ้ำ"""
+    gray = img.convert("L")
+    gray.thumbnail((SHARPNESS_MAX_DIMENSION, SHARPNESS_MAX_DIMENSION))
+    return round(ImageStat.Stat(gray.filter(ImageFilter.FIND_EDGES)).var[0], 2)
+
+
+class ImageIndex:
+    """
+    ข้อมูลรูปที่อัปโหลดใน session: hash ของเนื้อไฟล์, perceptual hash, ความคมชัด และกลุ่มรูปที่ถ่ายซ้ำ
+    เก็บเป็น JSON ในโฟลเดอร์ uploads (ถูกลบไปพร้อมกับรูปเมื่อล้าง session)
+    """
+
+    def __init__(self, upload_path):
+        self.path = os.path.join(upload_path, INDEX_FILENAME)
+        self.upload_path = upload_path
+        self.lock = threading.RLock()
+        self.images = {}  # saved_name -> {sha256, phash, sharpness, pixels, group}
+        self.sources = {}  # sha256 ของ PDF/TIFF -> [{saved_name, original_name} ของแต่ละหน้า]
+        self.compacted = set()  # รูปต้นฉบับที่ถูกบีบอัดหลังตรวจแล้ว (ไม่ต้องบีบอัดซ้ำ)
+        # รูปที่เนื้อไฟล์ถูกเขียนใหม่ตอนบีบอัด: saved_name -> {format, sha256 ของเนื้อไฟล์ใหม่}
+        # ชื่อไฟล์ยังเป็น hash ของไฟล์ที่อัปโหลด (ใช้ตรวจการอัปโหลดซ้ำ) นามสกุลจึงอาจไม่ตรงกับรูปแบบจริง
+        self.stored = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            get_logger().warning(f"Could not read image index {self.path}: {e}")
+            return
+        # ตัดรูปที่ถูกลบไปแล้วออก
+        self.images = {
+            name: entry for name, entry in data.get("images", {}).items()
+            if os.path.exists(os.path.join(self.upload_path, name))
+        }
+        self.sources = data.get("sources", {})
+        self.compacted = {
+            name for name in data.get("compacted", [])
+            if os.path.exists(os.path.join(self.upload_path, name))
+        }
+        self.stored = {name: entry for name, entry in data.get("stored", {}).items() if name in self.compacted}
+
+    def save(self):
+        with self.lock:
+            data = {
+                "images": self.images,
+                "sources": self.sources,
+                "compacted": sorted(self.compacted),
+                "stored": self.stored,
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    def add_image(self, saved_name, digest, img):
+        """
+        บันทึกรูปใหม่และจัดเข้ากลุ่มของรูปแรกของกลุ่มที่ใกล้เคียงที่สุด คืนค่าชื่อกลุ่ม
+        เทียบกับรูปแรกของกลุ่มเท่านั้น กลุ่มจึงไม่ต่อกันเป็นทอด ๆ จากรูปที่ใกล้กันทีละคู่
+        """
+        phash = perceptual_hash(img)
+        entry = {
+            "sha256": digest,
+            "phash": phash,
+            "sharpness": capture_sharpness(img),
+            "pixels": img.width * img.height,
+            "group": saved_name,
+        }
+        with self.lock:
+            nearest = None
+            for name, other in self.images.items():
+                if other["group"] != name:
+                    continue
+                distance = hamming_distance(phash, other["phash"])
+                if distance <= NEAR_DUPLICATE_DISTANCE and (nearest is None or distance < nearest[0]):
+                    nearest = (distance, other["group"])
+            if nearest:
+                entry["group"] = nearest[1]
+            self.images[saved_name] = entry
+            self.save()
+        return entry["group"]
+
+    def add_source(self, digest, pages):
+        with self.lock:
+            self.sources[digest] = [
+                {"saved_name": page["saved_name"], "original_name": page["original_name"]} for page in pages
+            ]
+            self.save()
+
+    def source_pages(self, digest):
+        """หน้าของ PDF/TIFF ที่เคยนำเข้าแล้ว (None ถ้ายังไม่เคย หรือบางหน้าถูกลบไปแล้ว)"""
+        with self.lock:
+            pages = self.sources.get(digest)
+        if not pages or not all(os.path.exists(os.path.join(self.upload_path, page["saved_name"])) for page in pages):
+            return None
+        return pages
+
+    def remove(self, saved_names):
+        with self.lock:
+            for name in saved_names:
+                self.images.pop(name, None)
+                self.compacted.discard(name)
+                self.stored.pop(name, None)
+                for mode in ("single", "multi"):
+                    try:
+                        os.remove(_layout_path(self.upload_path, name, mode))
+                    except OSError:
+                        pass
+            self.save()
+
+    def mark_compacted(self, saved_name, stored_format=None, stored_digest=None):
+        """บันทึกว่ารูปถูกบีบอัดแล้ว ถ้าเนื้อไฟล์ถูกเขียนใหม่ให้ระบุรูปแบบและ sha256 ของไฟล์ใหม่"""
+        with self.lock:
+            self.compacted.add(saved_name)
+            if stored_format:
+                self.stored[saved_name] = {"format": stored_format, "sha256": stored_digest}
+            self.save()
+
+    def stored_type(self, saved_name):
+        """(MIME, นามสกุล) ของเนื้อไฟล์จริงหลังบีบอัด หรือ None ถ้าไฟล์ยังเป็นรูปแบบเดิมตามนามสกุล"""
+        with self.lock:
+            entry = self.stored.get(saved_name)
+        return STORED_FORMATS.get(entry["format"]) if entry else None
+
+    def is_compacted(self, saved_name):
+        with self.lock:
+            return saved_name in self.compacted
+
+    def group_of(self, saved_name):
+        with self.lock:
+            entry = self.images.get(saved_name)
+            return entry["group"] if entry else None
+
+    def capture_match(self, saved_name, other_name):
+        """
+        ความเหมือนของรูปสองรูป: "identical" (เนื้อไฟล์เหมือนกันทุก byte), "similar" (perceptual hash ใกล้เคียงกัน) หรือ None
+        รูปที่ similar ยังไม่พอจะบอกว่าเป็นกระดาษแผ่นเดียวกัน
+        """
+        with self.lock:
+            entry, other = self.images.get(saved_name), self.images.get(other_name)
+        if not entry or not other:
+            return None
+        if entry["sha256"] == other["sha256"]:
+            return "identical"
+        if hamming_distance(entry["phash"], other["phash"]) <= NEAR_DUPLICATE_DISTANCE:
+            return "similar"
+        return None
+
+    def capture_rank(self, saved_name):
+        """ลำดับความดีของรูป (ค่ามากดีกว่า): คมชัดกว่าก่อน แล้วจึงละเอียดกว่า"""
+        with self.lock:
+            entry = self.images.get(saved_name)
+        if not entry:
+            return (0.0, 0)
+        return (entry["sharpness"], entry["pixels"])
+
+    def grading_order(self, filenames, saved_name_of=lambda name: name):
+        """เรียงรูปให้รูปที่ดีที่สุดของแต่ละกลุ่มถูกตรวจก่อนรูปอื่นในกลุ่มเดียวกัน (กลุ่มอยู่ตำแหน่งเดิม)"""
+        def group(name):
+            return self.group_of(saved_name_of(name)) or name
+
+        first_position = {}
+        for position, name in enumerate(filenames):
+            first_position.setdefault(group(name), position)
+        return sorted(
+            filenames,
+            key=lambda name: (
+                first_position[group(name)],
+                tuple(-value for value in self.capture_rank(saved_name_of(name))),
+            ),
+        )
+
+
+def _layout_path(upload_path, saved_name, mode):
+    return os.path.join(upload_path, LAYOUT_FOLDER, f"{saved_name}.{mode}.json")
+
+
+def save_layout(upload_path, saved_name, mode, layout):
+    """เก็บ layout ที่ engine ตรวจได้ของแผ่น (เขียนไฟล์ชั่วคราวแล้ว rename)"""
+    path = _layout_path(upload_path, saved_name, mode)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(layout, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def load_layout(upload_path, saved_name, mode):
+    """layout ของแผ่นจากการตรวจครั้งล่าสุด หรือ None ถ้าไม่มี (ตรวจก่อนมีการเก็บ layout หรือตรวจไม่สำเร็จ)"""
+    try:
+        with open(_layout_path(upload_path, saved_name, mode), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        get_logger().warning(f"Could not read layout of {saved_name}: {e}")
+        return None
+
+
+_indexes_lock = threading.Lock()
+_indexes = {}  # upload_path -> ImageIndex
+
+
+def get_image_index(upload_path):
+    """ImageIndex ของโฟลเดอร์ uploads (อ่านจากดิสก์ครั้งแรก แล้วใช้ร่วมกันทุก thread)"""
+    upload_path = os.path.abspath(upload_path)
+    index_path = os.path.join(upload_path, INDEX_FILENAME)
+    with _indexes_lock:
+        index = _indexes.get(upload_path)
+        # ไฟล์ index ถูกลบ (ล้าง session): เริ่มใหม่
+        if index is None or ((index.images or index.sources) and not os.path.exists(index_path)):
+            index = ImageIndex(upload_path)
+            _indexes[upload_path] = index
+        return index
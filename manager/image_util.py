@@ -1,8 +1,9 @@
 import io
 import os
+import uuid
 import pymupdf
 import cv2
-from PIL import Image
+from PIL import Image, ImageSequence
 from flask import session
 
 from manager.logging_manager import get_logger
@@ -26,9 +27,16 @@ def create_web_optimized_image(pil_image, max_width=800, quality=60):
     return buffer.getvalue()
 
 
-def convert_pdf_to_images(pdf_bytes, original_filename, save_path):
+def convert_pdf_to_images(pdf_source, original_filename, save_path):
+    """
+    แปลง PDF เป็นรูปภาพทีละหน้า
+    pdf_source เป็น bytes หรือ path ของไฟล์ (ใช้ path สำหรับไฟล์ใหญ่เพื่อไม่ต้องโหลดทั้งไฟล์เข้า memory)
+    """
     try:
-        doc = pymupdf.open(stream=pdf_bytes)
+        if isinstance(pdf_source, (str, os.PathLike)):
+            doc = pymupdf.open(pdf_source)
+        else:
+            doc = pymupdf.open(stream=pdf_source)
         converted_files = []
 
         for page_num in range(doc.page_count):
@@ -57,6 +65,7 @@ def convert_pdf_to_images(pdf_bytes, original_filename, save_path):
                     # เก็บ URL ต้นฉบับไว้สำหรับประมวลผล
                 }
             )
+        doc.close()
 
         get_logger().info(
             f"Converted PDF '{original_filename}' to {len(converted_files)} images (with web optimization)"
@@ -67,6 +76,49 @@ def convert_pdf_to_images(pdf_bytes, original_filename, save_path):
         raise ValueError(f"ไม่สามารถแปลงไฟล์ PDF ได้: {str(e)}")
 
 
+def convert_tiff_to_images(tiff_source, original_filename, save_path):
+    """
+    แยก TIFF หลายหน้า (เช่น Group 4 จากเครื่องสแกนความเร็วสูง) เป็นไฟล์หน้าละไฟล์
+    ถอดรหัสทีละ frame และบันทึกหน้าขาวดำเป็น TIFF Group 4 ตามเดิม (ไม่แปลงเป็น PNG)
+    ไฟล์ที่ได้ส่งเข้า OMR engine ได้โดยตรง (cv2.imdecode อ่าน TIFF ได้)
+    tiff_source เป็น bytes หรือ path ของไฟล์
+    """
+    source = tiff_source if isinstance(tiff_source, (str, os.PathLike)) else io.BytesIO(tiff_source)
+    try:
+        converted_files = []
+        with Image.open(source) as tiff:
+            for page_num, frame in enumerate(ImageSequence.Iterator(tiff)):
+                image_filename = f"{uuid.uuid4()}.tif"
+                if frame.mode == "1":
+                    frame.save(os.path.join(save_path, image_filename), format="TIFF", compression="group4")
+                    preview = frame.convert("L")
+                else:
+                    if frame.mode not in ("L", "RGB"):
+                        frame = frame.convert("RGB")
+                    frame.save(os.path.join(save_path, image_filename), format="TIFF", compression="tiff_deflate")
+                    preview = frame
+
+                web_filename = f"web_{image_filename}"
+                with open(os.path.join(save_path, web_filename), 'wb') as f:
+                    f.write(create_web_optimized_image(preview, max_width=800, quality=60))
+
+                converted_files.append(
+                    {
+                        "original_name": f"{original_filename} ({page_num + 1})",
+                        "saved_name": image_filename,
+                        "web_name": web_filename,
+                        "url": f"/uploads/{session['session_id']}/{web_filename}",
+                        "original_url": f"/uploads/{session['session_id']}/{image_filename}",
+                    }
+                )
+
+        get_logger().info(f"Split TIFF '{original_filename}' into {len(converted_files)} pages")
+        return converted_files
+    except Exception as e:
+        get_logger().error(f"Error converting TIFF '{original_filename}': {e}")
+        raise ValueError(f"ไม่สามารถแปลงไฟล์ TIFF ได้: {str(e)}")
+
+
 def clean_image_file(filepath):
     """
     อ่านไฟล์ภาพ, ใช้ adaptive thresholding เพื่อทำให้พื้นหลังขาวสะอาด,
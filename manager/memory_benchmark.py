@@ -0,0 +1,160 @@
+"""
+วัด peak RSS ต่อแผ่นของ engine เทียบโหมดปกติกับโหมดประหยัด memory (OMR_LOW_MEMORY)
+ใช้ประเมินจำนวน worker ที่รันได้ต่อ container
+
+    python -m manager.memory_benchmark answer_key.csv sheet1.jpg sheet2.png ... [--mode single] [--repeat 3]
+
+บน Linux รีเซ็ต peak (VmHWM) ก่อนตรวจแต่ละแผ่นผ่าน /proc/self/clear_refs จึงได้ peak ของแผ่นนั้นจริง
+ระบบอื่นใช้ ru_maxrss ซึ่งเป็น peak สะสมของทั้ง process (แสดงว่า cumulative)
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from flask import Flask
+
+from manager.answer_key_manager import compile_answer_key_bytes
+from manager.artifact_writer import get_artifact_writer
+from manager.logging_manager import setup_logging
+
+MB = 1024 * 1024
+
+
+def _proc_status_kb(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """รีเซ็ต peak RSS ของ process (Linux เท่านั้น) คืนค่า False ถ้าทำไม่ได้"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_rss():
+    kb = _proc_status_kb("VmRSS")
+    return kb * 1024 if kb is not None else None
+
+
+def peak_rss():
+    kb = _proc_status_kb("VmHWM")
+    if kb is not None:
+        return kb * 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # macOS รายงานเป็น byte, Linux เป็น KB
+
+
+def measure_sheet(omr, image_bytes, sheet_filename, mode, answer_key, output_folder, low_memory, parallel):
+    """ตรวจหนึ่งแผ่น (รวมการเขียนรูปผลตรวจ) คืนค่า {peak, ms, student_id, per_sheet}"""
+    per_sheet = reset_peak_rss()
+    start = time.perf_counter()
+    student_id, _, _ = omr.find_and_process_sheet(
+        image_bytes,
+        sheet_filename,
+        mode=mode,
+        single_answer_key=answer_key,
+        multi_answer_key=answer_key,
+        session_debug_folder=output_folder,
+        parallel=parallel,
+        low_memory=low_memory,
+    )
+    # รูปผลตรวจที่รอเขียนอยู่ในคิวเป็นส่วนหนึ่งของ memory ต่อแผ่น
+    get_artifact_writer().flush()
+    return {
+        "peak": peak_rss(),
+        "ms": (time.perf_counter() - start) * 1000,
+        "student_id": student_id,
+        "per_sheet": per_sheet,
+    }
+
+
+def measure_mode(answer_key_path, sheet_paths, mode, repeat, parallel, low_memory):
+    """
+    วัดทุกแผ่นด้วยโหมดเดียว (รันใน process ใหม่ของแต่ละโหมด ไม่ให้ heap ที่เหลือจากอีกโหมดทำให้ค่าเพี้ยน)
+    คืนค่า (RSS ของ worker ที่ว่างหลัง warmup, [ผลของแต่ละแผ่น])
+    """
+    from manager.omr import OMRSystemFinal
+
+    setup_logging(Flask(__name__)).setLevel(logging.WARNING)
+    with open(answer_key_path, "rb") as f:
+        answer_key = compile_answer_key_bytes(f.read(), mode)
+    sheets = []
+    for path in sheet_paths:
+        with open(path, "rb") as f:
+            sheets.append((os.path.basename(path), f.read()))
+
+    omr = OMRSystemFinal()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="omr_memory_benchmark_") as output_folder:
+        # ตรวจรอบแรกทิ้งไว้ก่อน (โหลด library, สร้าง thread ของ ArtifactWriter) ไม่ให้ปนกับผลของแผ่นแรก
+        measure_sheet(omr, sheets[0][1], "warmup", mode, answer_key, output_folder, low_memory, parallel)
+        idle_rss = current_rss() or peak_rss()
+        for name, image_bytes in sheets:
+            runs = [
+                measure_sheet(omr, image_bytes, name, mode, answer_key, output_folder, low_memory, parallel)
+                for _ in range(max(1, repeat))
+            ]
+            result = max(runs, key=lambda r: r["peak"])
+            result["ms"] = min(r["ms"] for r in runs)
+            result["sheet"] = name
+            results.append(result)
+    return idle_rss, results
+
+
+def run(answer_key_path, sheet_paths, mode="single", repeat=3, parallel=False, container_mb=None):
+    context = multiprocessing.get_context("spawn")
+    summary = {}
+    for label, low_memory in (("normal", False), ("low_memory", True)):
+        with context.Pool(1) as pool:
+            idle_rss, results = pool.apply(
+                measure_mode, (answer_key_path, sheet_paths, mode, repeat, parallel, low_memory)
+            )
+        print(f"\n[{label}] idle worker RSS {idle_rss / MB:.1f} MB")
+        print(f"{'sheet':<40} {'student_id':<16} {'peak MB':>9} {'over idle':>10} {'ms':>8}")
+        for result in results:
+            print(
+                f"{result['sheet'][:40]:<40} {str(result['student_id'])[:16]:<16} "
+                f"{result['peak'] / MB:>9.1f} {(result['peak'] - idle_rss) / MB:>10.1f} {result['ms']:>8.1f}"
+            )
+        if not all(result["per_sheet"] for result in results):
+            print("(peak เป็นค่าสะสมของทั้ง process: ระบบนี้รีเซ็ต peak RSS ต่อแผ่นไม่ได้)")
+        summary[label] = (idle_rss, max(result["peak"] for result in results))
+
+    print()
+    for label, (idle_rss, peak) in summary.items():
+        line = f"{label:<12} max peak {peak / MB:.1f} MB ({(peak - idle_rss) / MB:.1f} MB over idle)"
+        if container_mb:
+            line += f"  -> about {int(container_mb * MB // peak)} workers in {container_mb} MB"
+        print(line)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="วัด peak RSS ต่อแผ่นของ engine ตรวจข้อสอบ")
+    parser.add_argument("answer_key", help="ไฟล์เฉลย CSV (ข้อ, คำตอบ)")
+    parser.add_argument("sheets", nargs="+", help="รูปกระดาษคำตอบ")
+    parser.add_argument("--mode", choices=("single", "multi"), default="single")
+    parser.add_argument("--repeat", type=int, default=3, help="จำนวนครั้งที่ตรวจแต่ละแผ่น (รายงาน peak สูงสุด)")
+    parser.add_argument("--parallel", action="store_true", help="ตรวจบล็อกพร้อมกัน (OMR_PARALLEL_BLOCKS)")
+    parser.add_argument("--container-mb", type=int, help="memory ของ container ใช้ประเมินจำนวน worker ที่รันได้")
+    args = parser.parse_args(argv)
+    run(args.answer_key, args.sheets, args.mode, args.repeat, args.parallel, args.container_mb)
+
+
+if __name__ == "__main__":
+    main()
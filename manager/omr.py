@@ -1,22 +1,166 @@
+import functools
+import io
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
+from imutils.perspective import four_point_transform, order_points
 from PIL import Image
-from imutils import contours
-from imutils.perspective import four_point_transform
 
-from image_util import create_web_optimized_image
-from logging_manager import get_logger
+from manager.artifact_writer import get_artifact_writer
+from manager.debug_manager import NULL_TRACE
+from manager.logging_manager import get_logger
+
+# ขนาดด้านยาวสูงสุดที่ engine ใช้ตรวจ (รูปที่ใหญ่กว่านี้ถูกย่อก่อนตรวจ)
+PROCESSING_MAX_DIMENSION = 2000
+
+# ตรวจแบบเร็วว่าเห็นกระดาษครบก่อนอัปโหลด (หน้าถ่ายภาพ)
+PREVIEW_MAX_DIMENSION = 640
+PREVIEW_SHARPNESS_THRESHOLD = 60.0  # variance ของ Laplacian ขั้นต่ำที่ขนาด preview (ต่ำกว่านี้ถือว่าเบลอ)
+PREVIEW_EDGE_MARGIN = 0.01  # บล็อกที่ห่างขอบรูปน้อยกว่าสัดส่วนนี้ถือว่าถูกตัด
+
+# หาบล็อกแบบ coarse-to-fine: หาบนรูปย่อก่อน แล้ว threshold ความละเอียดเต็มเฉพาะบริเวณบล็อก
+COARSE_MAX_DIMENSION = 800
+BLOCK_REFINE_MARGIN = 0.02  # ขยายกรอบบล็อกจากรูปย่อ (สัดส่วนของด้านยาวของรูป) ก่อนหาขอบที่ความละเอียดเต็ม
+BLOCK_REFINE_AREA_TOLERANCE = 0.3  # พื้นที่บล็อกที่ความละเอียดเต็มต่างจากที่คาดจากรูปย่อได้ไม่เกินสัดส่วนนี้
+# พารามิเตอร์ adaptive threshold (blockSize, C) ตัวแรกเป็นค่าปกติ ตัวถัดไปใช้เมื่อหาบล็อก/เส้นตารางไม่พบ
+THRESHOLD_PARAMS = ((21, 5), (31, 10), (15, 3))
+
+# ขีดจำกัดต่อแผ่น กันรูปที่ไม่ใช่กระดาษคำตอบ (ภาพถ่ายทั่วไป/สัญญาณรบกวน) ทำให้การตรวจทั้งชุดค้าง
+try:
+    SHEET_TIME_BUDGET = float(os.environ.get("OMR_SHEET_TIME_BUDGET", 10))  # วินาทีต่อแผ่น (0 = ไม่จำกัด)
+except ValueError:
+    SHEET_TIME_BUDGET = 10.0
+MAX_SHEET_CONTOURS = 5000  # กระดาษคำตอบปกติมีราว 150 contour
+MAX_BLOCK_CANDIDATES = 300  # contour ขนาดใหญ่พอเป็นบล็อกได้ (กระดาษปกติมีไม่ถึง 10)
+
+# โหมด latency ต่ำ: ตรวจบล็อกรหัสและ 4 คอลัมน์ของแผ่นเดียวพร้อมกัน (cv2 ปล่อย GIL ระหว่างประมวลผล)
+# เปิดเมื่อเครื่องมีหลาย core และต้องการให้ผลของแผ่นเดียวเร็วขึ้น ผลตรวจเหมือนโหมดปกติทุกประการ
+PARALLEL_BLOCKS = os.environ.get("OMR_PARALLEL_BLOCKS", "0").lower() in ("1", "true", "yes")
+try:
+    BLOCK_WORKERS = int(os.environ.get("OMR_BLOCK_WORKERS", min(5, os.cpu_count() or 1)))
+except ValueError:
+    BLOCK_WORKERS = min(5, os.cpu_count() or 1)
+
+# โหมดประหยัด memory (รันหลาย worker ต่อ container): คำนวณ matrix ของแต่ละบล็อกครั้งเดียว ไม่ warp รูปสี
+# (วาดกรอบคำตอบบนรูปเต็มผ่านพิกัดที่แปลงกลับ) ถอดรหัส JPEG ขนาดใหญ่แบบย่อ และใช้ buffer ซ้ำระหว่างแผ่น
+# ผลตรวจเหมือนโหมดปกติ (JPEG ที่ถอดรหัสแบบย่อผ่านการย่อต่างวิธี) รูปผลตรวจต่างเล็กน้อยเพราะไม่ผ่านการ warp ไป-กลับ
+LOW_MEMORY = os.environ.get("OMR_LOW_MEMORY", "0").lower() in ("1", "true", "yes")
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# สีกรอบคำตอบตามสถานะการตรวจ (BGR) สถานะอื่นใช้สีแดง
+HIGHLIGHT_COLORS = {
+    "correct": (0, 255, 0),
+    "partial": (0, 255, 255),
+}
+
+
+class SheetRejected(ValueError):
+    """แผ่นที่หยุดตรวจกลางทาง (ไม่ใช่กระดาษคำตอบหรือใช้เวลาเกินกำหนด) ต้องให้ผู้ใช้ตรวจสอบเอง"""
+
+    reason = "rejected"
+
+
+class SheetTimeout(SheetRejected):
+    reason = "timeout"
+
+
+class SheetDeadline:
+    """เวลาสิ้นสุดของการตรวจหนึ่งแผ่น engine เรียก check() ระหว่างขั้นตอนเพื่อยกเลิกเมื่อเกินเวลา"""
+
+    def __init__(self, budget=SHEET_TIME_BUDGET):
+        self.budget = budget
+        self.expires = time.perf_counter() + budget if budget and budget > 0 else None
+
+    def check(self, stage):
+        if self.expires is not None and time.perf_counter() > self.expires:
+            raise SheetTimeout(f"ตรวจเกินเวลา {self.budget:g} วินาที (ขั้นตอน {stage})")
+
+
+NO_DEADLINE = SheetDeadline(0)
+
+_block_pool = None
+_block_pool_lock = threading.Lock()
+
+
+def get_block_pool():
+    """thread pool ที่ใช้ร่วมกันทุกแผ่นในโหมด parallel (สร้างเมื่อใช้ครั้งแรก)"""
+    global _block_pool
+    with _block_pool_lock:
+        if _block_pool is None:
+            _block_pool = ThreadPoolExecutor(max_workers=max(1, BLOCK_WORKERS), thread_name_prefix="omr-block")
+        return _block_pool
+
+
+_scratch = threading.local()
+
+
+def scratch_buffer(name, shape):
+    """
+    array uint8 ที่ใช้ซ้ำระหว่างแผ่นใน thread เดียวกัน (ขยายเมื่อต้องการขนาดใหญ่กว่าเดิมเท่านั้น)
+    ใช้ได้เฉพาะรูปที่ไม่ถูกเก็บต่อหลังตรวจแผ่นเสร็จ (ไม่ใช่รูปที่ส่งให้ ArtifactWriter หรือ debug trace)
+    """
+    buffers = _scratch.__dict__.setdefault("buffers", {})
+    size = int(np.prod(shape))
+    buffer = buffers.get(name)
+    if buffer is None or buffer.size < size:
+        buffer = buffers[name] = np.empty(size, dtype=np.uint8)
+    return buffer[:size].reshape(shape)
+
+
+def decode_image(image_bytes, low_memory=False):
+    """
+    ถอดรหัสรูปและย่อให้ด้านยาวไม่เกิน PROCESSING_MAX_DIMENSION คืนค่ารูป BGR หรือ None
+    low_memory: JPEG ที่ใหญ่กว่าขนาดตรวจหลายเท่าถูกถอดรหัสแบบย่อ (1/2, 1/4, 1/8) ไม่ต้องมีรูปเต็มใน memory
+    """
+    flags = cv2.IMREAD_COLOR
+    if low_memory:
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                longest = max(img.size) if img.format == "JPEG" else 0
+        except Exception:
+            longest = 0
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if longest // factor >= PROCESSING_MAX_DIMENSION:
+                flags = reduced_flag
+                break
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    if max(height, width) > PROCESSING_MAX_DIMENSION:
+        scale = PROCESSING_MAX_DIMENSION / max(height, width)
+        image = cv2.resize(
+            image,
+            (int(width * scale), int(height * scale)),
+            interpolation=cv2.INTER_AREA,
+        )
+    return image
 
 
 class OMRSystemFinal:
     def __init__(self):
-        # ปิด debug mode เพื่อเพิ่มความเร็วในการประมวลผล
-        self.debug_mode = False  # เปลี่ยนจาก True เป็น False
+        # ข้อมูล debug เก็บต่อแผ่นผ่าน debug_trace ของ find_and_process_sheet (ตั้งค่าต่อ session ใน debug_manager)
         self.debug_folder = "debug_output"
         if not os.path.exists(self.debug_folder):
             os.makedirs(self.debug_folder)
+        # เขียนรูปผลตรวจ/รูป debug ในเบื้องหลัง (ผู้เรียกต้อง flush ก่อนอ่านไฟล์หรือส่ง URL)
+        self.artifact_writer = get_artifact_writer()
+        self.tier_stats = {}  # ขั้นตอน -> {tier: จำนวนแผ่น/บล็อกที่สำเร็จด้วย tier นั้น}
+        self._stats_lock = threading.Lock()
+
+    def record_tier(self, stage, tier):
+        with self._stats_lock:
+            counts = self.tier_stats.setdefault(stage, {})
+            counts[tier] = counts.get(tier, 0) + 1
+
+    def tier_statistics(self):
+        """จำนวนครั้งที่แต่ละ tier ของ cascade สำเร็จ (tier "failed" = ทุก tier ไม่สำเร็จ)"""
+        with self._stats_lock:
+            return {stage: dict(counts) for stage, counts in self.tier_stats.items()}
 
     def find_main_blocks(self, contours_list, image_shape):
         h_img, w_img = image_shape[:2]
@@ -54,6 +198,171 @@ class OMRSystemFinal:
 
         return student_id_block_contour, answer_column_contours
 
+    def locate_blocks(self, gray_image, threshold_params=THRESHOLD_PARAMS[0]):
+        """
+        หาบล็อกรหัสและคอลัมน์คำตอบจากรูปขาวดำ คืนค่า (thresh, บล็อกรหัส, รายการคอลัมน์)
+        SheetRejected ถ้ารูปมี contour มากผิดปกติ (ไม่ใช่กระดาษคำตอบ) ก่อนวนลูปตรวจทีละ contour
+        """
+        thresh = self.adaptive_threshold_for_sheet(gray_image, *threshold_params)
+        # findContours ไม่แก้ไขรูปต้นทางตั้งแต่ OpenCV 3.2 จึงไม่ต้อง copy
+        all_contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if len(all_contours) > MAX_SHEET_CONTOURS:
+            raise SheetRejected(f"ภาพมีรายละเอียดมากผิดปกติ ({len(all_contours)} contour) อาจไม่ใช่กระดาษคำตอบ")
+        all_contours = [
+            c
+            for c in all_contours
+            if cv2.contourArea(c)
+               > (gray_image.shape[0] * gray_image.shape[1] * 0.001)
+        ]
+        if len(all_contours) > MAX_BLOCK_CANDIDATES:
+            raise SheetRejected(f"พบบริเวณที่อาจเป็นบล็อก {len(all_contours)} แห่ง อาจไม่ใช่กระดาษคำตอบ")
+        id_block_contour, column_contours = self.find_main_blocks(
+            all_contours, gray_image.shape
+        )
+        return thresh, id_block_contour, column_contours
+
+    def check_sheet_presence(self, image_bytes):
+        """
+        ตรวจแบบเร็วจากรูป preview ขนาดเล็กว่าเห็นบล็อกรหัสและคอลัมน์คำตอบครบ ไม่ชิดขอบ และไม่เบลอ
+        ใช้ขั้นตอนหาบล็อกเดียวกับการตรวจจริงที่ความละเอียดต่ำ (ใช้เวลาไม่กี่ ms)
+        """
+        start_time = time.perf_counter()
+        gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("ไม่สามารถอ่านไฟล์ภาพได้")
+
+        height, width = gray.shape[:2]
+        if max(height, width) > PREVIEW_MAX_DIMENSION:
+            scale = PREVIEW_MAX_DIMENSION / max(height, width)
+            gray = cv2.resize(
+                gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA
+            )
+
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        rejected = None
+        try:
+            _, id_block_contour, column_contours = self.locate_blocks(gray)
+        except SheetRejected as e:
+            rejected, id_block_contour, column_contours = str(e), None, []
+
+        h_img, w_img = gray.shape[:2]
+        margin_x, margin_y = w_img * PREVIEW_EDGE_MARGIN, h_img * PREVIEW_EDGE_MARGIN
+        blocks = column_contours + ([id_block_contour] if id_block_contour is not None else [])
+        cut_off = False
+        for c in blocks:
+            (x, y, w, h) = cv2.boundingRect(c)
+            if x < margin_x or y < margin_y or x + w > w_img - margin_x or y + h > h_img - margin_y:
+                cut_off = True
+                break
+
+        issues = []
+        if rejected:
+            issues.append(rejected)
+        else:
+            if id_block_contour is None:
+                issues.append("ไม่พบบล็อกรหัสนักศึกษา")
+            if len(column_contours) != 4:
+                issues.append(f"พบคอลัมน์คำตอบ {len(column_contours)} จาก 4 คอลัมน์")
+        if cut_off:
+            issues.append("กระดาษชิดขอบหรือถูกตัด")
+        if sharpness < PREVIEW_SHARPNESS_THRESHOLD:
+            issues.append("ภาพเบลอ")
+
+        return {
+            "ok": not issues,
+            "id_block": id_block_contour is not None,
+            "columns": len(column_contours),
+            "cut_off": cut_off,
+            "sharpness": round(sharpness, 1),
+            "issues": issues,
+            "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 1),
+        }
+
+    def _refine_block(self, gray_image, coarse_contour, scale):
+        """
+        หาขอบบล็อกที่ความละเอียดเต็มเฉพาะในกรอบรอบบล็อกที่หาได้จากรูปย่อ
+        คืนค่า (contour ในพิกัดรูปเต็ม, thresh ของกรอบ, (x, y) ของมุมกรอบ) หรือ None ถ้าหาไม่พบ
+        """
+        h_img, w_img = gray_image.shape[:2]
+        x, y, w, h = [int(round(v / scale)) for v in cv2.boundingRect(coarse_contour)]
+        margin = int(max(h_img, w_img) * BLOCK_REFINE_MARGIN)
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(w_img, x + w + margin), min(h_img, y + h + margin)
+        roi_thresh = self.adaptive_threshold_for_sheet(gray_image[y0:y1, x0:x1])
+        roi_contours, _ = cv2.findContours(roi_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not roi_contours:
+            return None
+        best = max(roi_contours, key=cv2.contourArea)
+        # เทียบพื้นที่กรอบสี่เหลี่ยม (contourArea ของรูปย่อคลาดเคลื่อนมากเมื่อขอบบล็อกขาดเป็นช่วง)
+        _, _, best_w, best_h = cv2.boundingRect(best)
+        expected_area = w * h
+        if abs(best_w * best_h - expected_area) > expected_area * BLOCK_REFINE_AREA_TOLERANCE:
+            return None
+        return best + np.array([x0, y0], dtype=best.dtype), roi_thresh, (x0, y0)
+
+    def _locate_coarse(self, gray_image, deadline):
+        """tier แรก: หาบล็อกบนรูปย่อ แล้ว refine ทีละบล็อก คืนค่า (บล็อกรหัส, รายการคอลัมน์) หรือ None"""
+        # ย่อครั้งละครึ่งด้วย pyrDown (เร็วกว่า resize แบบ INTER_AREA หลายเท่า)
+        small, scale = gray_image, 1.0
+        while max(small.shape[:2]) > COARSE_MAX_DIMENSION:
+            small = cv2.pyrDown(small)
+            scale = small.shape[1] / gray_image.shape[1]
+        _, id_block_contour, column_contours = self.locate_blocks(small)
+        if id_block_contour is None or len(column_contours) != 4:
+            return None
+        deadline.check("locate_blocks")
+        blocks = [self._refine_block(gray_image, c, scale) for c in [id_block_contour] + list(column_contours)]
+        if any(block is None for block in blocks):
+            return None
+        return blocks[0], blocks[1:]
+
+    def locate_blocks_cascade(self, gray_image, deadline=NO_DEADLINE):
+        """
+        หาบล็อกรหัสและคอลัมน์คำตอบ เริ่มจากวิธีที่ถูกที่สุด และเปลี่ยนไปใช้วิธีที่แพงกว่าเมื่อไม่สำเร็จ:
+        coarse (รูปย่อ + refine ในบล็อก) -> full (ทั้งรูปที่ความละเอียดเต็ม) -> full ด้วย threshold อื่น
+        คืนค่า (tier, บล็อกรหัส, รายการคอลัมน์) โดยแต่ละบล็อกคือ (contour, thresh, (x, y) ของ thresh)
+        ถ้าทุก tier ไม่สำเร็จ คืนค่า tier เป็น None พร้อมบล็อกที่หาได้จาก tier สุดท้าย
+        """
+        located = self._locate_coarse(gray_image, deadline)
+        if located:
+            return "coarse", located[0], located[1]
+
+        for params in THRESHOLD_PARAMS:
+            deadline.check("locate_blocks")
+            thresh, id_block_contour, column_contours = self.locate_blocks(gray_image, params)
+            id_block = (id_block_contour, thresh, (0, 0)) if id_block_contour is not None else None
+            columns = [(c, thresh, (0, 0)) for c in column_contours]
+            if id_block is not None and len(columns) == 4:
+                tier = "full" if params == THRESHOLD_PARAMS[0] else f"full_threshold_{params[0]}_{params[1]}"
+                return tier, id_block, columns
+        return None, id_block, columns
+
+    def detect_grid_cascade(self, warped_thresh, warp_gray, build_grid, deadline=NO_DEADLINE):
+        """
+        หาเส้นตารางในบล็อก ถ้าไม่ครบลอง threshold บล็อกนั้นใหม่ด้วยพารามิเตอร์อื่น
+        warp_gray() คืนค่ารูปขาวดำของบล็อก (เรียกเฉพาะเมื่อต้องลอง threshold อื่น)
+        build_grid(h_lines, v_lines) คืนค่าตารางช่อง หรือ None ถ้าไม่ครบ
+        คืนค่า (tier หรือ None, thresh ที่ใช้, h_lines, v_lines, ตาราง)
+        """
+        h_lines, v_lines = self.detect_grid_lines(warped_thresh)
+        grid = build_grid(h_lines, v_lines)
+        if grid:
+            return "primary", warped_thresh, h_lines, v_lines, grid
+
+        warped_gray = warp_gray()
+        for params in THRESHOLD_PARAMS[1:]:
+            deadline.check("grid_lines")
+            alt_thresh = self.adaptive_threshold_for_sheet(warped_gray, *params)
+            alt_h_lines, alt_v_lines = self.detect_grid_lines(alt_thresh)
+            grid = build_grid(alt_h_lines, alt_v_lines)
+            if grid:
+                return f"threshold_{params[0]}_{params[1]}", alt_thresh, alt_h_lines, alt_v_lines, grid
+        return None, warped_thresh, h_lines, v_lines, None
+
+    @staticmethod
+    def _valid_grid(grid, expected_length):
+        return grid if grid and len(grid) == expected_length else None
+
     def detect_grid_lines(self, binary_image):
         h, w = binary_image.shape
 
@@ -215,15 +524,21 @@ class OMRSystemFinal:
         max_choice = np.argmax(scores) + 1
         return max_choice
 
-    def adaptive_threshold_for_sheet(self, gray_image):
+    def adaptive_threshold_for_sheet(self, gray_image, block_size=21, c=5):
         blurred = cv2.GaussianBlur(gray_image, (5, 5), 0)
         return cv2.adaptiveThreshold(
-            blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 5
+            blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, c
         )
 
-    def overlay_warped_region(self, base_image, warped_region, corners):
+    @staticmethod
+    def _paste_region(base_image, transformed_back, mask):
+        """วางบล็อกที่แปลงกลับแล้วทับรูปเต็มเฉพาะบริเวณ mask (แก้ไข base_image โดยตรง)"""
+        cv2.copyTo(transformed_back, mask, base_image)
+
+    def _unwarp_region(self, image_shape, warped_region, corners):
+        """แปลงบล็อกที่ถูก warp กลับเป็นพิกัดของรูปเต็ม คืนค่า (รูปที่แปลงกลับ, mask ของบล็อก) หรือ None"""
         try:
-            mask = np.zeros(base_image.shape[:2], dtype=np.uint8)
+            mask = np.zeros(image_shape[:2], dtype=np.uint8)
             cv2.fillPoly(mask, [corners.astype(np.int32)], 255)
             h, w = warped_region.shape[:2]
             rect = np.zeros((4, 2), dtype="float32")
@@ -236,235 +551,348 @@ class OMRSystemFinal:
             src_corners = np.array([[0, 0], [w, 0], [w, h], [0, h]], dtype=np.float32)
             _m = cv2.getPerspectiveTransform(src_corners, rect)
             transformed_back = cv2.warpPerspective(
-                warped_region, _m, (base_image.shape[1], base_image.shape[0])
+                warped_region, _m, (image_shape[1], image_shape[0])
             )
-            mask_inv = cv2.bitwise_not(mask)
-            img_bg = cv2.bitwise_and(base_image, base_image, mask=mask_inv)
-            img_fg = cv2.bitwise_and(transformed_back, transformed_back, mask=mask)
-            combined_image = cv2.add(img_bg, img_fg)
-            return combined_image
+            return transformed_back, mask
         except Exception as e:
-            get_logger().error(f"Error in overlay_warped_region: {e}")
-            return base_image
-
-    def find_and_process_sheet(
-            self,
-            image_bytes,
-            sheet_filename,
-            mode="single",
-            single_answer_key=None,
-            multi_answer_key=None,
-            session_debug_folder="debug_output",
-    ):
-        start_time = time.time()
-        npimg = np.frombuffer(image_bytes, np.uint8)
-        original_image = cv2.imdecode(npimg, cv2.IMREAD_COLOR)
-        if original_image is None:
-            raise ValueError("ไม่สามารถอ่านไฟล์ภาพได้")
-
-        height, width = original_image.shape[:2]
-        if max(height, width) > 2000:
-            scale = 2000 / max(height, width)
-            original_image = cv2.resize(
-                original_image,
-                (int(width * scale), int(height * scale)),
-                interpolation=cv2.INTER_AREA,
-            )
-
-        gray = cv2.cvtColor(original_image, cv2.COLOR_BGR2GRAY)
-        thresh = self.adaptive_threshold_for_sheet(gray)
-        all_contours, _ = cv2.findContours(
-            thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
-        )
-        all_contours = [
-            c
-            for c in all_contours
-            if cv2.contourArea(c)
-               > (original_image.shape[0] * original_image.shape[1] * 0.001)
-        ]
-        id_block_contour, column_contours = self.find_main_blocks(
-            all_contours, original_image.shape
-        )
-        if id_block_contour is None:
-            raise ValueError("ไม่พบบล็อกรหัสนักศึกษา")
-        if len(column_contours) != 4:
-            raise ValueError(f"ไม่สามารถหาคอลัมน์ทั้ง 4 คอลัมน์ได้ (พบ {len(column_contours)})")
-        column_contours = contours.sort_contours(
-            column_contours, method="left-to-right"
-        )[0]
+            get_logger().error(f"Error in _unwarp_region: {e}")
+            return None
 
+    @staticmethod
+    def _block_transform(corners, rotation_for):
+        """
+        matrix perspective ของบล็อก (ขนาดผลลัพธ์เดียวกับ four_point_transform) คำนวณครั้งเดียวแล้วใช้กับทุกรูป
+        rotation_for(กว้าง, สูง) คืนค่าทิศที่ต้องหมุน (cv2.ROTATE_*) หรือ None ซึ่งถูกรวมเข้าใน matrix
+        คืนค่า (matrix, (กว้าง, สูง) หลังหมุน, ทิศที่หมุน)
+        """
+        rect = order_points(corners)
+        (tl, tr, br, bl) = rect
+        width = max(int(np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))),
+                    int(np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))))
+        height = max(int(np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))),
+                     int(np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))))
+        dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype="float32")
+        matrix = cv2.getPerspectiveTransform(rect, dst)
+        rotation = rotation_for(width, height)
+        if rotation == cv2.ROTATE_90_CLOCKWISE:  # (x, y) -> (สูง - 1 - y, x)
+            matrix = np.array([[0, -1, height - 1], [1, 0, 0], [0, 0, 1]]) @ matrix
+            width, height = height, width
+        elif rotation == cv2.ROTATE_90_COUNTERCLOCKWISE:  # (x, y) -> (y, กว้าง - 1 - x)
+            matrix = np.array([[0, 1, 0], [-1, 0, width - 1], [0, 0, 1]]) @ matrix
+            width, height = height, width
+        return matrix, (width, height), rotation
+
+    @staticmethod
+    def _warp_block(image, matrix, size, offset=(0, 0), buffer_name=None):
+        """warp รูป (หรือ thresh ของกรอบที่เริ่มที่ offset) ด้วย matrix ของบล็อก ลง scratch buffer ถ้าระบุชื่อ"""
+        if offset != (0, 0):
+            matrix = matrix @ np.array([[1, 0, offset[0]], [0, 1, offset[1]], [0, 0, 1]])
+        dst = scratch_buffer(buffer_name, (size[1], size[0]) + image.shape[2:]) if buffer_name else None
+        return cv2.warpPerspective(image, matrix, size, dst=dst)
+
+    def _warp_thresh(self, block, rotation_for, gray, buffer_name):
+        """
+        คืนค่า (box, thresh ของบล็อกที่ warp แล้ว, ฟังก์ชันคืนค่ารูปขาวดำของบล็อก, ทิศที่หมุน, matrix)
+        ไม่มี buffer_name = โหมดปกติ (four_point_transform แล้วหมุน, matrix เป็น None)
+        มี buffer_name = โหมดประหยัด memory (matrix เดียวรวมการหมุน ใช้ทั้ง thresh, รูปขาวดำ และการวาดกรอบ)
+        """
+        contour, thresh, offset = block
+        box = cv2.boxPoints(cv2.minAreaRect(contour)).astype("int")
+        corners = box.reshape(4, 2)
+        if buffer_name:
+            matrix, size, rotation = self._block_transform(corners.astype("float32"), rotation_for)
+            warped_thresh = self._warp_block(thresh, matrix, size, offset, buffer_name)
+            return box, warped_thresh, lambda: self._warp_block(gray, matrix, size), rotation, matrix
+
+        warped_thresh = four_point_transform(thresh, corners - offset)
+        rotation = rotation_for(warped_thresh.shape[1], warped_thresh.shape[0])
+        if rotation is not None:
+            warped_thresh = cv2.rotate(warped_thresh, rotation)
+
+        def warp_gray():
+            warped = four_point_transform(gray, corners)
+            return cv2.rotate(warped, rotation) if rotation is not None else warped
+
+        return box, warped_thresh, warp_gray, rotation, None
+
+    def _highlight_block(self, original_image, box, rotation, matrix, marks):
+        """
+        คืนค่าฟังก์ชันที่วาดกรอบคำตอบ marks [((x, y, w, h), สี)] (พิกัดในบล็อกที่ warp แล้ว) ลงบนรูปเต็ม
+        มี matrix (โหมดประหยัด memory หรือวาดจาก layout): แปลงมุมกรอบกลับด้วย inverse แล้ววาดบนรูปเต็มโดยตรง
+        ไม่เช่นนั้น warp บล็อกของรูปสี หมุนตาม rotation วาดกรอบ แล้วแปลงบล็อกกลับวางทับ (วิธีเดิม)
+        """
+        if matrix is not None:
+            inverse = np.linalg.inv(matrix)
+            polygons = []
+            for (x, y, w, h), color in marks:
+                corners = np.array([[[x, y]], [[x + w, y]], [[x + w, y + h]], [[x, y + h]]], dtype=np.float32)
+                polygons.append((np.round(cv2.perspectiveTransform(corners, inverse)).astype(np.int32), color))
+
+            def draw(image):
+                for polygon, color in polygons:
+                    cv2.polylines(image, [polygon], True, color, 3)
+
+            return draw
+
+        warped_highlighted = four_point_transform(original_image, box.reshape(4, 2))
+        if rotation is not None:
+            warped_highlighted = cv2.rotate(warped_highlighted, rotation)
+        for (x, y, w, h), color in marks:
+            cv2.rectangle(warped_highlighted, (x, y), (x + w, y + h), color, 3)
+        region = self._unwarp_region(original_image.shape, warped_highlighted, box.reshape(4, 2))
+        return (lambda image: self._paste_region(image, *region)) if region is not None else None
+
+    @staticmethod
+    def _block_layout(box, rotation, marks):
+        """ตำแหน่งบล็อกและกรอบที่วาด (เก็บเป็น JSON ไว้วาดรูปผลตรวจใหม่โดยไม่ต้องตรวจแผ่นซ้ำ)"""
+        return {
+            "box": box.reshape(4, 2).tolist(),
+            "rotation": rotation,
+            "marks": [[int(x), int(y), int(w), int(h), list(color)] for (x, y, w, h), color in marks],
+        }
+
+    def _read_id_block(self, id_block, gray, original_image, trace, deadline, low_memory=False):
+        """อ่านรหัสนักศึกษาจากบล็อกรหัส คืนค่า (รหัส, box, ฟังก์ชันวาดผลลงรูปผลตรวจ, layout ของบล็อก)"""
+        deadline.check("student_id")
         student_id = ""
-        debug_blocks_image = original_image.copy()
-        highlighted_image = original_image.copy()
-
-        box_id = cv2.boxPoints(cv2.minAreaRect(id_block_contour)).astype("int")
-        cv2.drawContours(debug_blocks_image, [box_id], 0, (0, 255, 0), 2)
-        warped_id_thresh = four_point_transform(thresh, box_id.reshape(4, 2))
-        warped_id_color = four_point_transform(original_image, box_id.reshape(4, 2))
-        warped_id_highlighted = four_point_transform(
-            highlighted_image, box_id.reshape(4, 2)
+        box_id, warped_id_thresh, warp_id_gray, rotation, matrix = self._warp_thresh(
+            id_block,
+            lambda w, h: cv2.ROTATE_90_CLOCKWISE if h > w * 1.5 else None,
+            gray,
+            "id_block" if low_memory and not trace.enabled else None,
         )
 
-        if warped_id_color.shape[0] > warped_id_color.shape[1] * 1.5:
-            warped_id_thresh = cv2.rotate(warped_id_thresh, cv2.ROTATE_90_CLOCKWISE)
-            warped_id_color = cv2.rotate(warped_id_color, cv2.ROTATE_90_CLOCKWISE)
-            warped_id_highlighted = cv2.rotate(
-                warped_id_highlighted, cv2.ROTATE_90_CLOCKWISE
-            )
-
-        id_grid = self.create_id_grid_from_lines(
-            *self.detect_grid_lines(warped_id_thresh)
+        id_tier, warped_id_thresh, id_h_lines, id_v_lines, id_grid = self.detect_grid_cascade(
+            warped_id_thresh,
+            warp_id_gray,
+            lambda h_lines, v_lines: self._valid_grid(self.create_id_grid_from_lines(h_lines, v_lines), 12),
+            deadline,
         )
-        if not id_grid or len(id_grid) != 12:
+        self.record_tier("id_grid", id_tier or "failed")
+        trace.image("id_block", warped_id_thresh)
+        trace.data("id_lines", {"h": id_h_lines, "v": id_v_lines, "tier": id_tier})
+        marks = []
+        if not id_grid:
             student_id = "Error Reading ID"
         else:
             for digit_boxes in id_grid:
                 marked_row = self.detect_marked_answer(warped_id_thresh, digit_boxes)
                 student_id += str(marked_row - 1) if marked_row > 0 else "-"
                 if marked_row > 0:
-                    idx = marked_row - 1
-                    b = digit_boxes[idx]
-                    cv2.rectangle(
-                        warped_id_highlighted,
-                        (b[0], b[1]),
-                        (b[0] + b[2], b[1] + b[3]),
-                        (0, 0, 255),
-                        3,
-                    )
-
-        highlighted_image = self.overlay_warped_region(
-            highlighted_image, warped_id_highlighted, box_id.reshape(4, 2)
-        )
-        if self.debug_mode:
-            # <-- FIX 1: แก้ไข Path ของไฟล์ Debug ย่อยให้ถูกต้อง
-            cv2.imwrite(
-                os.path.join(
-                    session_debug_folder, f"DEBUG_{sheet_filename}_id_block_result.png"
-                ),
-                warped_id_color,
-            )
+                    marks.append((digit_boxes[marked_row - 1], (0, 0, 255)))
 
-        question_counter = 1
-        all_answers_data = {}
-        for j, col_contour in enumerate(column_contours):
-            box = cv2.boxPoints(cv2.minAreaRect(col_contour)).astype("int")
-            cv2.drawContours(debug_blocks_image, [box], 0, (0, 255, 0), 2)
-            warped_col_thresh = four_point_transform(thresh, box.reshape(4, 2))
-            warped_col_color = four_point_transform(original_image, box.reshape(4, 2))
-            warped_col_highlighted = four_point_transform(
-                highlighted_image, box.reshape(4, 2)
-            )
+        return (
+            student_id,
+            box_id,
+            self._highlight_block(original_image, box_id, rotation, matrix, marks),
+            self._block_layout(box_id, rotation, marks),
+        )
 
-            if warped_col_color.shape[1] > warped_col_color.shape[0]:
-                warped_col_thresh = cv2.rotate(
-                    warped_col_thresh, cv2.ROTATE_90_COUNTERCLOCKWISE
-                )
-                warped_col_color = cv2.rotate(
-                    warped_col_color, cv2.ROTATE_90_COUNTERCLOCKWISE
-                )
-                warped_col_highlighted = cv2.rotate(
-                    warped_col_highlighted, cv2.ROTATE_90_COUNTERCLOCKWISE
-                )
-
-            box_rows_in_col = self.create_grid_from_lines(
-                *self.detect_grid_lines(warped_col_thresh), 30, 5
-            )
-            if not box_rows_in_col or len(box_rows_in_col) != 30:
-                for _ in range(30):
-                    all_answers_data[question_counter] = {
-                        "answers": set(),
-                        "status": "incorrect",
-                    }
-                    question_counter += 1
-                continue
+    def _read_column(
+            self, j, column_block, gray, original_image, answer_key, sheet_filename, trace, deadline, low_memory=False
+    ):
+        """ตรวจคำตอบ 30 ข้อของคอลัมน์ที่ j (นับจาก 0) คืนค่า (ผลรายข้อ, box, ฟังก์ชันวาดผลลงรูปผลตรวจ, layout ของบล็อก)"""
+        deadline.check(f"col_{j + 1}")
+        question_counter = j * 30 + 1
+        answers_data = {}
+        box, warped_col_thresh, warp_col_gray, rotation, matrix = self._warp_thresh(
+            column_block,
+            lambda w, h: cv2.ROTATE_90_COUNTERCLOCKWISE if w > h else None,
+            gray,
+            f"col_{j + 1}" if low_memory and not trace.enabled else None,
+        )
 
-            for boxes_for_this_question in box_rows_in_col:
-                densities = [
-                    cv2.countNonZero(warped_col_thresh[y: y + h, x: x + w])
-                    / ((w * h) or 1)
-                    for (x, y, w, h) in boxes_for_this_question
-                ]
-                student_answers_set = {
-                    idx + 1 for idx, density in enumerate(densities) if density > 0.20
-                }
-                highlight_color, status = (0, 0, 255), "incorrect"
-                has_multiple_answers = len(student_answers_set) > 1  # ตรวจจับการกาหลายคำตอบ
-
-                if mode == "single":
-                    correct_answer = single_answer_key.get(question_counter)
-                    if (
-                            len(student_answers_set) == 1
-                            and list(student_answers_set)[0] == correct_answer
-                    ):
-                        highlight_color, status = (0, 255, 0), "correct"
-                    elif has_multiple_answers:
-                        status = "multiple_answers"  # สถานะใหม่สำหรับการกาหลายคำตอบ
-                else:  # multi
-                    correct_answers_set = multi_answer_key.get(question_counter, set())
-                    if not correct_answers_set:
-                        status = "no_key"
-                    elif student_answers_set == correct_answers_set:
-                        highlight_color, status = (0, 255, 0), "correct"
-                    elif student_answers_set and student_answers_set.issubset(
-                            correct_answers_set
-                    ):
-                        highlight_color, status = (0, 255, 255), "partial"
-                all_answers_data[question_counter] = {
-                    "answers": student_answers_set,
-                    "status": status,
-                    "has_multiple_answers": has_multiple_answers,  # เพิ่มข้อมูลนี้
+        col_tier, warped_col_thresh, col_h_lines, col_v_lines, box_rows_in_col = self.detect_grid_cascade(
+            warped_col_thresh,
+            warp_col_gray,
+            lambda h_lines, v_lines: self._valid_grid(self.create_grid_from_lines(h_lines, v_lines, 30, 5), 30),
+            deadline,
+        )
+        self.record_tier("column_grid", col_tier or "failed")
+        trace.image(f"col_{j + 1}", warped_col_thresh)
+        trace.data(f"col_{j + 1}_lines", {"h": col_h_lines, "v": col_v_lines, "tier": col_tier})
+        if not box_rows_in_col:
+            # ทุก tier หาตารางไม่ได้: ทำเครื่องหมายว่าอ่านไม่ได้ (ไม่ใช่แค่ตอบผิด) ให้ผู้ใช้ตรวจเอง
+            get_logger().warning(f"Column {j + 1} of {sheet_filename} is unreadable")
+            for _ in range(30):
+                answers_data[question_counter] = {
+                    "answers": set(),
+                    "status": "incorrect",
+                    "unreadable": True,
                 }
-                for choice_idx, b in enumerate(boxes_for_this_question):
-                    if (choice_idx + 1) in student_answers_set:
-                        cv2.rectangle(
-                            warped_col_highlighted,
-                            (b[0], b[1]),
-                            (b[0] + b[2], b[1] + b[3]),
-                            highlight_color,
-                            3,
-                        )
                 question_counter += 1
+            return answers_data, box, None, self._block_layout(box, rotation, [])
+
+        marks = []
+        for boxes_for_this_question in box_rows_in_col:
+            densities = [
+                cv2.countNonZero(warped_col_thresh[y: y + h, x: x + w])
+                / ((w * h) or 1)
+                for (x, y, w, h) in boxes_for_this_question
+            ]
+            student_answers_set = {
+                idx + 1 for idx, density in enumerate(densities) if density > 0.20
+            }
+            has_multiple_answers = len(student_answers_set) > 1  # ตรวจจับการกาหลายคำตอบ
+
+            # ตรวจด้วย bitmask ของเฉลยที่คอมไพล์แล้ว (O(1) ต่อข้อ)
+            status = answer_key.grade(question_counter, student_answers_set)
+            highlight_color = HIGHLIGHT_COLORS.get(status, (0, 0, 255))
+            answers_data[question_counter] = {
+                "answers": student_answers_set,
+                "status": status,
+                "has_multiple_answers": has_multiple_answers,  # เพิ่มข้อมูลนี้
+            }
+            for choice_idx, b in enumerate(boxes_for_this_question):
+                if (choice_idx + 1) in student_answers_set:
+                    marks.append((b, highlight_color))
+            question_counter += 1
+
+        return (
+            answers_data,
+            box,
+            self._highlight_block(original_image, box, rotation, matrix, marks),
+            self._block_layout(box, rotation, marks),
+        )
 
-            highlighted_image = self.overlay_warped_region(
-                highlighted_image, warped_col_highlighted, box.reshape(4, 2)
-            )
-            if self.debug_mode:
-                # <-- FIX 1: แก้ไข Path ของไฟล์ Debug ย่อยให้ถูกต้อง
-                cv2.imwrite(
-                    os.path.join(
-                        session_debug_folder,
-                        f"DEBUG_{sheet_filename}_col_{j + 1}_result.png",
-                    ),
-                    warped_col_color,
-                )
-
-        if self.debug_mode:
-            cv2.imwrite(
-                os.path.join(
-                    session_debug_folder,
-                    f"DEBUG_{mode}_{sheet_filename}_blocks_detected.png",
-                ),
-                debug_blocks_image,
-            )
+    def find_and_process_sheet(
+            self,
+            image_bytes,
+            sheet_filename,
+            mode="single",
+            single_answer_key=None,
+            multi_answer_key=None,
+            session_debug_folder="debug_output",
+            debug_trace=None,
+            time_budget=SHEET_TIME_BUDGET,
+            parallel=None,
+            low_memory=None,
+            layout=None,
+    ):
+        """
+        ตรวจกระดาษคำตอบหนึ่งแผ่น คืนค่า (รหัสนักศึกษา, ผลรายข้อ, ชื่อไฟล์รูปผลตรวจเวอร์ชันเว็บ)
+        debug_trace (DebugTrace) เก็บ mask, เส้นตารางและเวลาแต่ละขั้นตอนไว้ทำ bundle debug
+        time_budget วินาทีสูงสุดของแผ่นนี้ เกินแล้วยกเลิกด้วย SheetTimeout (ไม่ค้างทั้งชุด)
+        parallel ตรวจบล็อกรหัสและคอลัมน์พร้อมกันบน thread pool (None = ตาม OMR_PARALLEL_BLOCKS)
+        low_memory ไม่ warp รูปสี และวาดผลลงรูปต้นฉบับโดยตรง (None = ตาม OMR_LOW_MEMORY)
+        layout (dict) รับขนาดรูปและตำแหน่งบล็อก/กรอบที่วาด สำหรับ render_from_layout ภายหลัง
+        """
+        trace = debug_trace or NULL_TRACE
+        deadline = SheetDeadline(time_budget)
+        low_memory = LOW_MEMORY if low_memory is None else low_memory
+        start_time = time.time()
+        original_image = decode_image(image_bytes, low_memory)
+        if original_image is None:
+            raise ValueError("ไม่สามารถอ่านไฟล์ภาพได้")
+        trace.mark("decode")
+
+        # รูปขาวดำไม่ถูกเก็บต่อหลังตรวจเสร็จ: โหมดประหยัด memory ใช้ buffer เดิมของ thread นี้
+        gray_buffer = scratch_buffer("gray", original_image.shape[:2]) if low_memory else None
+        gray = cv2.cvtColor(original_image, cv2.COLOR_BGR2GRAY, dst=gray_buffer)
+        deadline.check("decode")
+        block_tier, id_block, column_blocks = self.locate_blocks_cascade(gray, deadline)
+        self.record_tier("blocks", block_tier or "failed")
+        trace.mark("locate_blocks")
+        if trace.enabled:
+            trace.data("image_size", [original_image.shape[1], original_image.shape[0]])
+            trace.data("block_tier", block_tier)
+            trace.data("id_block", cv2.boundingRect(id_block[0]) if id_block is not None else None)
+            trace.data("columns", [cv2.boundingRect(block[0]) for block in column_blocks])
+            if block_tier != "coarse":
+                # tier แบบเต็มรูปใช้ thresh ทั้งรูปอยู่แล้ว ถ้าทุก tier ล้มเหลวสร้างใหม่เพื่อใช้ดูสาเหตุ
+                trace.image("threshold", column_blocks[0][1] if block_tier else self.adaptive_threshold_for_sheet(gray))
+        if id_block is None:
+            raise ValueError("ไม่พบบล็อกรหัสนักศึกษา")
+        if len(column_blocks) != 4:
+            raise ValueError(f"ไม่สามารถหาคอลัมน์ทั้ง 4 คอลัมน์ได้ (พบ {len(column_blocks)})")
+        column_blocks = sorted(column_blocks, key=lambda block: cv2.boundingRect(block[0])[0])  # ซ้ายไปขวา
+
+        answer_key = single_answer_key if mode == "single" else multi_answer_key
+        parallel = (PARALLEL_BLOCKS if parallel is None else parallel) and BLOCK_WORKERS > 1  # เครื่อง core เดียวช้าลง
+
+        # บล็อกรหัสและคอลัมน์คำตอบเป็นอิสระต่อกันหลังหาตำแหน่งได้แล้ว (ตรวจพร้อมกันได้ในโหมด parallel)
+        jobs = [("student_id", lambda: self._read_id_block(
+            id_block, gray, original_image, trace, deadline, low_memory
+        ))]
+        for j, column_block in enumerate(column_blocks):
+            jobs.append((f"col_{j + 1}", functools.partial(
+                self._read_column, j, column_block, gray, original_image, answer_key, sheet_filename, trace, deadline,
+                low_memory,
+            )))
+        if parallel:
+            futures = [get_block_pool().submit(job) for _, job in jobs]
+            try:
+                outcomes = [future.result() for future in futures]
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+            trace.mark("blocks_parallel")
+        else:
+            outcomes = []
+            for stage, job in jobs:
+                outcomes.append(job())
+                trace.mark(stage)
+
+        # รวมผลตามลำดับข้อ และวาดผลของแต่ละบล็อกลงรูปเต็มตามลำดับเดิม (บล็อกรหัสก่อน แล้วคอลัมน์ซ้ายไปขวา)
+        student_id = outcomes[0][0]
+        trace.data("student_id", student_id)
+        all_answers_data = {}
+        renders = [outcomes[0][1:3]]
+        for answers, box, render, _ in outcomes[1:]:
+            all_answers_data.update(answers)
+            renders.append((box, render))
+        if layout is not None:
+            layout["size"] = [original_image.shape[1], original_image.shape[0]]
+            layout["blocks"] = [outcome[3] for outcome in outcomes]
+
+        debug_blocks_image = original_image.copy() if trace.enabled else None
+        # โหมดประหยัด memory ไม่ใช้รูปต้นฉบับอีกแล้วหลังตรวจทุกบล็อก จึงวาดผลลงไปโดยตรง
+        highlighted_image = original_image if low_memory else original_image.copy()
+        for box, render in renders:
+            if render is not None:
+                render(highlighted_image)
+            if trace.enabled:
+                cv2.drawContours(debug_blocks_image, [box], 0, (0, 255, 0), 2)
+
+        trace.image("blocks_detected", debug_blocks_image)
+        trace.image("highlighted", highlighted_image)
+        deadline.check("render")
+        web_highlighted_filename = self._write_highlighted(highlighted_image, mode, sheet_filename, session_debug_folder)
+        trace.mark("render")
+
+        get_logger().info(
+            f"Processing time for {sheet_filename}: {time.time() - start_time:.2f} seconds"
+        )
+        return student_id, all_answers_data, web_highlighted_filename
 
+    def _write_highlighted(self, highlighted_image, mode, sheet_filename, session_debug_folder):
+        """ส่งรูปผลตรวจความละเอียดเต็มและเวอร์ชันเว็บให้ ArtifactWriter คืนค่าชื่อไฟล์เวอร์ชันเว็บ"""
         highlighted_filename = f"highlighted_{mode}_{sheet_filename}.png"
         highlighted_filepath = os.path.join(session_debug_folder, highlighted_filename)
-        cv2.imwrite(highlighted_filepath, highlighted_image)
+        self.artifact_writer.write_image(highlighted_filepath, highlighted_image)
 
-        # สร้างเวอร์ชันเว็บของรูปภาพที่ highlight แล้ว
+        # สร้างเวอร์ชันเว็บที่บีบอัดแล้วของรูปภาพที่ highlight แล้ว
         web_highlighted_filename = f"web_{highlighted_filename}"
         web_highlighted_filepath = os.path.join(session_debug_folder, web_highlighted_filename)
-
-        # แปลง OpenCV image เป็น PIL Image
-        highlighted_rgb = cv2.cvtColor(highlighted_image, cv2.COLOR_BGR2RGB)
-        highlighted_pil = Image.fromarray(highlighted_rgb)
-
-        # สร้างเวอร์ชันเว็บที่บีบอัดแล้ว
-        web_image_data = create_web_optimized_image(highlighted_pil, max_width=800, quality=60)
-        with open(web_highlighted_filepath, 'wb') as f:
-            f.write(web_image_data)
-
-        get_logger().info(
-            f"Processing time for {sheet_filename}: {time.time() - start_time:.2f} seconds"
-        )
-        return student_id, all_answers_data, web_highlighted_filename
+        self.artifact_writer.write_web_image(web_highlighted_filepath, highlighted_image)
+        return web_highlighted_filename
+
+    def render_from_layout(self, image_bytes, layout, sheet_filename, mode="single", session_debug_folder="debug_output"):
+        """
+        วาดรูปผลตรวจใหม่จาก layout ที่เก็บไว้ตอนตรวจ (ตำแหน่งบล็อกและกรอบคำตอบเดิม) โดยไม่ตรวจแผ่นซ้ำ
+        รูปจึงตรงกับผลที่บันทึกไว้เสมอ แม้รูปต้นฉบับถูกบีบอัดไปแล้ว คืนค่าชื่อไฟล์รูปผลตรวจเวอร์ชันเว็บ
+        """
+        image = decode_image(image_bytes)
+        if image is None:
+            raise ValueError("ไม่สามารถอ่านไฟล์ภาพได้")
+        width, height = layout["size"]
+        if (image.shape[1], image.shape[0]) != (width, height):
+            # รูปที่บีบอัดแล้วอาจต่างจากขนาดที่ใช้ตรวจ 1-2 pixel จากการปัดเศษของตัวย่อรูป
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        for block in layout["blocks"]:
+            corners = np.array(block["box"], dtype="float32")
+            matrix, _, rotation = self._block_transform(corners, lambda w, h: block["rotation"])
+            marks = [((x, y, w, h), tuple(color)) for x, y, w, h, color in block["marks"]]
+            self._highlight_block(image, corners, rotation, matrix, marks)(image)
+        return self._write_highlighted(image, mode, sheet_filename, session_debug_folder)
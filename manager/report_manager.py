@@ -0,0 +1,142 @@
+import io
+import os
+import tempfile
+
+import pymupdf
+from PIL import Image, ImageDraw, ImageFont
+
+from manager.export_manager import STREAM_CHUNK_SIZE
+
+# หน้า A4 (หน่วย point)
+PAGE_WIDTH, PAGE_HEIGHT = pymupdf.paper_size("a4")
+PAGE_MARGIN = 28
+
+REPORT_BATCH_PAGES = 25  # จำนวนหน้าที่สร้างใน memory ก่อนบันทึกต่อท้ายไฟล์และส่งออก
+REPORT_IMAGE_WIDTH = 1240  # ความกว้างรูปใน PDF (~150 dpi บน A4)
+REPORT_JPEG_QUALITY = 75
+HEADER_IMAGE_HEIGHT = 70  # ความสูงของแถบ header ในรูป (pixel)
+HEADER_FONT_SIZE = 32
+
+# ฟอนต์ภาษาไทยสำหรับ header (กำหนดเองได้ด้วย OMR_REPORT_FONT)
+THAI_FONT_CANDIDATES = [
+    "C:/Windows/Fonts/tahoma.ttf",
+    "/usr/share/fonts/truetype/tlwg/Garuda.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSansThai-Regular.ttf",
+    "/System/Library/Fonts/Supplemental/Thonburi.ttc",
+]
+
+
+def find_report_font():
+    """คืนค่า path ของฟอนต์ที่รองรับภาษาไทย หรือ None ถ้าไม่พบ"""
+    candidates = [os.environ.get("OMR_REPORT_FONT")] + THAI_FONT_CANDIDATES
+    for path in candidates:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
+def _load_header_font(font_path):
+    """คืนค่า (ฟอนต์, รองรับภาษาไทยหรือไม่)"""
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, HEADER_FONT_SIZE), True
+        except OSError:
+            pass
+    return ImageFont.load_default(), False
+
+
+def _render_page_image(header, image_path, font, thai_supported=True):
+    """
+    วาด header (รหัส ชื่อ คะแนน) เหนือรูปแผ่นคำตอบแล้วบีบอัดเป็น JPEG
+    วาดข้อความลงในรูปเพื่อไม่ต้องฝังฟอนต์ภาษาไทยซ้ำในทุก batch ของ PDF
+    """
+    sheet = None
+    if image_path:
+        with Image.open(image_path) as img:
+            sheet = img.convert("RGB")
+        if sheet.width != REPORT_IMAGE_WIDTH:
+            ratio = REPORT_IMAGE_WIDTH / sheet.width
+            sheet = sheet.resize((REPORT_IMAGE_WIDTH, int(sheet.height * ratio)), Image.Resampling.LANCZOS)
+
+    sheet_height = sheet.height if sheet else HEADER_IMAGE_HEIGHT
+    page_image = Image.new("RGB", (REPORT_IMAGE_WIDTH, HEADER_IMAGE_HEIGHT + sheet_height), "white")
+    draw = ImageDraw.Draw(page_image)
+    if not thai_supported:
+        # ฟอนต์พื้นฐานแสดงภาษาไทยไม่ได้ จึงตัดอักขระที่ไม่ใช่ ASCII ออก
+        header = header.encode("ascii", "ignore").decode("ascii")
+    draw.text((20, 15), header, fill="black", font=font)
+    if sheet:
+        page_image.paste(sheet, (0, HEADER_IMAGE_HEIGHT))
+    else:
+        draw.text((20, HEADER_IMAGE_HEIGHT + 15), "No image", fill="black", font=font)
+
+    buffer = io.BytesIO()
+    page_image.save(buffer, format="JPEG", quality=REPORT_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def _add_sheet_page(doc, header, image_path, font, thai_supported):
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    image_rect = pymupdf.Rect(PAGE_MARGIN, PAGE_MARGIN, PAGE_WIDTH - PAGE_MARGIN, PAGE_HEIGHT - PAGE_MARGIN)
+    page_image = _render_page_image(header, image_path, font, thai_supported)
+    page.insert_image(image_rect, stream=page_image, keep_proportion=True)
+
+
+def _read_new_bytes(path, offset):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_pdf_report(entries):
+    """
+    สร้างรายงาน PDF หนึ่งหน้าต่อหนึ่งแผ่นคำตอบ และส่งออกระหว่างที่สร้าง
+    entries: iterable ของ (ข้อความ header, path ของรูปหรือ None)
+
+    สร้างทีละ REPORT_BATCH_PAGES หน้าแล้วบันทึกแบบ incremental ต่อท้ายไฟล์ชั่วคราว
+    ส่วนต้นของไฟล์ไม่เปลี่ยนหลังบันทึก จึงส่ง bytes ที่เพิ่มขึ้นให้ client ได้ทันที
+    และ memory ที่ใช้ขึ้นกับขนาด batch ไม่ใช่จำนวนนักศึกษา
+    """
+    font, thai_supported = _load_header_font(find_report_font())
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    sent = 0
+    try:
+        doc = pymupdf.open()
+        is_first_save = True
+        pages_in_batch = 0
+        for header, image_path in entries:
+            _add_sheet_page(doc, header, image_path, font, thai_supported)
+            pages_in_batch += 1
+            if pages_in_batch < REPORT_BATCH_PAGES:
+                continue
+
+            # บันทึก batch นี้และเปิดไฟล์ใหม่เพื่อคืน memory ของหน้าที่บันทึกแล้ว
+            if is_first_save:
+                doc.save(pdf_path, garbage=0, deflate=True)
+                is_first_save = False
+            else:
+                doc.save(pdf_path, incremental=True, encryption=pymupdf.PDF_ENCRYPT_KEEP)
+            doc.close()
+            for chunk in _read_new_bytes(pdf_path, sent):
+                sent += len(chunk)
+                yield chunk
+            doc = pymupdf.open(pdf_path)
+            pages_in_batch = 0
+
+        if is_first_save:
+            if doc.page_count == 0:
+                doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            doc.save(pdf_path, garbage=0, deflate=True)
+        elif pages_in_batch:
+            doc.save(pdf_path, incremental=True, encryption=pymupdf.PDF_ENCRYPT_KEEP)
+        doc.close()
+        for chunk in _read_new_bytes(pdf_path, sent):
+            sent += len(chunk)
+            yield chunk
+    finally:
+        os.remove(pdf_path)
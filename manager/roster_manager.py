@@ -0,0 +1,207 @@
+import csv
+import os
+import threading
+from bisect import bisect_left
+
+from manager.session_manager import STATIC_FOLDER, get_session_path
+
+STUDENT_LIST_FILENAME = "student_list.csv"
+SESSION_DATA_FILENAME = "session_data.json"
+
+# คำที่บ่งบอกว่าแถวแรกเป็น header
+HEADER_KEYWORDS_ID = [
+    "student_id", "student_code", "รหัสนักศึกษา", "รหัส", "id", "รหัสประจำตัว",
+    "code", "std_code", "student_no"
+]
+HEADER_KEYWORDS_NAME = [
+    "name", "ชื่อ", "student_name", "ชื่อนักศึกษา", "ชื่อ-สกุล", "ชื่อสกุล",
+    "fname_th", "std_lname_th", "firstname", "lastname", "fullname"
+]
+# คำที่ไม่ควรปรากฏในข้อมูลนักศึกษาจริง (ใช้กรองรายชื่อที่เลือกได้ใน dropdown)
+INVALID_KEYWORDS = [
+    "student_id", "student_code", "รหัสนักศึกษา", "รหัส", "id",
+    "fname_th", "std_lname_th", "name", "ชื่อ", "code"
+]
+INVALID_SUBSTRINGS = ["student_code", "student_id", "fname_th", "std_lname_th"]
+
+# รหัสที่ไม่ถือว่าเป็นรหัสที่ถูกใช้งานแล้ว
+UNUSED_ID_VALUES = {"", "ERROR", "-"}
+
+_cache_lock = threading.Lock()
+_roster_cache = {}  # path -> (version, StudentRoster)
+_used_ids_cache = {}  # (path, mode) -> (version, frozenset)
+
+
+def _file_version(path):
+    """ใช้ mtime (ns) และขนาดไฟล์เป็นตัวบอกว่าไฟล์เปลี่ยนหรือไม่ (None ถ้าไม่มีไฟล์)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _is_header_row(row):
+    student_id_value = row[0].strip().lower() if row else ""
+    name_value = row[1].strip().lower() if len(row) > 1 else ""
+    return (
+        student_id_value in HEADER_KEYWORDS_ID
+        or name_value in HEADER_KEYWORDS_NAME
+        or any(keyword in student_id_value for keyword in ["student_code", "student_id", "code", "รหัส"])
+        or any(keyword in name_value for keyword in ["fname_th", "std_lname_th", "name", "ชื่อ"])
+    )
+
+
+def _is_selectable(student):
+    """ตรวจสอบว่าเป็นข้อมูลนักศึกษาที่เลือกได้ (ไม่ใช่ header หรือข้อมูลเปล่า)"""
+    student_id = student["student_id"]
+    student_name = student["name"]
+    return bool(
+        student_id and student_name
+        and student_id.lower() not in INVALID_KEYWORDS
+        and student_name.lower() not in INVALID_KEYWORDS
+        and not any(keyword in student_id.lower() for keyword in INVALID_SUBSTRINGS)
+        and not any(keyword in student_name.lower() for keyword in INVALID_SUBSTRINGS)
+        and len(student_id) > 3  # รหัสนักศึกษาต้องมีความยาวมากกว่า 3 ตัวอักษร
+    )
+
+
+class StudentRoster:
+    """
+    รายชื่อนักศึกษาที่ parse แล้ว พร้อม index สำหรับค้นหา
+    - by_id: hash lookup ด้วยรหัส
+    - sorted_ids: รหัสที่เรียงแล้วสำหรับค้นหาแบบ prefix/range
+    """
+
+    def __init__(self, students):
+        self.students = students
+        self.by_id = {}
+        for student in students:
+            self.by_id.setdefault(student["student_id"], student)
+        self.names = {sid: (s["fname"], s["lname"]) for sid, s in self.by_id.items()}
+        self.selectable = sorted(
+            (s for s in self.by_id.values() if _is_selectable(s)), key=lambda s: s["student_id"]
+        )
+        self.sorted_ids = [s["student_id"] for s in self.selectable]
+
+    def __len__(self):
+        return len(self.students)
+
+    def get(self, student_id):
+        return self.by_id.get(str(student_id).strip())
+
+    def range(self, low, high):
+        """นักศึกษาที่มีรหัสอยู่ในช่วง [low, high)"""
+        start = bisect_left(self.sorted_ids, low)
+        end = bisect_left(self.sorted_ids, high)
+        return self.selectable[start:end]
+
+    def prefix_search(self, prefix, exclude=None, limit=20):
+        """ค้นหานักศึกษาที่รหัสขึ้นต้นด้วย prefix (ข้ามรหัสใน exclude)"""
+        prefix = str(prefix).strip()
+        start = bisect_left(self.sorted_ids, prefix)
+        matches = []
+        for i in range(start, len(self.sorted_ids)):
+            if not self.sorted_ids[i].startswith(prefix):
+                break
+            if exclude and self.sorted_ids[i] in exclude:
+                continue
+            matches.append(self.selectable[i])
+            if limit and len(matches) >= limit:
+                break
+        return matches
+
+
+def parse_student_list(student_list_path):
+    """อ่านไฟล์รายชื่อนักศึกษา (รองรับ 2, 3 และ 4+ คอลัมน์) และข้าม header row"""
+    students = []
+    with open(student_list_path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        first_row = True
+        for row in reader:
+            if first_row:
+                first_row = False
+                if _is_header_row(row):
+                    continue  # ข้าม header row
+            if not row or len(row) < 2:  # ข้ามแถวว่างหรือไม่ครบ
+                continue
+
+            row = [col.strip() for col in row]
+            if len(row) >= 3:
+                # รูปแบบ: รหัส, ชื่อ, นามสกุล (, กลุ่ม)
+                fname, lname = row[1], row[2]
+                fullname = f"{fname} {lname}".strip()
+            else:
+                # รูปแบบ: รหัส, ชื่อเต็ม
+                fullname = row[1]
+                fname, lname = fullname, ""
+
+            students.append({
+                "student_id": row[0],
+                "name": fullname,
+                "fname": fname,
+                "lname": lname,
+                "group_code": row[3] if len(row) >= 4 else "",
+            })
+    return students
+
+
+def build_roster(student_list_path):
+    """parse รายชื่อและเก็บลง cache (เรียกตอนอัปโหลดไฟล์)"""
+    version = _file_version(student_list_path)
+    roster = StudentRoster(parse_student_list(student_list_path))
+    with _cache_lock:
+        _roster_cache[student_list_path] = (version, roster)
+    return roster
+
+
+def get_roster():
+    """
+    คืนค่า StudentRoster ของ session ปัจจุบันจาก cache (parse ใหม่เมื่อไฟล์เปลี่ยนตาม mtime)
+    คืนค่า roster ว่างถ้ายังไม่ได้อัปโหลดรายชื่อ
+    """
+    student_list_path = os.path.join(get_session_path("config"), STUDENT_LIST_FILENAME)
+    version = _file_version(student_list_path)
+    if version is None:
+        with _cache_lock:
+            _roster_cache.pop(student_list_path, None)
+        return StudentRoster([])
+
+    with _cache_lock:
+        cached = _roster_cache.get(student_list_path)
+    if cached and cached[0] == version:
+        return cached[1]
+    return build_roster(student_list_path)
+
+
+def forget_session_rosters(session_id):
+    """ลบ cache ของ session ที่ถูกล้างหรือหมดอายุ"""
+    prefix = os.path.join(STATIC_FOLDER, session_id) + os.sep
+    with _cache_lock:
+        for path in [path for path in _roster_cache if path.startswith(prefix)]:
+            del _roster_cache[path]
+        for key in [key for key in _used_ids_cache if key[0].startswith(prefix)]:
+            del _used_ids_cache[key]
+
+
+def get_used_student_ids(session_data, mode):
+    """
+    ชุดรหัสนักศึกษาที่ถูกใช้ในผลลัพธ์ของโหมดนั้นแล้ว
+    cache ตาม mtime ของ session_data.json เพื่อไม่ต้องสแกนผลลัพธ์ทุกครั้งที่เปิดหน้าแก้ไข
+    """
+    session_file = os.path.join(get_session_path("config"), SESSION_DATA_FILENAME)
+    version = _file_version(session_file)
+    cache_key = (session_file, mode)
+    with _cache_lock:
+        cached = _used_ids_cache.get(cache_key)
+    if version is not None and cached and cached[0] == version:
+        return cached[1]
+
+    used_ids = frozenset(
+        str(result.get("student_id", "")).strip()
+        for result in session_data.get(f"{mode}_results", [])
+    ) - UNUSED_ID_VALUES
+    if version is not None:
+        with _cache_lock:
+            _used_ids_cache[cache_key] = (version, used_ids)
+    return used_ids
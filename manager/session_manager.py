@@ -1,11 +1,9 @@
 import os
 import json
-import shutil
 import time
 from datetime import datetime
 from multiprocessing import get_logger
 
-import pandas as pd
 from flask import session
 
 STATIC_FOLDER = "config"
@@ -67,21 +65,18 @@ def get_session_path(folder_type):
 
 
 def _cleanup_session_directories(session_id: str):
-    paths_to_delete = [
-        os.path.join(UPLOAD_FOLDER, session_id),
-        os.path.join(DEBUG_FOLDER, session_id),
-        os.path.join(STATIC_FOLDER, session_id),
-    ]
-    for path in paths_to_delete:
-        if os.path.exists(path):
-            try:
-                shutil.rmtree(path)
-                get_logger().info(f"Removed idle session directory: {path}")
-            except Exception as e:
-                get_logger().error(f"Failed to delete directory {path}. Reason: {e}")
-
-
-def _cleanup_inactive_sessions_loop():
+    # ย้ายไปรอลบใน .trash (storage reaper ลบไฟล์จริงในเบื้องหลัง)
+    from manager.storage_manager import get_storage
+
+    try:
+        get_storage().discard_session(session_id)
+        get_logger().info(f"Discarded idle session directories: {session_id}")
+    except Exception as e:
+        get_logger().error(f"Failed to discard directories of session {session_id}. Reason: {e}")
+
+
+def _cleanup_inactive_sessions_loop(on_expired=None):
+    """ลบ session ที่ไม่มี heartbeat เกินเวลา on_expired(session_id) ใช้ล้าง cache ในหน่วยความจำของ session"""
     check_interval = 60  # seconds
     while True:
         try:
@@ -105,6 +100,8 @@ def _cleanup_inactive_sessions_loop():
             for sid in to_remove:
                 get_logger().info(f"Cleaning up inactive session: {sid}")
                 _cleanup_session_directories(sid)
+                if on_expired:
+                    on_expired(sid)
                 active_sessions.pop(sid, None)
 
             if to_remove:
@@ -129,30 +126,6 @@ def save_session_data(data):
         get_logger().error("Attempted to save session data without an active session.")
 
 
-def load_answer_key(mode):
-    try:
-        config_path = get_session_path("config")
-        key_path = os.path.join(config_path, f"answer_key_{mode}.csv")
-    except ValueError:
-        return None, "No active session to load answer key from."
-
-    if not os.path.exists(key_path):
-        return None, f"ไม่พบไฟล์เฉลยสำหรับโหมด {mode}"
-
-    key_dict = {}
-    try:
-        df = pd.read_csv(key_path, header=None, dtype=str)
-        for _, row in df.iterrows():
-            q_num = int(row[0])
-            answers_str = str(row[1])
-            if mode == "single":
-                key_dict[q_num] = int(answers_str)
-            else:  # multi
-                key_dict[q_num] = {int(ans) for ans in answers_str.split("&")}
-        return key_dict, None
-    except Exception as e:
-        return None, f"ผิดพลาดในการอ่านไฟล์เฉลย {mode}: {e}"
-
 def process_data(student_id, student_names, answered_data):
     score = sum(
         1 for data in answered_data.values() if data.get("status") == "correct"
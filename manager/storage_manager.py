@@ -0,0 +1,292 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from manager.logging_manager import get_logger
+from manager.session_manager import DEBUG_FOLDER, STATIC_FOLDER, UPLOAD_FOLDER
+
+TRASH_FOLDER = ".trash"  # โฟลเดอร์ซ่อนในแต่ละ root ที่รอให้ reaper ลบ (อยู่ใน filesystem เดียวกัน จึง rename ได้ทันที)
+SWEEP_INTERVAL = 60.0  # รอบการคำนวณพื้นที่และลบไฟล์ที่สร้างใหม่ได้เมื่อเกินโควตา
+DEFAULT_SESSION_QUOTA_MB = 4096
+DEFAULT_GLOBAL_QUOTA_MB = 20480
+MB = 1024 * 1024
+
+
+def _quota_from_env(name, default_mb):
+    """โควตาจาก environment (MB) 0 หรือค่าติดลบ = ไม่จำกัด"""
+    try:
+        value = float(os.environ.get(name, default_mb))
+    except ValueError:
+        get_logger().warning(f"Invalid {name}, using {default_mb} MB")
+        value = default_mb
+    return int(value * MB) if value > 0 else None
+
+
+def is_regenerable(folder_type, filename):
+    """
+    ไฟล์ที่ลบได้โดยไม่เสียข้อมูล: รูปย่อ web_ (สร้างใหม่จากต้นฉบับเมื่อมีคนเปิด)
+    และทุกไฟล์ใน debug_output (รูป highlighted วาดใหม่จาก layout ที่เก็บตอนตรวจเมื่อเปิดดู)
+    """
+    if folder_type == "debug_output":
+        return True
+    return folder_type == "uploads" and filename.startswith("web_")
+
+
+class StorageManager:
+    """
+    ติดตามพื้นที่ดิสก์ต่อ session และทั้งระบบ ลบไฟล์ที่สร้างใหม่ได้ที่ไม่ได้ใช้นานที่สุดก่อน (LRU) เมื่อเกินโควตา
+    และลบโฟลเดอร์ของ session ที่ถูกล้างในเบื้องหลัง (request แค่ rename โฟลเดอร์ไปที่ .trash)
+    """
+
+    def __init__(self, roots, session_quota=None, global_quota=None, sweep_interval=SWEEP_INTERVAL):
+        self.roots = roots  # folder_type -> root path เช่น {"uploads": "uploads", ...}
+        self.session_quota = session_quota
+        self.global_quota = global_quota
+        self.sweep_interval = sweep_interval
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.reaped_bytes = 0
+        self._usage = {}  # session_id -> {"total", "regenerable"} จากการสแกนล่าสุด (รวมที่เพิ่มหลังสแกน)
+        self._last_access = {}  # path -> เวลาที่เปิดดูล่าสุด (ใช้ร่วมกับ mtime ในการเลือกไฟล์ที่จะลบ)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
+            try:
+                self.reap()
+                self.sweep()
+            except Exception as e:
+                get_logger().error(f"Storage sweep failed: {e}")
+
+    # --- ล้าง session ---
+
+    def discard_session(self, session_id, recreate=False):
+        """
+        ย้ายโฟลเดอร์ของ session ไปที่ .trash (rename ทันทีไม่ว่าจะมีกี่ไฟล์) แล้วปลุก reaper ให้ลบ
+        recreate=True สร้างโฟลเดอร์ว่างแทนที่ทันที (ล้างข้อมูลแต่ใช้ session เดิมต่อ)
+        """
+        for root in self.roots.values():
+            path = os.path.join(root, session_id)
+            if os.path.isdir(path):
+                trash = os.path.join(root, TRASH_FOLDER)
+                os.makedirs(trash, exist_ok=True)
+                os.rename(path, os.path.join(trash, f"{session_id}.{uuid.uuid4().hex}"))
+            if recreate:
+                os.makedirs(path, exist_ok=True)
+        self.start()
+        with self._lock:
+            self._usage.pop(session_id, None)
+            prefixes = tuple(os.path.join(root, session_id) + os.sep for root in self.roots.values())
+            self._last_access = {p: t for p, t in self._last_access.items() if not p.startswith(prefixes)}
+        self._wake.set()
+
+    def reap(self):
+        """ลบโฟลเดอร์ใน .trash ทั้งหมด และล้างพื้นที่ที่นับไว้ของ session เหล่านั้น"""
+        reaped_sessions = set()
+        for root in self.roots.values():
+            trash = os.path.join(root, TRASH_FOLDER)
+            if not os.path.isdir(trash):
+                continue
+            for entry in os.scandir(trash):
+                size = _tree_size(entry.path)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+                except OSError as e:
+                    get_logger().error(f"Failed to delete {entry.path}: {e}")
+                    continue
+                self.reaped_bytes += size
+                reaped_sessions.add(entry.name.rsplit(".", 1)[0])  # ชื่อใน .trash คือ <session_id>.<uuid>
+                get_logger().info(f"Reaped {entry.path} ({size} bytes)")
+        # sweep ที่สแกนก่อนโฟลเดอร์ถูกย้ายอาจบันทึกพื้นที่เดิมกลับมา: ให้สแกนใหม่เมื่อถูกถาม
+        with self._lock:
+            for session_id in reaped_sessions:
+                self._usage.pop(session_id, None)
+
+    # --- นับพื้นที่และโควตา ---
+
+    def record_access(self, path):
+        with self._lock:
+            self._last_access[os.path.abspath(path)] = time.time()
+
+    def record_added(self, session_id, nbytes, regenerable=False):
+        """นับไฟล์ที่บันทึกเพิ่มระหว่างรอบการสแกน (เพื่อให้ตรวจโควตาได้ทันทีโดยไม่ต้องสแกนใหม่)"""
+        with self._lock:
+            usage = self._usage.get(session_id)
+            if usage is None:
+                return  # ยังไม่เคยสแกน: usage() จะสแกนเมื่อถูกถาม
+            usage["total"] += nbytes
+            if regenerable:
+                usage["regenerable"] += nbytes
+
+    def invalidate(self, session_id):
+        """ไฟล์ของ session เปลี่ยนมาก (เช่น บีบอัดรูป): สแกนใหม่เมื่อถูกถามครั้งถัดไป"""
+        with self._lock:
+            self._usage.pop(session_id, None)
+
+    def usage(self, session_id):
+        with self._lock:
+            usage = self._usage.get(session_id)
+            if usage is not None:
+                return dict(usage)
+            last_access = dict(self._last_access)
+        usage = self._scan_session(session_id, last_access)[0]
+        with self._lock:
+            self._usage.setdefault(session_id, usage)
+        return dict(usage)
+
+    def is_over_quota(self, session_id):
+        """พื้นที่ที่ลบไม่ได้ (รูปต้นฉบับ ผลตรวจ) ของ session เกินโควตาแล้ว: ไม่รับไฟล์เพิ่ม"""
+        if self.session_quota is None:
+            return False
+        usage = self.usage(session_id)
+        return usage["total"] - usage["regenerable"] >= self.session_quota
+
+    def _session_files(self, session_id):
+        for folder_type, root in self.roots.items():
+            folder = os.path.join(root, session_id)
+            for dirpath, _, filenames in os.walk(folder):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield folder_type, filename, path, stat
+
+    def _scan_session(self, session_id, last_access):
+        """คืนค่า ({total, regenerable}, รายการไฟล์ที่สร้างใหม่ได้ [(เวลาใช้ล่าสุด, size, path)])"""
+        usage = {"total": 0, "regenerable": 0}
+        candidates = []
+        for folder_type, filename, path, stat in self._session_files(session_id):
+            usage["total"] += stat.st_size
+            if is_regenerable(folder_type, filename):
+                usage["regenerable"] += stat.st_size
+                last_used = max(stat.st_mtime, last_access.get(os.path.abspath(path), 0))
+                candidates.append((last_used, stat.st_size, path))
+        return usage, candidates
+
+    def _session_ids(self):
+        session_ids = set()
+        for root in self.roots.values():
+            if os.path.isdir(root):
+                session_ids.update(
+                    entry.name for entry in os.scandir(root)
+                    if entry.is_dir() and not entry.name.startswith(".")
+                )
+        return session_ids
+
+    def sweep(self):
+        """สแกนพื้นที่ทุก session และลบไฟล์ที่สร้างใหม่ได้ที่ไม่ได้ใช้นานที่สุดจนกว่าจะไม่เกินโควตา"""
+        with self._lock:
+            last_access = dict(self._last_access)
+        scanned = {session_id: self._scan_session(session_id, last_access) for session_id in self._session_ids()}
+
+        all_candidates = []
+        for session_id, (usage, candidates) in scanned.items():
+            candidates.sort()
+            if self.session_quota is not None and usage["total"] > self.session_quota:
+                candidates = self._evict(usage, candidates, usage["total"] - self.session_quota)
+                if usage["total"] > self.session_quota:
+                    get_logger().warning(
+                        f"Session {session_id} uses {usage['total']} bytes, over quota {self.session_quota}"
+                    )
+            all_candidates.extend((c, usage) for c in candidates)
+
+        total = sum(usage["total"] for usage, _ in scanned.values())
+        if self.global_quota is not None and total > self.global_quota:
+            all_candidates.sort(key=lambda item: item[0])
+            excess = total - self.global_quota
+            for (last_used, size, path), usage in all_candidates:
+                if excess <= 0:
+                    break
+                if self._evict_file(path, size):
+                    usage["total"] -= size
+                    usage["regenerable"] -= size
+                    excess -= size
+            if excess > 0:
+                get_logger().warning(f"Storage uses {self.global_quota + excess} bytes, over quota {self.global_quota}")
+
+        with self._lock:
+            self._usage = {session_id: usage for session_id, (usage, _) in scanned.items()}
+
+    def _evict(self, usage, candidates, excess):
+        """ลบไฟล์จากต้นรายการ (เก่าสุด) จนพื้นที่ลดลงอย่างน้อย excess คืนค่าไฟล์ที่เหลือ"""
+        for position, (last_used, size, path) in enumerate(candidates):
+            if excess <= 0:
+                return candidates[position:]
+            if self._evict_file(path, size):
+                usage["total"] -= size
+                usage["regenerable"] -= size
+                excess -= size
+        return []
+
+    def _evict_file(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        return True
+
+    def status(self, session_id=None):
+        with self._lock:
+            total = sum(usage["total"] for usage in self._usage.values())
+        status = {
+            "global_usage": total,
+            "global_quota": self.global_quota,
+            "session_quota": self.session_quota,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+            "reaped_bytes": self.reaped_bytes,
+        }
+        if session_id:
+            status["session_usage"] = self.usage(session_id)
+        return status
+
+
+def _tree_size(path):
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """StorageManager ของทั้งระบบ (โควตาจาก OMR_SESSION_QUOTA_MB และ OMR_GLOBAL_QUOTA_MB)"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = StorageManager(
+                {"uploads": UPLOAD_FOLDER, "debug_output": DEBUG_FOLDER, "config": STATIC_FOLDER},
+                session_quota=_quota_from_env("OMR_SESSION_QUOTA_MB", DEFAULT_SESSION_QUOTA_MB),
+                global_quota=_quota_from_env("OMR_GLOBAL_QUOTA_MB", DEFAULT_GLOBAL_QUOTA_MB),
+            )
+        return _storage
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+
+# จำนวนการเปลี่ยนแปลงสูงสุดที่เก็บไว้ต่อ session (เกินกว่านี้ client ต้องโหลดข้อมูลใหม่ทั้งหมด)
+MAX_CHANGES_PER_SESSION = 2000
+
+# ชนิดของการเปลี่ยนแปลงที่ทำให้ต้องโหลดข้อมูลใหม่ทั้งหมด
+RESET_EVENTS = {"clear"}
+
+
+class ChangeLog:
+    """
+    บันทึกการเปลี่ยนแปลงของแต่ละ session พร้อมเลขลำดับ (sequence number) ที่เพิ่มขึ้นเสมอ
+    ใช้สำหรับ delta sync (/get_changes) และการ replay SSE ด้วย Last-Event-ID
+    """
+
+    def __init__(self, max_entries=MAX_CHANGES_PER_SESSION):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # เริ่มนับจากเวลาที่เปิดเซิร์ฟเวอร์ (ms) เพื่อให้เลขลำดับหลัง restart มากกว่าเลขเดิมที่ client ถืออยู่
+        self._base_seq = int(time.time() * 1000)
+        self._seq = self._base_seq
+        self._sessions = {}
+
+    def current_seq(self, session_id):
+        """เลขลำดับล่าสุดของ session (ถ้ายังไม่มีการเปลี่ยนแปลงจะได้เลขเริ่มต้นของเซิร์ฟเวอร์)"""
+        with self._lock:
+            log = self._sessions.get(session_id)
+            if log and log["entries"]:
+                return log["entries"][-1]["seq"]
+            return log["floor"] if log else self._base_seq
+
+    def record(self, session_id, event, data=None, mode=None, keys=None):
+        """บันทึกการเปลี่ยนแปลงและคืนค่า entry ที่มีเลขลำดับใหม่"""
+        with self._lock:
+            self._seq += 1
+            entry = {
+                "seq": self._seq,
+                "event": event,
+                "data": data,
+                "mode": mode,
+                "keys": list(keys) if keys else [],
+            }
+            log = self._sessions.get(session_id)
+            if log is None:
+                log = {"floor": self._base_seq, "entries": deque()}
+                self._sessions[session_id] = log
+            log["entries"].append(entry)
+            if len(log["entries"]) > self.max_entries:
+                dropped = log["entries"].popleft()
+                log["floor"] = dropped["seq"]
+            return entry
+
+    def since(self, session_id, seq):
+        """
+        คืนค่า (entries, latest_seq) ของการเปลี่ยนแปลงหลังเลขลำดับ seq
+        entries เป็น None ถ้าไม่สามารถตอบแบบ delta ได้ (client ต้องโหลดใหม่ทั้งหมด)
+        """
+        with self._lock:
+            log = self._sessions.get(session_id)
+            floor = log["floor"] if log else self._base_seq
+            entries = list(log["entries"]) if log else []
+        latest = entries[-1]["seq"] if entries else floor
+
+        if seq is None or seq < floor or seq > latest:
+            return None, latest
+        changes = [e for e in entries if e["seq"] > seq]
+        if any(e["event"] in RESET_EVENTS for e in changes):
+            return None, latest
+        return changes, latest
+
+    def forget(self, session_id):
+        """ลบประวัติของ session ที่ถูกลบไปแล้ว"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+def compact_changes(changes):
+    """
+    ยุบรายการเปลี่ยนแปลงให้เหลือสถานะล่าสุดของแต่ละแถว
+    คืนค่า (images, results) โดย results เก็บคีย์ (student_file) ที่เปลี่ยนของแต่ละโหมด
+    """
+    added = {}  # saved_name -> file_info
+    deleted = set()
+    cleaned = {}  # saved_name -> timestamp
+    results = {}  # mode -> {"replaced": bool, "keys": set()}
+
+    for entry in changes:
+        event = entry["event"]
+        if event == "new_image":
+            name = entry["data"]["saved_name"]
+            added[name] = entry["data"]
+            deleted.discard(name)
+        elif event == "delete_images":
+            for name in entry["keys"]:
+                added.pop(name, None)
+                cleaned.pop(name, None)
+                deleted.add(name)
+        elif event == "images_cleaned":
+            for name in entry["keys"]:
+                cleaned[name] = entry["data"]["timestamp"]
+        elif event in ("results_replaced", "results_cleared"):
+            results[entry["mode"]] = {"replaced": True, "keys": set()}
+        elif event == "result_updated":
+            mode_changes = results.setdefault(entry["mode"], {"replaced": False, "keys": set()})
+            if not mode_changes["replaced"]:
+                mode_changes["keys"].update(entry["keys"])
+
+    images = {"added": list(added.values()), "deleted": sorted(deleted), "cleaned": cleaned}
+    return images, results
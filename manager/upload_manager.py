@@ -0,0 +1,322 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import uuid
+import zlib
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_DIRECTORY_SIGNATURES = (b"PK\x01\x02", b"PK\x05\x06", b"PK\x06\x06")
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+
+FLAG_ENCRYPTED = 0x01
+FLAG_DATA_DESCRIPTOR = 0x08
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+MAX_ZIP_ENTRY_SIZE = 50 * 1024 * 1024  # ขนาดสูงสุดของแต่ละไฟล์ใน ZIP หลังแตกไฟล์
+
+# อัปโหลดแบบแบ่งส่วน (resumable)
+CHUNKED_UPLOAD_CHUNK_SIZE = 2 * 1024 * 1024  # ขนาด chunk ที่แนะนำให้ client ใช้
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNKED_UPLOAD_SIZE = 500 * 1024 * 1024
+CHUNK_READ_SIZE = 256 * 1024  # อ่าน body ของ chunk ทีละส่วนเพื่อให้ใช้ memory คงที่
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ZipStreamReader:
+    """
+    อ่านไฟล์ ZIP ทีละส่วนระหว่างที่กำลังอัปโหลด (อ่านจาก local file header ตามลำดับ)
+    feed() คืนค่ารายการไฟล์ที่แตกเสร็จแล้ว [(offset ของ header, ชื่อไฟล์, bytes)]
+
+    ถ้าเจอรูปแบบที่อ่านแบบ stream ไม่ได้ (เช่น STORED ที่ใช้ data descriptor, zip64, เข้ารหัส)
+    จะตั้งค่า deferred = True และหยุดอ่าน ให้ผู้เรียกแตกไฟล์ที่เหลือจาก central directory
+    หลังอัปโหลดเสร็จ
+    """
+
+    def __init__(self, max_entry_size=MAX_ZIP_ENTRY_SIZE):
+        self.max_entry_size = max_entry_size
+        self.finished = False  # ถึง central directory แล้ว
+        self.deferred = False  # ต้องอ่านส่วนที่เหลือด้วย zipfile
+        self.skipped = []  # (ชื่อไฟล์, เหตุผล)
+        self._buffer = bytearray()
+        self._offset = 0  # ตำแหน่งของ _buffer[0] ในไฟล์ ZIP
+        self._entry = None  # ข้อมูลของไฟล์ที่กำลังแตกแบบ data descriptor
+
+    def feed(self, data):
+        if self.finished or self.deferred:
+            return []
+        self._buffer += data
+        entries = []
+        while not (self.finished or self.deferred):
+            entry = self._read_entry()
+            if entry is None:
+                break  # ข้อมูลยังไม่พอ รอ chunk ถัดไป
+            if entry is not False:
+                entries.append(entry)
+        return entries
+
+    def _consume(self, size):
+        del self._buffer[:size]
+        self._offset += size
+
+    def _read_entry(self):
+        """คืนค่า entry ที่แตกเสร็จ, False ถ้าข้ามไฟล์นั้น หรือ None ถ้าข้อมูลยังไม่พอ"""
+        if self._entry is not None:
+            return self._continue_streamed_entry()
+
+        if len(self._buffer) < 4:
+            return None
+        signature = bytes(self._buffer[:4])
+        if signature in CENTRAL_DIRECTORY_SIGNATURES:
+            self.finished = True
+            return None
+        if signature != LOCAL_HEADER_SIGNATURE:
+            self.deferred = True
+            return None
+        if len(self._buffer) < LOCAL_HEADER.size:
+            return None
+
+        (_, _, flags, method, _, _, crc, compressed_size, uncompressed_size, name_length, extra_length) = LOCAL_HEADER.unpack_from(
+            self._buffer
+        )
+        header_size = LOCAL_HEADER.size + name_length + extra_length
+        if len(self._buffer) < header_size:
+            return None
+        name = bytes(self._buffer[LOCAL_HEADER.size:LOCAL_HEADER.size + name_length]).decode(
+            "utf-8" if flags & 0x800 else "cp437"
+        )
+
+        if (
+            flags & FLAG_ENCRYPTED
+            or method not in (METHOD_STORED, METHOD_DEFLATED)
+            or compressed_size == 0xFFFFFFFF
+            or uncompressed_size > self.max_entry_size
+            or (flags & FLAG_DATA_DESCRIPTOR and method == METHOD_STORED)
+        ):
+            self.deferred = True
+            return None
+
+        header_offset = self._offset
+        if flags & FLAG_DATA_DESCRIPTOR:
+            # ไม่รู้ขนาดล่วงหน้า แตกไฟล์ไปเรื่อย ๆ จนกว่า deflate stream จะจบ
+            self._consume(header_size)
+            self._entry = {
+                "offset": header_offset,
+                "name": name,
+                "decompressor": zlib.decompressobj(-15),
+                "chunks": [],
+                "size": 0,
+            }
+            return self._continue_streamed_entry()
+
+        if len(self._buffer) < header_size + compressed_size:
+            return None
+        payload = bytes(self._buffer[header_size:header_size + compressed_size])
+        self._consume(header_size + compressed_size)
+        try:
+            data = payload if method == METHOD_STORED else zlib.decompress(payload, -15)
+        except zlib.error as e:
+            self.skipped.append((name, f"invalid data: {e}"))
+            return False
+        if zlib.crc32(data) != crc:
+            self.skipped.append((name, "CRC mismatch"))
+            return False
+        return header_offset, name, data
+
+    def _continue_streamed_entry(self):
+        entry = self._entry
+        decompressor = entry["decompressor"]
+        if not decompressor.eof:
+            if not self._buffer:
+                return None
+            chunk = decompressor.decompress(bytes(self._buffer))
+            consumed = len(self._buffer) - len(decompressor.unused_data)
+            self._consume(consumed)
+            entry["chunks"].append(chunk)
+            entry["size"] += len(chunk)
+            if entry["size"] > self.max_entry_size:
+                self.deferred = True
+                return None
+            if not decompressor.eof:
+                return None
+
+        # data descriptor: (signature) crc32, compressed size, uncompressed size
+        if len(self._buffer) < 16:
+            return None
+        descriptor_size = 16 if bytes(self._buffer[:4]) == DATA_DESCRIPTOR_SIGNATURE else 12
+        crc = struct.unpack_from("<I", self._buffer, descriptor_size - 12)[0]
+        self._consume(descriptor_size)
+        self._entry = None
+
+        data = b"".join(entry["chunks"])
+        if zlib.crc32(data) != crc:
+            self.skipped.append((entry["name"], "CRC mismatch"))
+            return False
+        return entry["offset"], entry["name"], data
+
+
+class _Crc32:
+    """ตัวคำนวณ CRC32 ที่มี interface แบบเดียวกับ hashlib"""
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self):
+        return f"{self._value:08x}"
+
+
+CHECKSUM_ALGORITHMS = {"sha256": hashlib.sha256, "crc32": _Crc32}
+
+
+class UploadOffsetMismatch(ValueError):
+    """offset ของ chunk ไม่ตรงกับข้อมูลที่เซิร์ฟเวอร์มีอยู่ (client ต้องถามตำแหน่งใหม่แล้วส่งต่อ)"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload offset mismatch, server has {offset} bytes")
+        self.offset = offset
+
+
+def parse_checksum(header):
+    """แยก header "<algorithm> <hex>" คืนค่า (algorithm, hex) หรือ ValueError ถ้าไม่รองรับ"""
+    try:
+        algorithm, digest = header.strip().split(" ", 1)
+    except (AttributeError, ValueError):
+        raise ValueError("Upload-Checksum header must be '<algorithm> <hex digest>'")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+    return algorithm, digest.strip().lower()
+
+
+class ChunkedUpload:
+    """
+    ไฟล์ที่อัปโหลดแบบแบ่งส่วน เก็บเป็นไฟล์ซ่อนในโฟลเดอร์ uploads ของ session
+    (.upload_<id>.json เก็บข้อมูลไฟล์, .upload_<id>.part เก็บข้อมูลที่ได้รับแล้ว)
+    ขนาดของไฟล์ .part คือ offset ปัจจุบัน จึง resume ได้แม้เซิร์ฟเวอร์รีสตาร์ท
+    """
+
+    _active_lock = threading.Lock()
+    _active = set()  # path ของ upload ที่กำลังรับ chunk อยู่
+
+    def __init__(self, folder, upload_id, meta):
+        self.folder = folder
+        self.upload_id = upload_id
+        self.filename = meta["filename"]
+        self.size = meta["size"]
+        self.files = meta.get("files")  # ข้อมูลไฟล์ที่บันทึกแล้ว (None ถ้ายังอัปโหลดไม่เสร็จ)
+
+    @property
+    def part_path(self):
+        return os.path.join(self.folder, f".upload_{self.upload_id}.part")
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.folder, f".upload_{self.upload_id}.json")
+
+    @classmethod
+    def create(cls, folder, filename, size):
+        if size < 0 or size > MAX_CHUNKED_UPLOAD_SIZE:
+            raise ValueError(f"File size must be between 0 and {MAX_CHUNKED_UPLOAD_SIZE} bytes")
+        upload = cls(folder, uuid.uuid4().hex, {"filename": filename, "size": size})
+        open(upload.part_path, "wb").close()
+        with open(upload.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"filename": filename, "size": size}, f, ensure_ascii=False)
+        return upload
+
+    @classmethod
+    def load(cls, folder, upload_id):
+        """คืนค่า ChunkedUpload หรือ None ถ้าไม่พบ"""
+        if not upload_id or not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        try:
+            with open(os.path.join(folder, f".upload_{upload_id}.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(folder, upload_id, meta)
+
+    @property
+    def offset(self):
+        if self.files is not None:
+            return self.size
+        try:
+            return os.path.getsize(self.part_path)
+        except OSError:
+            return 0
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def write_chunk(self, stream, offset, length, checksum):
+        """
+        เขียน chunk จาก stream ต่อท้ายไฟล์ (อ่านทีละ CHUNK_READ_SIZE) คืนค่า offset ใหม่
+        ถ้าข้อมูลไม่ครบหรือ checksum ไม่ตรง จะตัดไฟล์กลับไปที่ offset เดิม
+        """
+        if length is None or length <= 0 or length > MAX_CHUNK_SIZE:
+            raise ValueError(f"Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+        if offset + length > self.size:
+            raise ValueError("Chunk exceeds declared file size")
+        algorithm, expected = parse_checksum(checksum)
+
+        with ChunkedUpload._active_lock:
+            if self.part_path in ChunkedUpload._active:
+                raise UploadOffsetMismatch(self.offset)
+            ChunkedUpload._active.add(self.part_path)
+        try:
+            current = self.offset
+            if offset != current:
+                raise UploadOffsetMismatch(current)
+
+            digest = CHECKSUM_ALGORITHMS[algorithm]()
+            received = 0
+            with open(self.part_path, "r+b") as f:
+                f.seek(offset)
+                try:
+                    while received < length:
+                        data = stream.read(min(CHUNK_READ_SIZE, length - received))
+                        if not data:
+                            break
+                        digest.update(data)
+                        f.write(data)
+                        received += len(data)
+                except Exception:
+                    f.truncate(offset)
+                    raise
+                if received != length:
+                    f.truncate(offset)
+                    raise ValueError(f"Incomplete chunk: received {received} of {length} bytes")
+                if digest.hexdigest() != expected:
+                    f.truncate(offset)
+                    raise ValueError("Chunk checksum mismatch")
+            return offset + length
+        finally:
+            with ChunkedUpload._active_lock:
+                ChunkedUpload._active.discard(self.part_path)
+
+    def finish(self, files):
+        """
+        บันทึกผลการนำเข้าและลบข้อมูลชั่วคราว
+        เก็บผลไว้เพื่อให้ client ที่ไม่ได้รับ response ของ chunk สุดท้ายถามซ้ำได้
+        """
+        self.files = files
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"filename": self.filename, "size": self.size, "files": files}, f, ensure_ascii=False)
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+    def discard(self):
+        for path in (self.part_path, self.meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,285 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import struct
+import threading
+import time
+from queue import Empty, Queue
+
+from manager.logging_manager import get_logger
+
+SETTLE_SECONDS = 2.0  # ไฟล์ต้องมีขนาดและเวลาแก้ไขคงที่นานเท่านี้จึงถือว่าเขียนเสร็จ
+POLL_INTERVAL = 2.0  # รอบการตรวจโฟลเดอร์เมื่อใช้ polling (และรอบตรวจไฟล์ที่รอให้เขียนเสร็จ)
+FULL_SCAN_INTERVAL = 30.0  # สแกนทั้งโฟลเดอร์เป็นระยะแม้ใช้ inotify (network share อาจไม่ส่ง event)
+INGEST_BATCH_SIZE = 20  # จำนวนไฟล์สูงสุดที่ส่งให้ callback ต่อครั้ง
+KEEPALIVE_INTERVAL = 60.0  # เรียก keepalive ระหว่างที่ watcher ทำงาน เพื่อไม่ให้ session ถูกลบ
+PROCESSED_FOLDER = "processed"
+FAILED_FOLDER = "failed"
+
+# inotify (Linux)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    """inotify ผ่าน ctypes (ไม่ต้องติดตั้งแพ็กเกจเพิ่ม) ใช้ได้เฉพาะ Linux"""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def read_names(self, timeout):
+        """รอ event ไม่เกิน timeout วินาที คืนค่าชื่อไฟล์ที่มีการเปลี่ยนแปลง"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, _, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class HotFolderWatcher:
+    """
+    เฝ้าโฟลเดอร์ที่เครื่องสแกนเขียนไฟล์ลงมา และส่งไฟล์ที่เขียนเสร็จแล้วให้ on_files ทีละชุด
+    ใช้ inotify ถ้าทำได้ ไม่เช่นนั้น (Windows, macOS, network share บางแบบ) ใช้การสแกนเป็นรอบ
+    ไฟล์ที่นำเข้าแล้วถูกย้ายไป processed/ (หรือ failed/) เพื่อไม่ให้นำเข้าซ้ำเมื่อเริ่ม watcher ใหม่
+
+    on_files(paths) คืนค่า {path: True/False} ว่านำเข้าสำเร็จหรือไม่
+    """
+
+    def __init__(self, path, on_files, accept, keepalive=None, settle_seconds=SETTLE_SECONDS,
+                 poll_interval=POLL_INTERVAL, use_inotify=True):
+        self.path = os.path.abspath(path)
+        self.on_files = on_files
+        self.accept = accept
+        self.keepalive = keepalive
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.backend = None
+        self.ingested = 0
+        self.failed = 0
+        self.last_error = None
+        self._pending = {}  # ชื่อไฟล์ -> (ขนาด, mtime, เวลาที่เห็นค่านี้ครั้งแรก)
+        self._done = set()  # ไฟล์ที่ย้ายออกไม่ได้ (กันนำเข้าซ้ำ): (ชื่อ, ขนาด, mtime)
+        self._queue = Queue()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for target in (self._watch_loop, self._ingest_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def status(self):
+        return {
+            "path": self.path,
+            "backend": self.backend,
+            "running": self.running,
+            "pending": len(self._pending),
+            "queued": self._queue.qsize(),
+            "ingested": self.ingested,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+    def _scan(self):
+        try:
+            return {
+                entry.name for entry in os.scandir(self.path)
+                if entry.is_file() and not entry.name.startswith(".")
+            }
+        except OSError as e:
+            self.last_error = str(e)
+            return set()
+
+    def _watch_loop(self):
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = _Inotify(self.path)
+            except (OSError, AttributeError) as e:
+                get_logger().info(f"inotify unavailable for {self.path}, using polling: {e}")
+        self.backend = "inotify" if inotify else "polling"
+        get_logger().info(f"Hot folder watcher started on {self.path} ({self.backend})")
+
+        last_full_scan = 0
+        last_keepalive = 0
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if inotify is None or now - last_full_scan >= FULL_SCAN_INTERVAL:
+                    names = self._scan()
+                    last_full_scan = now
+                else:
+                    names = set()
+                for name in names:
+                    self._pending.setdefault(name, None)
+                self._check_pending()
+
+                if self.keepalive and now - last_keepalive >= KEEPALIVE_INTERVAL:
+                    last_keepalive = now
+                    self.keepalive()
+
+                if inotify is None:
+                    self._stop.wait(self.poll_interval)
+                else:
+                    # รอ event ใหม่ แต่ไม่นานกว่า poll_interval เพื่อตรวจไฟล์ที่รอให้เขียนเสร็จ
+                    for name in inotify.read_names(self.poll_interval):
+                        if not name.startswith("."):
+                            self._pending.setdefault(name, None)
+        except Exception as e:
+            self.last_error = str(e)
+            get_logger().error(f"Hot folder watcher for {self.path} stopped: {e}")
+            self._stop.set()
+        finally:
+            if inotify:
+                inotify.close()
+
+    def _check_pending(self):
+        """ย้ายไฟล์ที่ขนาดและ mtime ไม่เปลี่ยนนาน settle_seconds เข้าคิวนำเข้า (debounce การเขียนไม่เสร็จ)"""
+        now = time.monotonic()
+        for name, observed in list(self._pending.items()):
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[name]  # ไฟล์ถูกลบหรือย้ายไปแล้ว
+                continue
+            if not self.accept(name):
+                del self._pending[name]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if (name,) + signature in self._done:
+                del self._pending[name]
+                continue
+            if observed is None or observed[:2] != signature or stat.st_size == 0:
+                self._pending[name] = signature + (now,)
+                continue
+            if now - observed[2] >= self.settle_seconds:
+                del self._pending[name]
+                self._done.add((name,) + signature)
+                self._queue.put(path)
+
+    def _ingest_loop(self):
+        while not self._stop.is_set():
+            try:
+                paths = [self._queue.get(timeout=self.poll_interval)]
+            except Empty:
+                continue
+            while len(paths) < INGEST_BATCH_SIZE:
+                try:
+                    paths.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                outcome = self.on_files(paths)
+            except Exception as e:
+                self.last_error = str(e)
+                get_logger().error(f"Hot folder ingest failed: {e}")
+                outcome = {}
+            for path in paths:
+                ok = outcome.get(path, False)
+                if ok:
+                    self.ingested += 1
+                else:
+                    self.failed += 1
+                self._archive(path, PROCESSED_FOLDER if ok else FAILED_FOLDER)
+
+    def _archive(self, path, folder):
+        target_folder = os.path.join(self.path, folder)
+        try:
+            os.makedirs(target_folder, exist_ok=True)
+            target = os.path.join(target_folder, os.path.basename(path))
+            if os.path.exists(target):
+                name, ext = os.path.splitext(os.path.basename(path))
+                target = os.path.join(target_folder, f"{name}_{int(time.time())}{ext}")
+            shutil.move(path, target)
+        except OSError as e:
+            # โฟลเดอร์อ่านอย่างเดียว: ยังกันนำเข้าซ้ำได้ด้วย _done ระหว่างที่ watcher ทำงาน
+            get_logger().warning(f"Could not move {path} to {folder}/: {e}")
+
+
+_watchers_lock = threading.Lock()
+_watchers = {}  # session_id -> HotFolderWatcher
+
+
+def allowed_watch_roots():
+    """โฟลเดอร์ที่อนุญาตให้เฝ้าได้ (OMR_HOT_FOLDER_ROOTS คั่นด้วย os.pathsep) ถ้าไม่ตั้งค่าจะปิดฟีเจอร์นี้"""
+    roots = os.environ.get("OMR_HOT_FOLDER_ROOTS", "")
+    return [os.path.realpath(root) for root in roots.split(os.pathsep) if root.strip()]
+
+
+def resolve_watch_path(path):
+    """ตรวจสอบว่า path อยู่ในโฟลเดอร์ที่อนุญาต คืนค่า path จริง (PermissionError/ValueError ถ้าใช้ไม่ได้)"""
+    roots = allowed_watch_roots()
+    if not roots:
+        raise PermissionError("Hot folder is disabled (set OMR_HOT_FOLDER_ROOTS)")
+    real_path = os.path.realpath(path or "")
+    if not any(os.path.commonpath([real_path, root]) == root for root in roots):
+        raise PermissionError("Folder is outside OMR_HOT_FOLDER_ROOTS")
+    if not os.path.isdir(real_path):
+        raise ValueError(f"Folder not found: {path}")
+    return real_path
+
+
+def start_watcher(session_id, watcher):
+    """ผูก watcher กับ session (หยุด watcher เดิมของ session ถ้ามี)"""
+    with _watchers_lock:
+        for other_id, other in _watchers.items():
+            if other_id != session_id and other.running and other.path == watcher.path:
+                raise ValueError("Folder is already bound to another session")
+        previous = _watchers.pop(session_id, None)
+        _watchers[session_id] = watcher
+    if previous:
+        previous.stop()
+    watcher.start()
+
+
+def stop_watcher(session_id):
+    with _watchers_lock:
+        watcher = _watchers.pop(session_id, None)
+    if watcher:
+        watcher.stop()
+    return watcher
+
+
+def get_watcher(session_id):
+    with _watchers_lock:
+        return _watchers.get(session_id)
@@ -9,12 +9,14 @@ document.addEventListener('DOMContentLoaded', function() {
     const progressFill = document.getElementById('progress-fill');
     
     let selectedFilesList = [];
+    const previewChecks = new Map();  // File -> ผลตรวจ preview
 
     // Handle file selection
     function handleFiles(files) {
         selectedFilesList = Array.from(files);
         updateFileList();
         uploadBtn.disabled = selectedFilesList.length === 0;
+        checkSelectedFiles(selectedFilesList);
     }
 
     // Update file list display
@@ -39,8 +41,13 @@ document.addEventListener('DOMContentLoaded', function() {
             fileSize.className = 'file-size';
             fileSize.textContent = formatFileSize(file.size);
             
+            const fileCheck = document.createElement('span');
+            fileCheck.className = 'file-check';
+            fileCheck.dataset.index = index;
+
             fileItem.appendChild(fileName);
             fileItem.appendChild(fileSize);
+            fileItem.appendChild(fileCheck);
             fileList.appendChild(fileItem);
         });
     }
@@ -54,39 +61,145 @@ document.addEventListener('DOMContentLoaded', function() {
         return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
     }
 
+    let captureSettingsPromise = null;
+
+    // ขนาดและคุณภาพรูปที่เซิร์ฟเวอร์ใช้ตรวจ (null ถ้าถามไม่ได้ จะอัปโหลดไฟล์เดิม)
+    function getCaptureSettings() {
+        if (!captureSettingsPromise) {
+            captureSettingsPromise = fetch('/capture_settings')
+                .then(response => (response.ok ? response.json() : null))
+                .catch(() => null);
+        }
+        return captureSettingsPromise;
+    }
+
+    function encodeImage(source, width, height, type, quality) {
+        // OffscreenCanvas บีบอัดแบบ async โดยไม่ต้องเพิ่ม canvas ลงในหน้า
+        if (typeof OffscreenCanvas !== 'undefined') {
+            const canvas = new OffscreenCanvas(width, height);
+            canvas.getContext('2d').drawImage(source, 0, 0, width, height);
+            return canvas.convertToBlob({ type, quality });
+        }
+        const canvas = document.createElement('canvas');
+        canvas.width = width;
+        canvas.height = height;
+        canvas.getContext('2d').drawImage(source, 0, 0, width, height);
+        return new Promise(resolve => canvas.toBlob(resolve, type, quality));
+    }
+
+    // ถอดรหัสรูปแล้วย่อให้ด้านยาวไม่เกิน maxDimension คืนค่า Blob
+    // คืนค่า null ถ้าเบราว์เซอร์ถอดรหัสไม่ได้ (เช่น HEIC, TIFF หลายหน้า)
+    async function downscaleImage(file, maxDimension, type, quality) {
+        if (!file.type.startsWith('image/') || /tiff/i.test(file.type) || typeof createImageBitmap !== 'function') {
+            return null;
+        }
+        let bitmap;
+        try {
+            bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+        } catch (error) {
+            return null;
+        }
+        try {
+            const scale = Math.min(1, maxDimension / Math.max(bitmap.width, bitmap.height));
+            const width = Math.round(bitmap.width * scale);
+            const height = Math.round(bitmap.height * scale);
+            return await encodeImage(bitmap, width, height, type, quality);
+        } finally {
+            bitmap.close();
+        }
+    }
+
+    // ย่อรูปจากกล้องให้ด้านยาวไม่เกินที่ engine ใช้ตรวจและบีบอัดเป็น JPEG (ใช้ไฟล์เดิมถ้าไม่ได้เล็กลง)
+    async function prepareImageForUpload(file) {
+        const settings = await getCaptureSettings();
+        if (!settings) return file;
+        try {
+            const blob = await downscaleImage(file, settings.max_dimension, settings.mime_type, settings.jpeg_quality);
+            if (!blob || blob.size >= file.size) {
+                return file;
+            }
+            const name = file.name.replace(/\.[^.]+$/, '') + '.jpg';
+            return new File([blob], name, { type: settings.mime_type, lastModified: file.lastModified });
+        } catch (error) {
+            console.warn('Could not downscale image, uploading original:', error);
+            return file;
+        }
+    }
+
+    async function postSheetPreview(preview) {
+        const response = await fetch('/check_sheet_preview', {
+            method: 'POST',
+            headers: { 'Content-Type': 'image/jpeg' },
+            body: preview
+        });
+        return response.ok ? await response.json() : null;
+    }
+
+    // ส่งรูปขนาดเล็กให้เซิร์ฟเวอร์ตรวจว่าเห็นกระดาษครบและไม่เบลอ (null ถ้าตรวจไม่ได้)
+    async function checkSheetPreview(file) {
+        const settings = await getCaptureSettings();
+        if (!settings || !settings.preview_max_dimension) return null;
+        try {
+            const preview = await downscaleImage(file, settings.preview_max_dimension, 'image/jpeg', 0.8);
+            if (!preview) return null;
+            return await postSheetPreview(preview);
+        } catch (error) {
+            console.warn('Sheet preview check failed:', error);
+            return null;
+        }
+    }
+
+    // ตรวจรูปที่เลือกทีละรูปและแสดงผลในรายการ เพื่อให้ถ่ายใหม่ได้ทันที
+    async function checkSelectedFiles(files) {
+        for (const [index, file] of files.entries()) {
+            const status = fileList.querySelector(`.file-check[data-index="${index}"]`);
+            if (status) status.textContent = '⏳';
+            const check = await checkSheetPreview(file);
+            if (files !== selectedFilesList) return;  // ผู้ใช้เลือกไฟล์ใหม่ระหว่างตรวจ
+            previewChecks.set(file, check);
+            if (!status) continue;
+            if (!check) {
+                status.textContent = '';
+            } else if (check.ok) {
+                status.textContent = '✅';
+            } else {
+                status.textContent = `⚠️ ${check.issues.join(', ')}`;
+                status.classList.add('file-check-failed');
+            }
+        }
+    }
+
     // Handle upload
     async function uploadFiles() {
         if (selectedFilesList.length === 0) return;
 
+        // รูปที่ตรวจแล้วไม่เห็นกระดาษครบหรือเบลอ จะอ่านไม่ได้ตอนตรวจจริง
+        const failedFiles = selectedFilesList.filter(file => previewChecks.get(file)?.ok === false);
+        let filesToUpload = selectedFilesList;
+        if (failedFiles.length > 0) {
+            if (!confirm(`มี ${failedFiles.length} รูปที่เห็นกระดาษไม่ครบหรือเบลอ ควรถ่ายใหม่\nกด OK เพื่ออัปโหลดเฉพาะรูปที่ผ่าน หรือ Cancel เพื่อกลับไปถ่ายใหม่`)) {
+                return;
+            }
+            filesToUpload = selectedFilesList.filter(file => !failedFiles.includes(file));
+            if (filesToUpload.length === 0) return;
+        }
+
         progressOverlay.style.display = 'flex';
-        progressText.textContent = `กำลังอัปโหลด ${selectedFilesList.length} ไฟล์...`;
+        progressText.textContent = `กำลังอัปโหลด ${filesToUpload.length} ไฟล์...`;
         progressFill.style.width = '0%';
 
-        const formData = new FormData();
-        selectedFilesList.forEach(file => {
-            formData.append('files', file);
-        });
-
         try {
-            // Simulate progress
-            let progress = 0;
-            const progressInterval = setInterval(() => {
-                progress += Math.random() * 15;
-                if (progress > 90) progress = 90;
-                progressFill.style.width = progress + '%';
-            }, 200);
-
-            const response = await fetch('/upload_image', {
-                method: 'POST',
-                body: formData
-            });
-
-            clearInterval(progressInterval);
-            progressFill.style.width = '100%';
-
-            if (!response.ok) {
-                throw new Error('Upload failed');
+            // ย่อรูปบนมือถือแล้วอัปโหลดทีละไฟล์แบบแบ่งส่วน ถ้าสัญญาณหลุดจะส่งต่อจากจุดเดิมแทนการเริ่มใหม่
+            const fileCount = filesToUpload.length;
+            for (const [index, file] of filesToUpload.entries()) {
+                progressText.textContent = `กำลังย่อรูป ${index + 1}/${fileCount}...`;
+                const uploadFile = await prepareImageForUpload(file);
+                progressText.textContent = `กำลังอัปโหลด ${index + 1}/${fileCount} ไฟล์...`;
+                await ChunkedUpload.upload(uploadFile, (sent, total) => {
+                    progressFill.style.width = `${((index + sent / total) / fileCount) * 100}%`;
+                });
             }
+            progressFill.style.width = '100%';
 
             progressText.textContent = '✅ อัปโหลดสำเร็จ!';
             
@@ -134,6 +247,189 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // ---- ถ่ายต่อเนื่องอัตโนมัติ: วางกระดาษทีละแผ่นใต้กล้อง ระบบถ่ายเองเมื่อภาพนิ่งและเห็นกระดาษครบ ----
+    const burstBtn = document.getElementById('burst-btn');
+    const burstOverlay = document.getElementById('burst-overlay');
+    const burstVideo = document.getElementById('burst-video');
+    const burstStatus = document.getElementById('burst-status');
+    const burstCounts = document.getElementById('burst-counts');
+    const burstStopBtn = document.getElementById('burst-stop-btn');
+    const queueStatus = document.getElementById('queue-status');
+    const queueParked = document.getElementById('queue-parked');
+    const queueParkedText = document.getElementById('queue-parked-text');
+
+    const BURST_INTERVAL = 250;  // ms ระหว่างการตรวจเฟรม
+    const SIGNATURE_SIZE = 32;  // ย่อเฟรมเป็นภาพเทา 32x32 เพื่อวัดการเคลื่อนไหว
+    const STILL_THRESHOLD = 6;  // ผลต่างเฉลี่ยต่อพิกเซลที่ยังถือว่ากล้องนิ่ง
+    const NEW_SHEET_THRESHOLD = 12;  // ผลต่างจากภาพที่ถ่ายล่าสุดที่ถือว่าเป็นกระดาษแผ่นใหม่
+    const STABLE_FRAMES = 2;  // จำนวนเฟรมนิ่งและผ่านการตรวจติดกันก่อนถ่าย
+
+    let burstStream = null;
+    let burstTimer = null;
+    let burstCaptured = 0;
+    let previousSignature = null;
+    let lastCaptureSignature = null;
+    let sheetRemoved = true;
+    let stableFrames = 0;
+    const signatureCanvas = document.createElement('canvas');
+    signatureCanvas.width = SIGNATURE_SIZE;
+    signatureCanvas.height = SIGNATURE_SIZE;
+
+    function frameSignature() {
+        const context = signatureCanvas.getContext('2d', { willReadFrequently: true });
+        context.drawImage(burstVideo, 0, 0, SIGNATURE_SIZE, SIGNATURE_SIZE);
+        const pixels = context.getImageData(0, 0, SIGNATURE_SIZE, SIGNATURE_SIZE).data;
+        const signature = new Uint8Array(SIGNATURE_SIZE * SIGNATURE_SIZE);
+        for (let i = 0; i < signature.length; i++) {
+            signature[i] = (pixels[i * 4] * 77 + pixels[i * 4 + 1] * 150 + pixels[i * 4 + 2] * 29) >> 8;
+        }
+        return signature;
+    }
+
+    function signatureDiff(a, b) {
+        if (!a || !b) return Infinity;
+        let total = 0;
+        for (let i = 0; i < a.length; i++) {
+            total += Math.abs(a[i] - b[i]);
+        }
+        return total / a.length;
+    }
+
+    function encodeVideoFrame(maxDimension, type, quality) {
+        const scale = Math.min(1, maxDimension / Math.max(burstVideo.videoWidth, burstVideo.videoHeight));
+        const width = Math.round(burstVideo.videoWidth * scale);
+        const height = Math.round(burstVideo.videoHeight * scale);
+        return encodeImage(burstVideo, width, height, type, quality);
+    }
+
+    async function captureBurstFrame(settings) {
+        const blob = await encodeVideoFrame(settings.max_dimension, settings.mime_type, settings.jpeg_quality);
+        await UploadQueue.add(blob, `burst_${Date.now()}.jpg`);
+        burstCaptured++;
+        if (navigator.vibrate) {
+            navigator.vibrate(80);
+        }
+        burstVideo.classList.add('flash');
+        setTimeout(() => burstVideo.classList.remove('flash'), 150);
+    }
+
+    async function burstTick() {
+        if (!burstStream) return;
+        try {
+            const settings = await getCaptureSettings();
+            if (!settings || burstVideo.readyState < 2) return;
+
+            // ภาพยังขยับอยู่ (กำลังวางหรือหยิบกระดาษ): ไม่ต้องถามเซิร์ฟเวอร์
+            const signature = frameSignature();
+            const still = signatureDiff(signature, previousSignature) < STILL_THRESHOLD;
+            previousSignature = signature;
+            if (!still) {
+                stableFrames = 0;
+                burstStatus.textContent = 'รอให้ภาพนิ่ง...';
+                return;
+            }
+
+            const preview = await encodeVideoFrame(settings.preview_max_dimension, 'image/jpeg', 0.8);
+            const check = await postSheetPreview(preview);
+            if (!burstStream || !check) return;
+            if (!check.ok) {
+                stableFrames = 0;
+                sheetRemoved = true;
+                burstStatus.textContent = `วางกระดาษแผ่นถัดไป (${check.issues.join(', ')})`;
+                return;
+            }
+
+            // ถ่ายเฉพาะกระดาษแผ่นใหม่: ต้องหยิบแผ่นเดิมออกก่อน หรือภาพต่างจากที่ถ่ายล่าสุดชัดเจน
+            const isNewSheet = sheetRemoved || signatureDiff(signature, lastCaptureSignature) > NEW_SHEET_THRESHOLD;
+            if (!isNewSheet) {
+                burstStatus.textContent = '✅ ถ่ายแผ่นนี้แล้ว วางแผ่นถัดไป';
+                return;
+            }
+            if (++stableFrames < STABLE_FRAMES) {
+                burstStatus.textContent = 'ถือกล้องนิ่งไว้...';
+                return;
+            }
+
+            await captureBurstFrame(settings);
+            lastCaptureSignature = signature;
+            sheetRemoved = false;
+            stableFrames = 0;
+            burstStatus.textContent = `📸 ถ่ายแล้ว ${burstCaptured} แผ่น`;
+        } catch (error) {
+            console.warn('Burst frame check failed:', error);
+        } finally {
+            if (burstStream) {
+                burstTimer = setTimeout(burstTick, BURST_INTERVAL);
+            }
+        }
+    }
+
+    async function startBurst() {
+        try {
+            burstStream = await navigator.mediaDevices.getUserMedia({
+                video: { facingMode: 'environment', width: { ideal: 1920 }, height: { ideal: 1080 } },
+                audio: false
+            });
+        } catch (error) {
+            console.error('Could not open camera:', error);
+            alert('ไม่สามารถเปิดกล้องได้ กรุณาอนุญาตการใช้กล้อง หรือใช้การเลือกรูปแทน');
+            burstStream = null;
+            return;
+        }
+        burstCaptured = 0;
+        previousSignature = null;
+        lastCaptureSignature = null;
+        sheetRemoved = true;
+        stableFrames = 0;
+        burstVideo.srcObject = burstStream;
+        burstOverlay.style.display = 'flex';
+        burstStatus.textContent = 'วางกระดาษคำตอบให้เห็นครบทั้งแผ่น';
+        burstTimer = setTimeout(burstTick, BURST_INTERVAL);
+    }
+
+    function stopBurst() {
+        clearTimeout(burstTimer);
+        if (burstStream) {
+            burstStream.getTracks().forEach(track => track.stop());
+            burstStream = null;
+        }
+        burstVideo.srcObject = null;
+        burstOverlay.style.display = 'none';
+    }
+
+    function showQueueStatus(status) {
+        let text = '';
+        if (status.pending > 0) {
+            text = `รออัปโหลด ${status.pending} รูป (กำลังส่ง ${status.uploading})`;
+            if (status.lastError && !navigator.onLine) {
+                text += ' · ออฟไลน์ จะส่งต่อเมื่อกลับมาออนไลน์';
+            }
+        } else if (status.uploaded > 0) {
+            text = `✅ อัปโหลดครบแล้ว ${status.uploaded} รูป`;
+        }
+        queueStatus.textContent = text;
+        // ไฟล์ที่เซิร์ฟเวอร์ปฏิเสธหรือถ่ายไว้ใน session อื่น: ไม่ส่งเองอัตโนมัติ
+        queueParked.style.display = status.parked > 0 ? 'block' : 'none';
+        queueParkedText.textContent = status.parked > 0
+            ? `ส่งไม่สำเร็จ ${status.parked} รูป: ${status.parkedError || 'ไม่ทราบสาเหตุ'}`
+            : '';
+        burstCounts.textContent = `ถ่ายแล้ว ${burstCaptured} · รออัปโหลด ${status.pending} · ส่งแล้ว ${status.uploaded}`;
+    }
+
+    // getUserMedia ใช้ได้เฉพาะ HTTPS/localhost ถ้าไม่ได้ยังใช้การเลือกรูปแบบเดิมได้
+    if (navigator.mediaDevices && navigator.mediaDevices.getUserMedia && window.UploadQueue && UploadQueue.isSupported()) {
+        burstBtn.style.display = 'block';
+        burstBtn.addEventListener('click', startBurst);
+        burstStopBtn.addEventListener('click', stopBurst);
+        UploadQueue.onChange(showQueueStatus);
+        document.getElementById('queue-retry-btn').addEventListener('click', () => UploadQueue.retryParked());
+        document.getElementById('queue-discard-btn').addEventListener('click', () => {
+            if (confirm('ทิ้งรูปที่ส่งไม่สำเร็จทั้งหมด?')) {
+                UploadQueue.discardParked();
+            }
+        });
+    }
+
     // Event listeners
     uploadArea.addEventListener('click', () => fileInput.click());
     
@@ -0,0 +1,136 @@
+// อัปโหลดไฟล์ใหญ่แบบแบ่งส่วน (resume ต่อได้เมื่อการเชื่อมต่อหลุด) ใช้ร่วมกันระหว่างหน้าหลักและหน้าถ่ายภาพ
+(function () {
+    const STORAGE_PREFIX = 'chunked-upload:';
+    const DEFAULT_CHUNK_SIZE = 2 * 1024 * 1024;
+    const MAX_RETRIES = 8;
+    // ไฟล์ที่ใหญ่กว่านี้ (และ PDF/TIFF หลายหน้าทุกไฟล์) ให้อัปโหลดแบบแบ่งส่วน
+    const CHUNKED_THRESHOLD = 8 * 1024 * 1024;
+
+    let crcTable = null;
+
+    function crc32(bytes) {
+        if (!crcTable) {
+            crcTable = new Uint32Array(256);
+            for (let n = 0; n < 256; n++) {
+                let c = n;
+                for (let k = 0; k < 8; k++) {
+                    c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+                }
+                crcTable[n] = c >>> 0;
+            }
+        }
+        let crc = 0xFFFFFFFF;
+        for (let i = 0; i < bytes.length; i++) {
+            crc = crcTable[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+        }
+        return (crc ^ 0xFFFFFFFF) >>> 0;
+    }
+
+    async function checksum(buffer) {
+        if (window.crypto && window.crypto.subtle) {
+            const digest = new Uint8Array(await window.crypto.subtle.digest('SHA-256', buffer));
+            return 'sha256 ' + Array.from(digest, b => b.toString(16).padStart(2, '0')).join('');
+        }
+        // crypto.subtle ใช้ได้เฉพาะ HTTPS/localhost มือถือที่เข้าผ่าน IP ในวง LAN จึงใช้ CRC32 แทน
+        return 'crc32 ' + crc32(new Uint8Array(buffer)).toString(16).padStart(8, '0');
+    }
+
+    function storageKey(file) {
+        return STORAGE_PREFIX + [file.name, file.size, file.lastModified].join(':');
+    }
+
+    function fatalError(message) {
+        const error = new Error(message);
+        error.fatal = true;
+        return error;
+    }
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    // เริ่มอัปโหลดใหม่ หรือถามตำแหน่งล่าสุดของไฟล์เดิมที่ค้างอยู่
+    async function startOrResume(file) {
+        const savedId = localStorage.getItem(storageKey(file));
+        if (savedId) {
+            const response = await fetch(`/upload_chunked/${savedId}`);
+            if (response.ok) {
+                return await response.json();
+            }
+            localStorage.removeItem(storageKey(file));
+        }
+
+        const response = await fetch('/upload_chunked', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        const status = await response.json();
+        if (!response.ok) {
+            throw fatalError(status.error || 'ไม่สามารถเริ่มอัปโหลดได้');
+        }
+        localStorage.setItem(storageKey(file), status.upload_id);
+        return status;
+    }
+
+    async function upload(file, onProgress) {
+        let status = await startOrResume(file);
+        const uploadId = status.upload_id;
+        const chunkSize = status.chunk_size || DEFAULT_CHUNK_SIZE;
+        let offset = status.offset;
+        let retries = 0;
+
+        while (!status.complete) {
+            if (onProgress) onProgress(offset, file.size);
+            const buffer = await file.slice(offset, Math.min(offset + chunkSize, file.size)).arrayBuffer();
+            try {
+                const response = await fetch(`/upload_chunked/${uploadId}`, {
+                    method: 'PATCH',
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'Upload-Offset': String(offset),
+                        'Upload-Checksum': await checksum(buffer)
+                    },
+                    body: buffer
+                });
+                const data = await response.json();
+                if (response.ok) {
+                    status = data;
+                    offset = data.offset;
+                    retries = 0;
+                    continue;
+                }
+                if (typeof data.offset !== 'number') {
+                    localStorage.removeItem(storageKey(file));
+                    throw fatalError(data.error || 'อัปโหลดไม่สำเร็จ');
+                }
+                // offset ไม่ตรงหรือ checksum ไม่ตรง: ส่งต่อจากตำแหน่งที่เซิร์ฟเวอร์มี
+                offset = data.offset;
+            } catch (error) {
+                if (error.fatal) throw error;
+                // การเชื่อมต่อหลุด: รอแล้วถามตำแหน่งล่าสุดก่อนส่งต่อ
+                await sleep(Math.min(1000 * 2 ** retries, 15000));
+                try {
+                    const response = await fetch(`/upload_chunked/${uploadId}`);
+                    if (response.ok) {
+                        status = await response.json();
+                        offset = status.offset;
+                    }
+                } catch (e) { /* ยังเชื่อมต่อไม่ได้ ลองใหม่รอบถัดไป */ }
+            }
+            if (++retries > MAX_RETRIES) {
+                throw new Error('การเชื่อมต่อไม่เสถียร อัปโหลดไม่สำเร็จ (ลองอีกครั้งเพื่ออัปโหลดต่อจากเดิม)');
+            }
+        }
+
+        localStorage.removeItem(storageKey(file));
+        if (onProgress) onProgress(file.size, file.size);
+        return status.files;
+    }
+
+    function shouldUseChunked(file) {
+        return file.size > CHUNKED_THRESHOLD || /\.(pdf|tiff?)$/i.test(file.name);
+    }
+
+    window.ChunkedUpload = { upload, shouldUseChunked, CHUNKED_THRESHOLD };
+})();
@@ -15,6 +15,7 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     };
     let isStudentListSelected = false; // Shared state
+    let lastSeq = null; // เลขลำดับการเปลี่ยนแปลงล่าสุดที่ได้รับจากเซิร์ฟเวอร์ (ใช้สำหรับ delta sync)
 
     // --- DOM Elements ---
     const pcUploadInput = document.getElementById('pc-upload-input');
@@ -92,6 +93,8 @@ document.addEventListener('DOMContentLoaded', function () {
         return {
             processBtn: document.getElementById(`process-btn-${mode}`),
             downloadCsvBtn: document.getElementById(`download-csv-btn-${mode}`),
+            downloadImagesBtn: document.getElementById(`download-images-btn-${mode}`),
+            downloadReportBtn: document.getElementById(`download-report-btn-${mode}`),
             answerKeyInput: document.getElementById(`answer-key-input-${mode}`),
             answerKeyLabel: document.getElementById(`answer-key-label-${mode}`),
             createEditBtn: document.getElementById(`create-edit-answer-key-btn-${mode}`),
@@ -291,48 +294,114 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
+    // อัปโหลด ZIP แบบ stream: เซิร์ฟเวอร์แตกไฟล์และ (ถ้ามีเฉลย) ตรวจทันทีระหว่างอัปโหลด
+    async function uploadZipFile(file) {
+        const params = new URLSearchParams();
+        if (state[currentMode].isAnswerKeySelected) {
+            params.set('grade', currentMode);
+        }
+        const response = await fetch(`/upload_zip?${params.toString()}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/zip' },
+            body: file
+        });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.error || 'เกิดข้อผิดพลาดในการอัปโหลด ZIP');
+        }
+        // รูปภาพและผลตรวจถูกส่งมาทาง SSE แล้ว ที่นี่ sync อีกครั้งเผื่อ event หลุด
+        await syncChanges();
+        if (result.skipped && result.skipped.length > 0) {
+            alert(`อัปโหลด ${result.files.length} รูป, ข้าม ${result.skipped.length} ไฟล์ที่ไม่ใช่รูปกระดาษคำตอบ`);
+        }
+    }
+
     async function handleFileUpload(files) {
         if (files.length === 0) return;
 
         const uploadBtn = document.querySelector('label[for="pc-upload-input"]');
         const originalText = uploadBtn.textContent;
 
-        // ตรวจสอบว่ามีไฟล์ PDF หรือไม่
-        const hasPdf = Array.from(files).some(file => file.name.toLowerCase().endsWith('.pdf'));
-
-        if (hasPdf) {
-            uploadBtn.textContent = 'กำลังแปลง PDF...';
-        } else {
-            uploadBtn.textContent = 'กำลังอัปโหลด...';
+        const zipFiles = Array.from(files).filter(file => file.name.toLowerCase().endsWith('.zip'));
+        files = Array.from(files).filter(file => !file.name.toLowerCase().endsWith('.zip'));
+        if (zipFiles.length > 0) {
+            uploadBtn.textContent = 'กำลังอัปโหลด ZIP...';
+            uploadBtn.style.pointerEvents = 'none';
+            try {
+                for (const zipFile of zipFiles) {
+                    await uploadZipFile(zipFile);
+                }
+            } catch (error) {
+                console.error('Error uploading zip:', error);
+                alert(error.message || 'เกิดข้อผิดพลาดในการอัปโหลด ZIP');
+            } finally {
+                uploadBtn.textContent = originalText;
+                uploadBtn.style.pointerEvents = 'auto';
+            }
+            if (files.length === 0) return;
         }
 
+        // PDF และไฟล์ใหญ่อัปโหลดแบบแบ่งส่วน (resume ได้) ไฟล์เล็กส่งรวมกันเป็นชุด
+        const chunkedFiles = files.filter(file => ChunkedUpload.shouldUseChunked(file));
+        const smallFiles = files.filter(file => !ChunkedUpload.shouldUseChunked(file));
+        const pdfFiles = chunkedFiles.filter(file => file.name.toLowerCase().endsWith('.pdf'));
+
+        uploadBtn.textContent = 'กำลังอัปโหลด...';
         uploadBtn.style.pointerEvents = 'none';
 
-        const formData = new FormData();
-        for (const file of files) {
-            formData.append('files', file);
-        }
         try {
-            const response = await fetch('/upload_image', {
-                method: 'POST',
-                body: formData
-            });
-            if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || 'เกิดข้อผิดพลาดในการอัปโหลด');
+            let pdfPages = 0;
+            for (const file of chunkedFiles) {
+                const isPdf = file.name.toLowerCase().endsWith('.pdf');
+                const uploadedFiles = await ChunkedUpload.upload(file, (sent, total) => {
+                    const percent = Math.floor((sent / total) * 100);
+                    uploadBtn.textContent = sent < total
+                        ? `กำลังอัปโหลด ${file.name} (${percent}%)`
+                        : (isPdf ? 'กำลังแปลง PDF...' : 'กำลังบันทึก...');
+                });
+                uploadedFiles.forEach(addImageThumbnail);
+                if (isPdf) pdfPages += uploadedFiles.length;
+            }
+
+            // แบ่งไฟล์เล็กเป็นชุดเพื่อไม่ให้ request เกินขนาดสูงสุดของเซิร์ฟเวอร์
+            const batches = [];
+            let batch = [];
+            let batchSize = 0;
+            for (const file of smallFiles) {
+                if (batch.length > 0 && batchSize + file.size > ChunkedUpload.CHUNKED_THRESHOLD * 4) {
+                    batches.push(batch);
+                    batch = [];
+                    batchSize = 0;
+                }
+                batch.push(file);
+                batchSize += file.size;
             }
-            const result = await response.json();
-            // แสดงรูปทันทีหลังอัปโหลด (ไม่ต้องรอ event)
-            if (result.files && Array.isArray(result.files)) {
-                result.files.forEach(addImageThumbnail);
+            if (batch.length > 0) batches.push(batch);
+
+            for (const batchFiles of batches) {
+                uploadBtn.textContent = 'กำลังอัปโหลด...';
+                const formData = new FormData();
+                for (const file of batchFiles) {
+                    formData.append('files', file);
+                }
+                const response = await fetch('/upload_image', {
+                    method: 'POST',
+                    body: formData
+                });
+                if (!response.ok) {
+                    const errorData = await response.json();
+                    throw new Error(errorData.error || 'เกิดข้อผิดพลาดในการอัปโหลด');
+                }
+                const result = await response.json();
+                // แสดงรูปทันทีหลังอัปโหลด (ไม่ต้องรอ event)
+                if (result.files && Array.isArray(result.files)) {
+                    result.files.forEach(addImageThumbnail);
+                }
             }
+
             // แสดงข้อความสำเร็จถ้ามีการแปลง PDF
-            if (hasPdf && result.files) {
-                const pdfFiles = Array.from(files).filter(file => file.name.toLowerCase().endsWith('.pdf'));
-                const totalPages = result.files.length;
-                if (pdfFiles.length > 0) {
-                    alert(`แปลงไฟล์ PDF เสร็จแล้ว! ได้รูปภาพทั้งหมด ${totalPages} หน้า`);
-                }
+            if (pdfFiles.length > 0) {
+                alert(`แปลงไฟล์ PDF เสร็จแล้ว! ได้รูปภาพทั้งหมด ${pdfPages} หน้า`);
             }
         } catch (error) {
             console.error('Error uploading files:', error);
@@ -371,6 +440,8 @@ document.addEventListener('DOMContentLoaded', function () {
         elements.resultsTbody.innerHTML = '';
         const unmatchedTbody = document.getElementById(`unmatched-tbody-${mode}`);
         if (unmatchedTbody) unmatchedTbody.innerHTML = '';
+        const conflictsTbody = document.getElementById(`conflicts-tbody-${mode}`);
+        if (conflictsTbody) conflictsTbody.innerHTML = '';
 
         if (!results || results.length === 0) {
             console.log('No results, showing placeholder');
@@ -385,11 +456,18 @@ document.addEventListener('DOMContentLoaded', function () {
             return;
         }
 
-        // แยกผลลัพธ์เป็น 2 กลุ่ม
+        // แยกผลลัพธ์เป็น 3 กลุ่ม: รหัสซ้ำ, จับคู่ไม่ได้ และจับคู่ได้
+        const conflictResults = [];
         const unmatchedResults = [];
         const matchedResults = [];
 
         results.forEach((item, index) => {
+            // รหัสซ้ำแสดงในตาราง conflicts (ทั้งโหมด single และ multi)
+            if (item.is_duplicate === true) {
+                conflictResults.push(item);
+                return;
+            }
+
             const studentName = item.student_name || '';
             const studentId = item.student_id || '';
 
@@ -416,8 +494,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 String(studentId).trim() === ''
             );
 
-            // ตรวจสอบว่ามีปัญหาการกาหลายคำตอบหรือไม่ (เฉพาะโหมด single)
-            const hasIssues = mode === 'single' && item.has_issues === true;
+            // ตรวจสอบว่ามีปัญหาหรือไม่ (เซิร์ฟเวอร์กำหนด has_issues ตามโหมดแล้ว)
+            const hasIssues = item.has_issues === true;
 
             console.log(`Item ${index + 1} classification:`, {
                 isNameNotFound,
@@ -451,6 +529,14 @@ document.addEventListener('DOMContentLoaded', function () {
             matched: sortedMatchedResults.length
         });
 
+        // จัดกลุ่มรหัสซ้ำให้อยู่ติดกันตามรหัส
+        if (conflictResults.length > 0) {
+            conflictResults.sort((a, b) => String(a.student_id).localeCompare(String(b.student_id), 'th', { numeric: true }));
+            populateTable(conflictsTbody, conflictResults, mode, false);
+        }
+        const conflictsSection = document.getElementById(`conflicts-section-${mode}`);
+        if (conflictsSection) conflictsSection.style.display = conflictResults.length > 0 ? 'block' : 'none';
+
         // เติมข้อมูลในตารางก่อน
         if (unmatchedResults.length > 0) {
             console.log('Populating unmatched table with', unmatchedResults.length, 'items:', unmatchedResults);
@@ -480,7 +566,7 @@ document.addEventListener('DOMContentLoaded', function () {
         });
 
         // เพิ่มสถิติ
-        addStatsElement(mode, validResults, unmatchedResults.length, sortedMatchedResults.length);
+        addStatsElement(mode, validResults, unmatchedResults.length, sortedMatchedResults.length, conflictResults.length);
 
         updateButtonStates();
 
@@ -531,9 +617,11 @@ document.addEventListener('DOMContentLoaded', function () {
     function hideAllTables(mode) {
         const unmatchedSection = document.getElementById(`unmatched-section-${mode}`);
         const matchedSection = document.getElementById(`matched-section-${mode}`);
+        const conflictsSection = document.getElementById(`conflicts-section-${mode}`);
 
         if (unmatchedSection) unmatchedSection.style.display = 'none';
         if (matchedSection) matchedSection.style.display = 'none';
+        if (conflictsSection) conflictsSection.style.display = 'none';
     }
 
     function showRelevantTables(mode, hasUnmatched, hasMatched) {
@@ -569,7 +657,7 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
-    function addStatsElement(mode, validResults, unmatchedCount, matchedCount) {
+    function addStatsElement(mode, validResults, unmatchedCount, matchedCount, conflictCount = 0) {
         let statsElement = document.getElementById(`results-stats-${mode}`);
         if (!statsElement) {
             statsElement = document.createElement('div');
@@ -588,6 +676,9 @@ document.addEventListener('DOMContentLoaded', function () {
 
         if (validResults > 0) {
             let statsText = `ประมวลผลเสร็จแล้ว ${validResults} คน`;
+            if (conflictCount > 0) {
+                statsText += ` | รหัสซ้ำ: ${conflictCount} แผ่น`;
+            }
             if (unmatchedCount > 0) {
                 statsText += ` | ไม่จับคู่ได้: ${unmatchedCount} คน`;
             }
@@ -662,6 +753,12 @@ document.addEventListener('DOMContentLoaded', function () {
             if (!isSorted && (item.student_name === 'ไม่พบชื่อ' || !item.student_name)) {
                 nameCell.style.color = '#ef4444';
             }
+            // แผ่นที่ต้องตรวจสอบเอง (ตรวจไม่สำเร็จ/เกินเวลา/อ่านตารางไม่ได้) แสดงสาเหตุ
+            if (item.needs_attention) {
+                nameCell.textContent += ' ⚠️ ต้องตรวจสอบ';
+                nameCell.title = item.attention_reason || '';
+                nameCell.style.color = '#ef4444';
+            }
 
             // Cell 3: รหัสนักศึกษา
             const idCell = row.insertCell(2);
@@ -693,6 +790,13 @@ document.addEventListener('DOMContentLoaded', function () {
                 scoreCell.style.color = '#ef4444';
                 scoreCell.style.fontWeight = 'bold';
             }
+            // คอลัมน์ที่หาเส้นตารางไม่ได้ถูกนับเป็นข้อผิด ต้องตรวจด้วยตนเอง
+            if (item.unreadable_count > 0) {
+                scoreText += ` ⚠️`;
+                scoreCell.title = `${scoreCell.title ? scoreCell.title + '\n' : ''}อ่านตารางคำตอบไม่ได้ ${item.unreadable_count} ข้อ`;
+                scoreCell.style.color = '#ef4444';
+                scoreCell.style.fontWeight = 'bold';
+            }
 
             scoreCell.textContent = scoreText;
             scoreCell.style.textAlign = 'left';
@@ -997,6 +1101,8 @@ document.addEventListener('DOMContentLoaded', function () {
             state[mode].answerKeyFileContent = null; // Clear cached file content
             populateResultsTable(null, mode);
             elements.downloadCsvBtn.style.display = 'none';
+            elements.downloadImagesBtn.style.display = 'none';
+            elements.downloadReportBtn.style.display = 'none';
             elements.clearResultsBtn.style.display = 'none';
             elements.answerKeyInput.value = '';
             elements.answerKeyLabel.textContent = `ไฟล์เฉลย${mode === 'single' ? ' 1 คำตอบ' : 'หลายคำตอบ'} (.csv)`;
@@ -1020,11 +1126,14 @@ document.addEventListener('DOMContentLoaded', function () {
             try {
                 const response = await fetch(`/get_results_${mode}`);
                 const data = await response.json();
+                noteBaselineSeq(data.seq);
                 if (data.results && data.results.length > 0) {
                     const elements = getModeElements(mode);
                     state[mode].resultsDataCache = data.results;
                     populateResultsTable(data.results, mode);
                     elements.downloadCsvBtn.style.display = 'block';
+                    elements.downloadImagesBtn.style.display = 'block';
+                    elements.downloadReportBtn.style.display = 'block';
                 }
             } catch (error) {
                 console.error(`Could not load saved results for ${mode}:`, error);
@@ -1075,6 +1184,7 @@ document.addEventListener('DOMContentLoaded', function () {
         try {
             const response = await fetch('/get_images');
             const data = await response.json();
+            noteBaselineSeq(data.seq);
             if (data.files) {
                 data.files.forEach(addImageThumbnail);
             }
@@ -1083,6 +1193,73 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
+    // --- Delta Sync ---
+    // ใช้เลขลำดับที่น้อยที่สุดของการโหลดครั้งแรก เพื่อไม่ให้พลาดการเปลี่ยนแปลงระหว่างโหลด
+    function noteBaselineSeq(seq) {
+        if (seq === null || seq === undefined) return;
+        lastSeq = lastSeq === null ? seq : Math.min(lastSeq, seq);
+    }
+
+    // รวมแถวผลลัพธ์ที่เปลี่ยนเข้ากับ cache (อ้างอิงด้วย student_file)
+    function applyResultRows(mode, rows, replaced = false) {
+        if (replaced) {
+            state[mode].resultsDataCache = rows && rows.length > 0 ? rows : null;
+        } else {
+            if (!rows || rows.length === 0) return;
+            const cache = state[mode].resultsDataCache || [];
+            rows.forEach(row => {
+                const index = cache.findIndex(r => r.student_file === row.student_file);
+                if (index !== -1) {
+                    cache[index] = row;
+                } else {
+                    cache.push(row);
+                }
+            });
+            state[mode].resultsDataCache = cache;
+        }
+        const elements = getModeElements(mode);
+        populateResultsTable(state[mode].resultsDataCache, mode);
+        elements.downloadCsvBtn.style.display = state[mode].resultsDataCache ? 'block' : 'none';
+        elements.downloadImagesBtn.style.display = elements.downloadCsvBtn.style.display;
+        elements.downloadReportBtn.style.display = elements.downloadCsvBtn.style.display;
+    }
+
+    // โหลดข้อมูลใหม่ทั้งหมด (ใช้เมื่อเซิร์ฟเวอร์ไม่สามารถส่ง delta ได้)
+    function refreshAll() {
+        imagePreviewGrid.innerHTML = '';
+        uploadedImageCount = 0;
+        lastSeq = null;
+        loadInitialImages();
+        loadSavedResults();
+    }
+
+    // ดึงเฉพาะการเปลี่ยนแปลงหลัง lastSeq
+    async function syncChanges() {
+        if (lastSeq === null) {
+            refreshAll();
+            return;
+        }
+        try {
+            const response = await fetch(`/get_changes?since=${lastSeq}`);
+            const data = await response.json();
+            if (data.reset) {
+                refreshAll();
+                return;
+            }
+            data.images.added.forEach(addImageThumbnail);
+            removeImageThumbnails(data.images.deleted);
+            Object.entries(data.images.cleaned).forEach(([name, timestamp]) => {
+                updateImageThumbnails({ filenames: [name], timestamp });
+            });
+            Object.entries(data.results).forEach(([mode, changes]) => {
+                applyResultRows(mode, changes.rows, changes.replaced);
+            });
+            lastSeq = Math.max(lastSeq, data.seq);
+        } catch (error) {
+            console.error("Could not sync changes:", error);
+        }
+    }
+
     function connectToServerEvents() {
         const eventSource = new EventSource("/stream");
         eventSource.onmessage = function (event) {
@@ -1092,6 +1269,11 @@ document.addEventListener('DOMContentLoaded', function () {
             if (msg.session_id && mySessionId && msg.session_id !== mySessionId) {
                 return; // ignore events not for this session
             }
+            if (msg.seq !== undefined && msg.event !== 'resync') {
+                // ข้าม event ที่ได้รับแล้ว (อาจซ้ำจากการ replay หลังเชื่อมต่อใหม่)
+                if (lastSeq !== null && msg.seq <= lastSeq) return;
+                lastSeq = msg.seq;
+            }
             if (msg.event === 'new_image') {
                 addImageThumbnail(msg.data);
             } else if (msg.event === 'delete_images') {
@@ -1100,6 +1282,18 @@ document.addEventListener('DOMContentLoaded', function () {
                 clearUI();
             } else if (msg.event === 'images_cleaned') {
                 updateImageThumbnails(msg.data);
+            } else if (msg.event === 'result_updated') {
+                applyResultRows(msg.mode, msg.data);
+            } else if (msg.event === 'results_replaced' || msg.event === 'results_cleared') {
+                lastSeq = msg.seq - 1;
+                syncChanges();
+            } else if (msg.event === 'resync') {
+                refreshAll();
+            } else if (msg.event === 'zip_progress') {
+                const uploadBtn = document.querySelector('label[for="pc-upload-input"]');
+                if (uploadBtn && msg.status !== 'done') {
+                    uploadBtn.textContent = `กำลังแตกไฟล์ ZIP... (${msg.processed} รูป)`;
+                }
             }
         };
         eventSource.onerror = function (err) {
@@ -1126,6 +1320,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
         // Store original student ID and mode for reference
         window.originalStudentId = studentData.student_id;
+        window.currentStudentFile = studentData.student_file;
         window.currentMode = mode;
 
         // Set student info - make student ID editable
@@ -1141,6 +1336,8 @@ document.addEventListener('DOMContentLoaded', function () {
 
         // Create dropdown for student selection
         scoreEditStudentId.innerHTML = `
+            <input type="search" id="edit-student-search" placeholder="ค้นหารหัส..." inputmode="numeric"
+                style="border: 1px solid #ccc; padding: 4px; border-radius: 4px; width: 120px; font-size: 14px; margin-right: 6px;">
             <select id="edit-student-id" style="border: 1px solid #ccc; padding: 4px; border-radius: 4px; width: 200px; font-size: 14px;">
                 <option value="">กำลังโหลดรายชื่อ...</option>
             </select>
@@ -1150,6 +1347,19 @@ document.addEventListener('DOMContentLoaded', function () {
         console.log('About to load dropdown with studentId:', studentData.student_id, 'mode:', window.currentMode);
         await loadAvailableStudentsDropdown(studentData.student_id);
 
+        // ค้นหารหัสด้วย prefix จากเซิร์ฟเวอร์ แล้วแสดงเฉพาะรายชื่อที่ตรงใน dropdown
+        const studentSearchInput = document.getElementById('edit-student-search');
+        if (studentSearchInput) {
+            studentSearchInput.addEventListener('input', debounce(async (e) => {
+                const prefix = e.target.value.trim();
+                if (!prefix) {
+                    await loadAvailableStudentsDropdown(studentData.student_id);
+                } else {
+                    await searchStudentsForDropdown(prefix, studentData.student_id);
+                }
+            }, 200));
+        }
+
         // Add change event listener for dropdown
         const studentIdSelect = document.getElementById('edit-student-id');
         if (studentIdSelect) {
@@ -1624,6 +1834,51 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
+    // ค้นหานักศึกษาที่ยังไม่ได้ใช้งานด้วย prefix ของรหัส และแทนที่ตัวเลือกใน dropdown
+    async function searchStudentsForDropdown(prefix, currentStudentId) {
+        const studentIdSelect = document.getElementById('edit-student-id');
+        if (!studentIdSelect) return;
+
+        const actualCurrentId = currentStudentId || window.originalStudentId || '';
+        const params = new URLSearchParams({
+            q: prefix,
+            mode: window.currentMode,
+            current_student_id: actualCurrentId,
+            limit: 50
+        });
+
+        try {
+            const response = await fetch(`/search_students?${params}`);
+            const result = await response.json();
+            if (!result.success) {
+                console.error('Error searching students:', result.error);
+                return;
+            }
+
+            studentIdSelect.innerHTML = '';
+            const defaultOption = document.createElement('option');
+            defaultOption.value = '';
+            defaultOption.textContent = result.students.length > 0 ? 'เลือกนักศึกษา...' : 'ไม่พบรหัสที่ตรงกัน';
+            studentIdSelect.appendChild(defaultOption);
+
+            result.students.forEach(student => {
+                const option = document.createElement('option');
+                option.value = student.student_id;
+                option.textContent = student.display_text;
+                option.dataset.studentName = student.name;
+                studentIdSelect.appendChild(option);
+            });
+
+            // เลือกอัตโนมัติเมื่อพบเพียงรายการเดียว
+            if (result.students.length === 1) {
+                studentIdSelect.value = result.students[0].student_id;
+                studentIdSelect.dispatchEvent(new Event('change'));
+            }
+        } catch (error) {
+            console.error('Error searching students:', error);
+        }
+    }
+
     // Function to update student name from ID (kept for backward compatibility)
     async function updateStudentNameFromId(studentId) {
         if (!studentId) return;
@@ -1702,7 +1957,8 @@ document.addEventListener('DOMContentLoaded', function () {
                     student_name: scoreEditStudentName.textContent,
                     mode: window.currentMode,
                     answers: window.currentStudentAnswers,
-                    original_student_id: window.originalStudentId || studentId
+                    original_student_id: window.originalStudentId || studentId,
+                    student_file: window.currentStudentFile
                 })
             });
 
@@ -1714,51 +1970,11 @@ document.addEventListener('DOMContentLoaded', function () {
                 scoreEditModal.style.display = 'none';
                 document.body.style.overflow = ''; // ปลดล็อค scroll ของ body
 
-                // Refresh the results table
-                if (state[window.currentMode].resultsDataCache) {
-                    const studentIndex = state[window.currentMode].resultsDataCache.findIndex(
-                        s => s.student_id === result.original_student_id || s.student_id === studentId
-                    );
-                    console.log('Found student at index:', studentIndex);
-
-                    if (studentIndex !== -1) {
-                        // คำนวณจำนวนข้อที่มีการกาหลายคำตอบใหม่
-                        let multipleAnswersCount = 0;
-                        if (window.currentMode === 'single') {
-                            Object.values(window.currentStudentAnswers).forEach(answerData => {
-                                const hasMultiple = answerData.has_multiple_answers || 
-                                                  (answerData.answers && answerData.answers.length > 1);
-                                if (hasMultiple) {
-                                    multipleAnswersCount++;
-                                }
-                            });
-                        }
-                        
-                        state[window.currentMode].resultsDataCache[studentIndex].student_id = studentId;
-                        state[window.currentMode].resultsDataCache[studentIndex].student_name = scoreEditStudentName.textContent;
-                        state[window.currentMode].resultsDataCache[studentIndex].score = result.new_score;
-                        state[window.currentMode].resultsDataCache[studentIndex].total = result.total;
-                        state[window.currentMode].resultsDataCache[studentIndex].multiple_answers_count = multipleAnswersCount;
-                        
-                        // โหลดข้อมูลใหม่จากเซิร์ฟเวอร์เพื่ออัปเดต is_duplicate และ has_issues
-                        const refreshResponse = await fetch(`/get_results_${window.currentMode}`);
-                        const refreshData = await refreshResponse.json();
-                        if (refreshData.results) {
-                            state[window.currentMode].resultsDataCache = refreshData.results;
-                        }
-                        
-                        console.log('Updated student data:', state[window.currentMode].resultsDataCache[studentIndex]);
-                        populateResultsTable(state[window.currentMode].resultsDataCache, window.currentMode);
-                    } else {
-                        console.error('Student not found in cache, reloading results...');
-                        // โหลดผลลัพธ์ใหม่จากเซิร์ฟเวอร์
-                        const response = await fetch(`/get_results_${window.currentMode}`);
-                        const data = await response.json();
-                        if (data.results) {
-                            state[window.currentMode].resultsDataCache = data.results;
-                            populateResultsTable(data.results, window.currentMode);
-                        }
-                    }
+                // อัปเดตเฉพาะแถวที่เปลี่ยน (รวมแถวที่สถานะรหัสซ้ำเปลี่ยน) แทนการโหลดผลลัพธ์ใหม่ทั้งหมด
+                if (result.rows && result.rows.length > 0) {
+                    applyResultRows(window.currentMode, result.rows);
+                } else {
+                    await syncChanges();
                 }
             } else {
                 alert('เกิดข้อผิดพลาด: ' + result.error);
@@ -1787,6 +2003,64 @@ document.addEventListener('DOMContentLoaded', function () {
         pcUploadInput.value = '';
     });
 
+    // --- Hot folder: นำเข้าไฟล์จากโฟลเดอร์ของเครื่องสแกนอัตโนมัติ ---
+    const hotFolderPath = document.getElementById('hot-folder-path');
+    const hotFolderStartBtn = document.getElementById('hot-folder-start-btn');
+    const hotFolderStopBtn = document.getElementById('hot-folder-stop-btn');
+    const hotFolderStatus = document.getElementById('hot-folder-status');
+    let hotFolderTimer = null;
+
+    function renderHotFolderStatus(status) {
+        hotFolderStartBtn.disabled = status.running;
+        hotFolderStopBtn.disabled = !status.running;
+        if (status.running) {
+            hotFolderPath.value = status.path;
+            hotFolderStatus.textContent = `กำลังเฝ้า (${status.backend || 'เริ่มต้น'}) นำเข้าแล้ว ${status.ingested} ไฟล์` +
+                (status.failed ? `, ผิดพลาด ${status.failed}` : '') +
+                (status.pending || status.queued ? `, รอ ${status.pending + status.queued}` : '');
+        } else {
+            hotFolderStatus.textContent = status.last_error ? `หยุดแล้ว: ${status.last_error}` : '';
+        }
+        clearTimeout(hotFolderTimer);
+        if (status.running) {
+            hotFolderTimer = setTimeout(refreshHotFolderStatus, 5000);
+        }
+    }
+
+    async function refreshHotFolderStatus() {
+        try {
+            const response = await fetch('/hot_folder/status');
+            renderHotFolderStatus(await response.json());
+        } catch (error) {
+            console.error('Error fetching hot folder status:', error);
+        }
+    }
+
+    if (hotFolderStartBtn) {
+        hotFolderStartBtn.addEventListener('click', async () => {
+            const body = { path: hotFolderPath.value.trim() };
+            if (state[currentMode].isAnswerKeySelected) {
+                body.grade = currentMode;  // ตรวจทันทีด้วยเฉลยของโหมดปัจจุบัน
+            }
+            const response = await fetch('/hot_folder/start', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body)
+            });
+            const result = await response.json();
+            if (!response.ok) {
+                alert(result.error || 'ไม่สามารถเฝ้าโฟลเดอร์ได้');
+                return;
+            }
+            renderHotFolderStatus(result);
+        });
+        hotFolderStopBtn.addEventListener('click', async () => {
+            await fetch('/hot_folder/stop', { method: 'POST' });
+            refreshHotFolderStatus();
+        });
+        refreshHotFolderStatus();
+    }
+
     // --- Drag and Drop Support ---
     const imagePreviewContainer = document.getElementById('image-preview-container');
 
@@ -1825,13 +2099,13 @@ document.addEventListener('DOMContentLoaded', function () {
         // กรองเฉพาะไฟล์ที่รองรับ
         const validFiles = Array.from(files).filter(file => {
             const extension = file.name.toLowerCase().split('.').pop();
-            return ['jpg', 'jpeg', 'png', 'pdf'].includes(extension);
+            return ['jpg', 'jpeg', 'png', 'pdf', 'tif', 'tiff', 'zip'].includes(extension);
         });
 
         if (validFiles.length > 0) {
             handleFileUpload(validFiles);
         } else {
-            alert('กรุณาอัปโหลดไฟล์รูปภาพ (JPG, PNG) หรือ PDF เท่านั้น');
+            alert('กรุณาอัปโหลดไฟล์รูปภาพ (JPG, PNG, TIFF), PDF หรือ ZIP เท่านั้น');
         }
     }
 
@@ -1895,6 +2169,8 @@ document.addEventListener('DOMContentLoaded', function () {
             elements.resultsTbody.innerHTML = '';
             elements.processBtn.disabled = true;
             elements.downloadCsvBtn.style.display = 'none';
+            elements.downloadImagesBtn.style.display = 'none';
+            elements.downloadReportBtn.style.display = 'none';
 
             try {
                 const response = await fetch(`/process_${mode}`, { method: 'POST' });
@@ -1905,6 +2181,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 state[mode].resultsDataCache = data.results;
                 populateResultsTable(data.results, mode);
                 elements.downloadCsvBtn.style.display = 'block';
+                elements.downloadImagesBtn.style.display = 'block';
+                elements.downloadReportBtn.style.display = 'block';
             } catch (error) {
                 console.error('Processing error:', error);
                 alert(`เกิดข้อผิดพลาดในการประมวลผล: ${error.message}`);
@@ -1916,39 +2194,49 @@ document.addEventListener('DOMContentLoaded', function () {
         });
 
         // Event for Download CSV
-        elements.downloadCsvBtn.addEventListener('click', async () => {
+        elements.downloadCsvBtn.addEventListener('click', () => {
             if (!state[mode].resultsDataCache) return;
             const filenameInput = document.getElementById(`output-filename-${mode}`);
             const filename = filenameInput ? filenameInput.value.trim() || 'omr_results' : 'omr_results';
 
-            try {
-                // ดึงข้อมูลล่าสุดจากเซิร์ฟเวอร์แทนการใช้ cache
-                const resultsResponse = await fetch(`/get_results_${mode}`);
-                const resultsData = await resultsResponse.json();
-                const latestResults = resultsData.results || state[mode].resultsDataCache;
+            const formatSelect = document.getElementById(`export-format-${mode}`);
+            const exportFormat = formatSelect ? formatSelect.value : 'csv';
+            const answersCheckbox = document.getElementById(`export-answers-${mode}`);
 
-                const response = await fetch(`/download_results_${mode}`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ results: latestResults, filename: filename })
-                });
-                if (!response.ok) throw new Error('Download failed');
-                const blob = await response.blob();
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.style.display = 'none';
-                a.href = url;
-                a.download = `${filename}_${mode}.csv`;
-                document.body.appendChild(a);
-                a.click();
-                window.URL.revokeObjectURL(url);
-                document.body.removeChild(a);
-            } catch (error) {
-                console.error('Download error:', error);
-                alert('เกิดข้อผิดพลาดในการดาวน์โหลด');
-            }
+            // เซิร์ฟเวอร์อ่านผลลัพธ์ล่าสุดจาก session เองและส่งไฟล์แบบ stream ให้ browser ดาวน์โหลดโดยตรง
+            const params = new URLSearchParams({
+                format: exportFormat,
+                filename: `${filename}_${mode}`,
+            });
+            if (answersCheckbox && answersCheckbox.checked) {
+                params.set('answers', '1');
+            }
+            const a = document.createElement('a');
+            a.style.display = 'none';
+            a.href = `/download_results_${mode}?${params.toString()}`;
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
         });
 
+        // Event for Download Images (ZIP) / PDF report (ใช้ตัวกรองเดียวกัน)
+        const downloadSheets = (endpoint, filename) => {
+            if (!state[mode].resultsDataCache) return;
+            const filterSelect = document.getElementById(`image-zip-filter-${mode}`);
+            const params = new URLSearchParams({
+                filter: filterSelect ? filterSelect.value : 'all',
+                filename: filename,
+            });
+            const a = document.createElement('a');
+            a.style.display = 'none';
+            a.href = `/${endpoint}_${mode}?${params.toString()}`;
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+        };
+        elements.downloadImagesBtn.addEventListener('click', () => downloadSheets('download_images', `omr_images_${mode}`));
+        elements.downloadReportBtn.addEventListener('click', () => downloadSheets('download_report', `omr_report_${mode}`));
+
         // Event for Clear Results
         elements.clearResultsBtn.addEventListener('click', async () => {
             if (confirm('คุณต้องการลบผลลัพธ์ทั้งหมดหรือไม่?')) {
@@ -1957,6 +2245,8 @@ document.addEventListener('DOMContentLoaded', function () {
                     state[mode].resultsDataCache = null;
                     populateResultsTable(null, mode);
                     elements.downloadCsvBtn.style.display = 'none';
+                    elements.downloadImagesBtn.style.display = 'none';
+                    elements.downloadReportBtn.style.display = 'none';
                     elements.clearResultsBtn.style.display = 'none';
                 } catch (error) {
                     console.error('Clear results error:', error);
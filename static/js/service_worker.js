@@ -0,0 +1,124 @@
+// service worker: เสิร์ฟผ่าน /sw.js ซึ่งใส่ CACHE_VERSION และ PRECACHE_URLS ไว้ด้านบนไฟล์
+// - static ที่มี ?v= (fingerprint): cache-first ไม่ต้องถามเซิร์ฟเวอร์อีกจนกว่าไฟล์จะเปลี่ยน
+// - รูปย่อ web_ ใน /uploads/: cache-first (ชื่อ uuid เขียนครั้งเดียว) เก็บไม่เกิน MAX_THUMBNAILS รูป
+// - หน้าเว็บและ API ผลตรวจ: network-first ใช้ข้อมูลล่าสุดใน cache เฉพาะเมื่อเชื่อมต่อไม่ได้ (ไม่ใช่เมื่อช้า)
+//   cache แยกตาม session (header X-Session-Tag) และเก็บเฉพาะของ session ล่าสุดที่เซิร์ฟเวอร์ตอบ
+const STATIC_CACHE = `omr-static-${CACHE_VERSION}`;
+const THUMBNAIL_CACHE = 'omr-thumbnails';
+const RUNTIME_CACHE_PREFIX = 'omr-runtime-';
+const MAX_THUMBNAILS = 500;
+
+// GET API ที่อ่านข้อมูลอย่างเดียว แสดงข้อมูลล่าสุดได้เมื่อออฟไลน์
+const NETWORK_FIRST_PATHS = [
+    '/get_results_single', '/get_results_multi', '/get_images', '/get_session_info',
+    '/get_student_list', '/get_answer_key_single', '/get_answer_key_multi',
+    '/view_answer_key_single', '/view_answer_key_multi', '/view_student_list',
+    '/get_conflicts', '/capture_settings', '/check_pdf_support'
+];
+const PAGE_PATHS = ['/', '/capture', '/manual'];
+// คำขอที่ล้างข้อมูลของ session: ลบ cache ของหน้าและ API ด้วย (ไม่ให้แสดงผลของ session เก่า)
+const SESSION_RESET_PATHS = ['/new_session', '/clear_session'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(STATIC_CACHE)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names
+                    // omr-runtime คือ cache ของ API รุ่นก่อนที่ไม่แยกตาม session
+                    .filter(name => (name.startsWith('omr-static-') && name !== STATIC_CACHE) || name === 'omr-runtime')
+                    .map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function cacheFirst(request, cacheName, maxEntries) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) {
+        await cache.put(request, response.clone());
+        if (maxEntries) trimCache(cache, maxEntries);
+    }
+    return response;
+}
+
+// ลบรายการเก่าสุดก่อน (cache.keys() เรียงตามลำดับที่เพิ่ม)
+async function trimCache(cache, maxEntries) {
+    const keys = await cache.keys();
+    for (const key of keys.slice(0, Math.max(0, keys.length - maxEntries))) {
+        await cache.delete(key);
+    }
+}
+
+async function runtimeCacheNames() {
+    return (await caches.keys()).filter(name => name.startsWith(RUNTIME_CACHE_PREFIX));
+}
+
+// cache ของ session ที่ตอบ response นี้ (session เปลี่ยน เช่น หมดอายุแล้วเริ่มใหม่: ลบ cache ของ session เก่า)
+async function runtimeCacheFor(response) {
+    const name = RUNTIME_CACHE_PREFIX + (response.headers.get('X-Session-Tag') || 'none');
+    const stale = (await runtimeCacheNames()).filter(other => other !== name);
+    await Promise.all(stale.map(other => caches.delete(other)));
+    return caches.open(name);
+}
+
+// ข้อมูลใน cache ใช้เฉพาะเมื่อเชื่อมต่อไม่ได้ เครือข่ายช้า (เช่น รอการตรวจที่ล็อกข้อมูลอยู่) ต้องรอผลจริง
+// ไม่เช่นนั้นผู้ใช้จะเห็นคะแนนเก่าเหมือนเป็นข้อมูลปัจจุบัน
+async function networkFirst(request) {
+    let response;
+    try {
+        response = await fetch(request);
+    } catch (error) {
+        for (const name of await runtimeCacheNames()) {
+            const cached = await (await caches.open(name)).match(request);
+            if (cached) return cached;
+        }
+        throw error;
+    }
+    if (response.ok && !response.redirected) {
+        const cache = await runtimeCacheFor(response);
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function resetSessionCaches(request) {
+    const response = await fetch(request);
+    if (response.ok) {
+        const names = await runtimeCacheNames();
+        await Promise.all(names.map(name => caches.delete(name)));
+        await caches.delete(THUMBNAIL_CACHE);
+    }
+    return response;
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (request.method === 'POST' && SESSION_RESET_PATHS.includes(url.pathname)) {
+        event.respondWith(resetSessionCaches(request));
+        return;
+    }
+    if (request.method !== 'GET') return;
+
+    if (url.pathname.startsWith('/static/') && url.searchParams.has('v')) {
+        event.respondWith(cacheFirst(request, STATIC_CACHE));
+    } else if (url.pathname.startsWith('/uploads/') && url.pathname.split('/').pop().startsWith('web_')) {
+        event.respondWith(cacheFirst(request, THUMBNAIL_CACHE, MAX_THUMBNAILS));
+    } else if (PAGE_PATHS.includes(url.pathname) || NETWORK_FIRST_PATHS.includes(url.pathname)) {
+        event.respondWith(networkFirst(request));
+    }
+    // อื่น ๆ (SSE /stream, ดาวน์โหลด, รูปต้นฉบับ, debug) ไปที่เครือข่ายตามปกติ
+});
@@ -0,0 +1,182 @@
+// คิวอัปโหลดเบื้องหลังที่เก็บรูปไว้ใน IndexedDB (ไม่หายเมื่อรีโหลดหน้าหรือเน็ตหลุด)
+// ส่งพร้อมกันไม่เกิน CONCURRENCY ไฟล์ ผ่าน ChunkedUpload และลองใหม่แบบ backoff เมื่อเน็ตหลุด
+// ไฟล์ที่เซิร์ฟเวอร์ปฏิเสธ (error.fatal เช่น 400/413/507) หรือถ่ายไว้ใน session อื่น ถูกพักไว้ให้ผู้ใช้ลองใหม่หรือทิ้ง
+(function () {
+    const DB_NAME = 'omr-upload-queue';
+    const STORE_NAME = 'files';
+    const CONCURRENCY = 2;
+    const MAX_BACKOFF = 60 * 1000;
+
+    let dbPromise = null;
+    let active = 0;
+    let uploaded = 0;
+    let retryTimer = null;
+    let sessionId = null;  // session ล่าสุดที่เซิร์ฟเวอร์ตอบ (ใช้ค่าเดิมเมื่อออฟไลน์)
+    const inFlight = new Set();
+    const listeners = [];
+
+    function openDb() {
+        if (!dbPromise) {
+            dbPromise = new Promise((resolve, reject) => {
+                const request = indexedDB.open(DB_NAME, 1);
+                request.onupgradeneeded = () => {
+                    request.result.createObjectStore(STORE_NAME, { keyPath: 'id', autoIncrement: true });
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        }
+        return dbPromise;
+    }
+
+    async function withStore(mode, action) {
+        const db = await openDb();
+        return new Promise((resolve, reject) => {
+            const transaction = db.transaction(STORE_NAME, mode);
+            const request = action(transaction.objectStore(STORE_NAME));
+            transaction.oncomplete = () => resolve(request.result);
+            transaction.onerror = () => reject(transaction.error);
+        });
+    }
+
+    const getAll = () => withStore('readonly', store => store.getAll());
+    const putItem = item => withStore('readwrite', store => store.put(item));
+    const removeItem = id => withStore('readwrite', store => store.delete(id));
+
+    // session ปัจจุบันของเบราว์เซอร์นี้ (null ถ้าไม่มี session)
+    async function currentSession() {
+        try {
+            const response = await fetch('/get_session_info');
+            const data = await response.json();
+            sessionId = data.has_session ? data.session_id_full : null;
+        } catch (error) { /* ออฟไลน์: ใช้ค่าเดิม */ }
+        return sessionId;
+    }
+
+    async function park(item, reason) {
+        item.parked = true;
+        item.lastError = reason;
+        await putItem(item);
+    }
+
+    async function notify() {
+        const items = await getAll();
+        const waiting = items.filter(item => !item.parked);
+        const parked = items.filter(item => item.parked);
+        const status = {
+            pending: waiting.length,
+            uploading: active,
+            uploaded,
+            lastError: waiting.map(item => item.lastError).filter(Boolean).pop() || null,
+            parked: parked.length,
+            parkedError: parked.map(item => item.lastError).filter(Boolean).pop() || null
+        };
+        listeners.forEach(listener => listener(status));
+    }
+
+    async function send(item) {
+        try {
+            // lastModified คงที่ ทำให้ ChunkedUpload ส่งต่อจากจุดเดิมได้หลังรีโหลดหน้า
+            const file = new File([item.blob], item.name, { type: item.blob.type, lastModified: item.created });
+            await ChunkedUpload.upload(file);
+            await removeItem(item.id);
+            uploaded++;
+        } catch (error) {
+            console.warn(`Queued upload ${item.name} failed:`, error);
+            if (error.fatal) {
+                // ส่งซ้ำก็ได้ผลเดิม (และเป็นการอัปโหลดใหม่ทุกครั้ง): พักไว้ให้ผู้ใช้ตัดสินใจ
+                await park(item, error.message);
+                return;
+            }
+            item.attempts += 1;
+            item.nextAttempt = Date.now() + Math.min(1000 * 2 ** item.attempts, MAX_BACKOFF);
+            item.lastError = error.message;
+            await putItem(item);
+        }
+    }
+
+    async function pump() {
+        const session = await currentSession();
+        let items = await getAll();
+        // รูปที่ถ่ายใน session อื่น (session หมดอายุหรือเริ่มใหม่): ไม่ส่งเข้า session ปัจจุบัน
+        for (const item of items) {
+            if (!item.parked && !inFlight.has(item.id) && session && item.sessionId !== session) {
+                await park(item, 'รูปนี้ถ่ายไว้ใน session อื่น');
+            }
+        }
+        items = items.filter(item => !item.parked);
+        const now = Date.now();
+        for (const item of items) {
+            if (active >= CONCURRENCY) break;
+            if (inFlight.has(item.id) || item.nextAttempt > now) continue;
+            inFlight.add(item.id);
+            active++;
+            send(item).finally(() => {
+                inFlight.delete(item.id);
+                active--;
+                notify();
+                pump();
+            });
+        }
+
+        // ตั้งเวลาลองใหม่สำหรับไฟล์ที่ยังอยู่ในช่วง backoff
+        clearTimeout(retryTimer);
+        const waiting = items.filter(item => !inFlight.has(item.id) && item.nextAttempt > now);
+        if (waiting.length > 0) {
+            const nextAttempt = Math.min(...waiting.map(item => item.nextAttempt));
+            retryTimer = setTimeout(pump, nextAttempt - now);
+        }
+        notify();
+    }
+
+    async function add(blob, name) {
+        const session = await currentSession();
+        await putItem({
+            blob, name, sessionId: session, created: Date.now(),
+            attempts: 0, nextAttempt: 0, lastError: null, parked: false
+        });
+        pump();
+    }
+
+    // กลับมาออนไลน์: ไม่ต้องรอ backoff ที่เหลือ (ไฟล์ที่ถูกพักไว้ต้องให้ผู้ใช้กดส่งใหม่เอง)
+    async function retryNow() {
+        const items = await getAll();
+        await Promise.all(
+            items.filter(item => !item.parked && !inFlight.has(item.id)).map(item => putItem({ ...item, nextAttempt: 0 }))
+        );
+        pump();
+    }
+
+    // ส่งไฟล์ที่ถูกพักไว้อีกครั้ง (เช่น หลังลบรูปเพื่อคืนพื้นที่) เข้า session ปัจจุบัน
+    async function retryParked() {
+        const session = await currentSession();
+        const items = await getAll();
+        await Promise.all(items.filter(item => item.parked).map(item => putItem({
+            ...item, sessionId: session, parked: false, attempts: 0, nextAttempt: 0, lastError: null
+        })));
+        pump();
+    }
+
+    async function discardParked() {
+        const items = await getAll();
+        await Promise.all(items.filter(item => item.parked).map(item => removeItem(item.id)));
+        notify();
+    }
+
+    function onChange(listener) {
+        listeners.push(listener);
+        notify();
+    }
+
+    function isSupported() {
+        return typeof indexedDB !== 'undefined';
+    }
+
+    // ส่งไฟล์ที่ค้างจากครั้งก่อน และส่งทันทีเมื่อกลับมาออนไลน์
+    if (isSupported()) {
+        window.addEventListener('online', retryNow);
+        pump().catch(error => console.warn('Upload queue unavailable:', error));
+    }
+
+    window.UploadQueue = { add, onChange, pump, retryParked, discardParked, isSupported };
+})();